@@ -4,6 +4,12 @@ from permissions.exceptions import Unauthorized
 
 class PermissionBase(object):
     """Mix-in class for permissions.
+
+    Models whose objects inherit permissions from other objects provide
+    ``get_parent_for_permissions()``, which returns the parent of the object
+    (or None). To resolve the ancestors of many objects at once they may also
+    provide a classmethod ``get_parents_for_permissions(objs)``, which returns
+    the parents of all passed objects in the same order.
     """
     def grant_permission(self, role, permission):
         """Grants passed permission to passed role. Returns True if the
@@ -54,8 +60,31 @@ class PermissionBase(object):
         """
         if roles is None:
             roles = []
+
+        # Answered from the results of permissions.utils.prefetch_permissions
+        prefetched = getattr(self, "_prefetched_perms", None)
+        if not roles and prefetched is not None:
+            principal_key, codenames = prefetched
+            if principal_key == permissions.utils._get_principal_key(user) and permission in codenames:
+                return permission in self._allowed_perms
+
         return permissions.utils.has_permission(self, user, permission, roles)
 
+    def get_permissions(self, user, roles=None):
+        """Returns the codenames of all permissions the passed user has for
+        this instance as a set.
+
+        **Parameters:**
+
+        user
+            The user for which the permissions should be returned.
+
+        roles
+            If passed, these roles will be assigned to the user temporarily
+            before the permissions are checked.
+        """
+        return permissions.utils.get_permissions(self, user, roles)
+
     def check_permission(self, user, permission, roles=None):
         """Raise Unauthorized if the the passed user hasn't passed permission 
         for this instance.
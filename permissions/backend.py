@@ -1,4 +1,5 @@
 # permissions imports
+import permissions.catalog
 import permissions.utils
 
 class ObjectPermissionsBackend(object):
@@ -49,4 +50,79 @@ class ObjectPermissionsBackend(object):
         obj
             The object for which the permission should be checked.
         """
-        return permissions.utils.has_permission(obj, actor_obj, perm)
\ No newline at end of file
+        return permissions.utils.has_permission(obj, actor_obj, perm)
+
+    def get_granted_perms(self, actor_obj, perm_list, obj=None):
+        """Returns the ones of the passed permissions which the passed actor
+        has for the passed object (obj) as a set. All permissions are
+        evaluated at once.
+
+        Parameters
+        ==========
+
+        actor_obj
+            The actor for which the permissions should be checked.
+
+        perm_list
+            The permissions' codenames which should be checked.
+
+        obj
+            The object for which the permissions should be checked.
+        """
+        if obj is None:
+            return set()
+
+        mask = permissions.utils.get_permission_mask(obj, actor_obj)
+        return set([perm for perm in perm_list
+            if mask & permissions.utils.get_permission_bit(perm)])
+
+    def get_all_permissions(self, actor_obj, obj=None):
+        """Returns the codenames of the permissions of the passed actor as a
+        set. If an object is passed these are the permissions the actor has
+        for it, otherwise the permissions which the actor may have for any
+        object (see ``permissions.utils.get_granted_permission_ids``).
+
+        Parameters
+        ==========
+
+        actor_obj
+            The actor for which the permissions should be returned.
+
+        obj
+            The object for which the permissions should be returned.
+        """
+        if obj is not None:
+            return permissions.utils.get_permissions(obj, actor_obj)
+        return permissions.catalog.get_codenames(self._get_all_permission_ids(actor_obj))
+
+    def has_module_perms(self, actor_obj, app_label):
+        """Returns True if one of the actor's roles is granted a permission
+        which is active for a content type of the passed app.
+
+        Parameters
+        ==========
+
+        actor_obj
+            The actor for which the permissions should be checked.
+
+        app_label
+            The label of the app.
+        """
+        app_permission_ids = permissions.catalog.get_app_permission_ids(app_label)
+        if not app_permission_ids:
+            return False
+        return bool(self._get_all_permission_ids(actor_obj) & app_permission_ids)
+
+    def _get_all_permission_ids(self, actor_obj):
+        """Returns the ids of the permissions which the passed actor may have
+        for any object. They are cached on the actor and within the
+        permission cache.
+        """
+        if not hasattr(actor_obj, "_permissions_all_perm_cache"):
+            cached = permissions.utils._get_cached_result(actor_obj, "all_permissions")
+            ids = cached.get()
+            if ids is None:
+                ids = permissions.utils.get_granted_permission_ids(actor_obj)
+                cached.set(list(ids))
+            actor_obj._permissions_all_perm_cache = set(ids)
+        return actor_obj._permissions_all_perm_cache
@@ -0,0 +1,19 @@
+"""Benchmarks for django-permissions.
+
+Add ``permissions.bench`` to ``INSTALLED_APPS`` (next to ``permissions``) and
+run ``manage.py syncdb`` to get the model of the synthetic hierarchy. Then::
+
+    $ django-admin permissions_bench --actors 500 --depth 5 --fanout 4
+
+generates an organisation, measures the permission operations on it and
+rolls everything back afterwards. ::
+
+    $ django-admin permissions_load --workers 8 --write-ratio 0.2
+
+runs checks interleaved with writes from several threads (or processes with
+``--processes``) against a SQLite file or PostgreSQL database and reports
+throughput, latency percentiles and lock errors.
+
+Both commands accept ``--keep`` to keep the generated data for inspection.
+Kept data is removed by the next run before it generates its own.
+"""
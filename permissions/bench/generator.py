@@ -0,0 +1,151 @@
+# python imports
+import random
+
+# django imports
+from django.contrib.contenttypes.models import ContentType
+
+# permissions imports
+from permissions.bench.models import BenchNode
+from permissions.models import Actor
+from permissions.models import ActorGroup
+from permissions.models import ObjectPermission
+from permissions.models import ObjectPermissionInheritanceBlock
+from permissions.models import Permission
+from permissions.models import PermissionAncestor
+from permissions.models import PrincipalRoleRelation
+from permissions.models import Role
+from permissions.utils import add_inheritance_block
+from permissions.utils import add_local_role
+from permissions.utils import add_role
+from permissions.utils import grant_permission
+from permissions.utils import register_permission
+from permissions.utils import register_role
+
+class Organisation(object):
+    """The generated data of a synthetic organisation.
+
+    **Attributes:**
+
+    actors, groups, roles, codenames
+        The generated actors, groups, roles and permission codenames.
+
+    nodes
+        All nodes of the hierarchy, level by level starting with the root.
+
+    leaves
+        The nodes of the deepest level.
+    """
+    def __init__(self):
+        self.actors = []
+        self.groups = []
+        self.roles = []
+        self.codenames = []
+        self.nodes = []
+        self.leaves = []
+
+def generate(actors=100, groups=10, roles=5, permissions=5, depth=4, fanout=4,
+             memberships=2, roles_per_actor=2, local_ratio=0.5,
+             grant_ratio=0.2, block_ratio=0.05, seed=0):
+    """Generates a synthetic organisation and returns it. Data of a former run
+    which has been kept (``--keep``) is removed first (see ``remove``), as the
+    generated names would clash otherwise.
+
+    **Parameters:**
+
+    actors, groups, roles, permissions
+        The number of actors, groups, roles and permissions.
+
+    depth, fanout
+        The number of levels below the root of the hierarchy and the number of
+        children of each node.
+
+    memberships
+        The number of groups each actor is a member of.
+
+    roles_per_actor
+        The number of roles assigned to each actor (and to each group).
+
+    local_ratio
+        The share of role assignments which are local to a random node instead
+        of global.
+
+    grant_ratio, block_ratio
+        The share of nodes which get an additional grant and an inheritance
+        block for a random permission.
+
+    seed
+        The seed of the random generator, which makes data sets reproducible.
+    """
+    remove()
+
+    rnd = random.Random(seed)
+    org = Organisation()
+
+    for i in range(roles):
+        org.roles.append(register_role("bench-role-%s" % i))
+
+    for i in range(permissions):
+        codename = "bench_%s" % i
+        register_permission("Bench %s" % i, codename)
+        org.codenames.append(codename)
+
+    for i in range(groups):
+        org.groups.append(ActorGroup.objects.create(name="bench-group-%s" % i))
+
+    # The hierarchy
+    level = [BenchNode.objects.create(name="bench-0")]
+    org.nodes.extend(level)
+    for d in range(depth):
+        children = []
+        for parent in level:
+            for i in range(fanout):
+                children.append(BenchNode.objects.create(
+                    name="%s-%s" % (parent.name, i), parent=parent))
+        org.nodes.extend(children)
+        level = children
+    org.leaves = level
+
+    # Grants and inheritance blocks
+    root = org.nodes[0]
+    for role in org.roles:
+        for codename in org.codenames:
+            if rnd.random() < 0.5:
+                grant_permission(root, role, codename)
+
+    for node in org.nodes[1:]:
+        if rnd.random() < grant_ratio:
+            grant_permission(node, rnd.choice(org.roles), rnd.choice(org.codenames))
+        if rnd.random() < block_ratio:
+            add_inheritance_block(node, rnd.choice(org.codenames))
+
+    # Principals
+    for i in range(actors):
+        actor = Actor.objects.create(name="bench-actor-%s" % i)
+        if org.groups:
+            for group in rnd.sample(org.groups, min(memberships, len(org.groups))):
+                actor.groups.add(group)
+        org.actors.append(actor)
+
+    for principal in org.actors + org.groups:
+        for i in range(roles_per_actor):
+            role = rnd.choice(org.roles)
+            if rnd.random() < local_ratio:
+                add_local_role(rnd.choice(org.nodes), principal, role)
+            else:
+                add_role(principal, role)
+
+    return org
+
+def remove():
+    """Removes all data generated by ``generate``.
+    """
+    ctype = ContentType.objects.get_for_model(BenchNode)
+    for model in (ObjectPermission, ObjectPermissionInheritanceBlock,
+                  PrincipalRoleRelation, PermissionAncestor):
+        model.objects.filter(content_type=ctype).delete()
+
+    BenchNode.objects.all().delete()
+    Actor.objects.filter(name__startswith="bench-actor-").delete()
+    ActorGroup.objects.filter(name__startswith="bench-group-").delete()
+    Role.objects.filter(name__startswith="bench-role-").delete()
+    Permission.objects.filter(codename__startswith="bench_").delete()
@@ -0,0 +1,184 @@
+"""A load generator which runs permission checks interleaved with writes from
+several threads or processes at once.
+
+The workers use their own database connections, so the data must be
+committed and the database must be shared between connections, e.g. a SQLite
+file or a PostgreSQL database (an in-memory SQLite database is not).
+"""
+# python imports
+from multiprocessing.pool import Pool
+from multiprocessing.pool import ThreadPool
+import random
+import time
+
+# django imports
+from django.db import connection
+from django.db import transaction
+from django.db.utils import DatabaseError
+from django.db.utils import IntegrityError
+
+# permissions imports
+from permissions.bench.models import BenchNode
+from permissions.bench.runner import percentile
+from permissions.models import Actor
+from permissions.models import Role
+from permissions.utils import add_local_role
+from permissions.utils import grant_permission
+from permissions.utils import has_permission
+
+def get_ids(org):
+    """Returns the ids of the actors, nodes and roles and the codenames of
+    passed organisation, which is what is handed over to the workers.
+    """
+    return {
+        "actors": [actor.id for actor in org.actors],
+        "nodes": [node.id for node in org.nodes],
+        "leaves": [node.id for node in org.leaves],
+        "roles": [role.id for role in org.roles],
+        "codenames": list(org.codenames),
+    }
+
+def work(ids, operations=200, write_ratio=0.1, seed=0):
+    """Runs passed number of operations on the current database connection
+    and returns a dict with the latencies (in ms) of the reads and the writes
+    and the number of errors per kind.
+
+    **Parameters:**
+
+    ids
+        The data to work on, see ``get_ids``.
+
+    write_ratio
+        The share of operations which are writes (``add_local_role`` or
+        ``grant_permission``). The others are reads (``has_permission`` or
+        ``Actor.has_perm``).
+
+    seed
+        The seed of the random generator of the worker.
+    """
+    rnd = random.Random(seed)
+    actors = list(Actor.objects.filter(pk__in=ids["actors"]))
+    nodes = BenchNode.objects.in_bulk(ids["nodes"])
+    leaves = [nodes[id] for id in ids["leaves"]]
+    nodes = nodes.values()
+    roles = list(Role.objects.filter(pk__in=ids["roles"]))
+    codenames = ids["codenames"]
+
+    result = {"reads": [], "writes": [], "errors": {"lock": 0, "integrity": 0, "other": 0}}
+    for i in range(operations):
+        write = rnd.random() < write_ratio
+        kind = rnd.randint(0, 1)
+        start = time.time()
+        try:
+            if write and kind:
+                add_local_role(rnd.choice(nodes), rnd.choice(actors), rnd.choice(roles))
+            elif write:
+                grant_permission(rnd.choice(nodes), rnd.choice(roles), rnd.choice(codenames))
+            elif kind:
+                has_permission(rnd.choice(leaves), rnd.choice(actors), rnd.choice(codenames))
+            else:
+                rnd.choice(actors).has_perm(rnd.choice(codenames), rnd.choice(leaves))
+        except IntegrityError:
+            result["errors"]["integrity"] += 1
+            transaction.rollback_unless_managed()
+        except DatabaseError, e:
+            result["errors"][_get_error_kind(e)] += 1
+            transaction.rollback_unless_managed()
+        else:
+            result[write and "writes" or "reads"].append((time.time() - start) * 1000)
+    return result
+
+def run_load(org, workers=4, operations=200, write_ratio=0.1, processes=False, seed=0):
+    """Runs ``work`` within passed number of threads (or processes) at once
+    and returns the summary of the results, see ``summarize``.
+
+    **Parameters:**
+
+    org
+        The organisation to work on. Its data must be committed.
+
+    workers
+        The number of threads or processes.
+
+    operations
+        The number of operations of each worker.
+
+    processes
+        If True the workers are processes, otherwise threads.
+    """
+    args = [(get_ids(org), operations, write_ratio, seed + i) for i in range(workers)]
+    if processes:
+        # The forked processes must not share the connection of the parent.
+        connection.close()
+        pool = Pool(workers)
+    else:
+        pool = ThreadPool(workers)
+
+    start = time.time()
+    try:
+        results = pool.map(_work_and_close, args)
+    finally:
+        pool.close()
+        pool.join()
+    return summarize(results, time.time() - start)
+
+def summarize(results, elapsed):
+    """Returns a dict with the throughput (operations per second), the
+    latency percentiles of reads, writes and all operations and the summed up
+    errors of passed results of ``work``.
+    """
+    summary = {"elapsed": elapsed, "errors": {}}
+    latencies = {"reads": [], "writes": []}
+    for result in results:
+        for key in latencies:
+            latencies[key].extend(result[key])
+        for kind, count in result["errors"].items():
+            summary["errors"][kind] = summary["errors"].get(kind, 0) + count
+
+    latencies["all"] = latencies["reads"] + latencies["writes"]
+    for key, values in latencies.items():
+        values.sort()
+        summary[key] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+
+    total = len(latencies["all"]) + sum(summary["errors"].values())
+    summary["throughput"] = elapsed and total / elapsed or 0.0
+    return summary
+
+def format_summary(summary):
+    """Returns passed summary as a table.
+    """
+    lines = ["%-10s %9s %9s %9s %9s" % ("operation", "count", "p50 ms", "p95 ms", "p99 ms")]
+    for key in ("reads", "writes", "all"):
+        stats = summary[key]
+        lines.append("%-10s %9s %9.3f %9.3f %9.3f" % (
+            key, stats["count"], stats["p50"], stats["p95"], stats["p99"]))
+
+    lines.append("")
+    lines.append("throughput: %.1f operations/s in %.2fs" % (summary["throughput"], summary["elapsed"]))
+    lines.append("errors: %s" % ", ".join(["%s %s" % (kind, count)
+        for kind, count in sorted(summary["errors"].items())]))
+    return "\n".join(lines)
+
+def _get_error_kind(error):
+    """Returns "lock" if passed database error is caused by a lock or a
+    serialization conflict, otherwise "other".
+    """
+    message = str(error).lower()
+    for part in ("lock", "could not serialize"):
+        if part in message:
+            return "lock"
+    return "other"
+
+def _work_and_close(args):
+    """Runs ``work`` with passed arguments and closes the connection of the
+    thread or process afterwards.
+    """
+    try:
+        return work(*args)
+    finally:
+        connection.close()
@@ -0,0 +1,65 @@
+# python imports
+from optparse import make_option
+import time
+
+# django imports
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db import transaction
+
+# permissions imports
+from permissions.bench import generator
+from permissions.bench import runner
+
+class Command(NoArgsCommand):
+    help = ("Generates a synthetic organisation and reports latency percentiles "
+            "and query counts of the permission operations on it.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--actors", type="int", dest="actors", default=100),
+        make_option("--groups", type="int", dest="groups", default=10),
+        make_option("--roles", type="int", dest="roles", default=5),
+        make_option("--permissions", type="int", dest="permissions", default=5),
+        make_option("--depth", type="int", dest="depth", default=4,
+            help="Number of levels below the root of the hierarchy."),
+        make_option("--fanout", type="int", dest="fanout", default=4,
+            help="Number of children of each node."),
+        make_option("--local-ratio", type="float", dest="local_ratio", default=0.5,
+            help="Share of role assignments which are local."),
+        make_option("--iterations", type="int", dest="iterations", default=200),
+        make_option("--seed", type="int", dest="seed", default=0),
+        make_option("--collapse-ancestors", action="store_true", dest="collapse_ancestors", default=False,
+            help="Sets PERMISSIONS_COLLAPSE_ANCESTORS."),
+        make_option("--role-index", action="store_true", dest="role_index", default=False,
+            help="Sets PERMISSIONS_ROLE_INDEX (the index is built for the generated data)."),
+        make_option("--keep", action="store_true", dest="keep", default=False,
+            help="Commit the generated data instead of rolling it back. It is replaced by the next run."),
+    )
+
+    def handle_noargs(self, **options):
+        if options["collapse_ancestors"]:
+            settings.PERMISSIONS_COLLAPSE_ANCESTORS = True
+        if options["role_index"]:
+            settings.PERMISSIONS_ROLE_INDEX = True
+
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            start = time.time()
+            org = generator.generate(
+                actors=options["actors"], groups=options["groups"], roles=options["roles"],
+                permissions=options["permissions"], depth=options["depth"], fanout=options["fanout"],
+                local_ratio=options["local_ratio"], seed=options["seed"])
+            self.stdout.write("Generated %s actors, %s groups, %s roles and %s nodes in %.1fs on %s\n\n" % (
+                len(org.actors), len(org.groups), len(org.roles), len(org.nodes),
+                time.time() - start, connection.vendor))
+
+            results = runner.run(org, options["iterations"], options["seed"])
+            self.stdout.write(runner.format_results(results) + "\n")
+        finally:
+            if options["keep"]:
+                transaction.commit()
+            else:
+                transaction.rollback()
+            transaction.leave_transaction_management()
@@ -0,0 +1,53 @@
+# python imports
+from optparse import make_option
+
+# django imports
+from django.core.management.base import CommandError
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db import transaction
+
+# permissions imports
+from permissions.bench import generator
+from permissions.bench import load
+
+class Command(NoArgsCommand):
+    help = ("Generates a synthetic organisation and runs permission checks "
+            "interleaved with writes from several threads or processes at once.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--actors", type="int", dest="actors", default=100),
+        make_option("--depth", type="int", dest="depth", default=3),
+        make_option("--fanout", type="int", dest="fanout", default=4),
+        make_option("--workers", type="int", dest="workers", default=4),
+        make_option("--operations", type="int", dest="operations", default=200,
+            help="Number of operations of each worker."),
+        make_option("--write-ratio", type="float", dest="write_ratio", default=0.1,
+            help="Share of operations which are writes."),
+        make_option("--processes", action="store_true", dest="processes", default=False,
+            help="Use processes instead of threads."),
+        make_option("--seed", type="int", dest="seed", default=0),
+        make_option("--keep", action="store_true", dest="keep", default=False,
+            help="Keep the generated data instead of removing it. It is replaced by the next run."),
+    )
+
+    def handle_noargs(self, **options):
+        if connection.vendor == "sqlite" and connection.settings_dict["NAME"] in ("", ":memory:"):
+            raise CommandError("The load test needs a database which is shared "
+                               "between connections, e.g. a SQLite file.")
+
+        generate = transaction.commit_on_success(generator.generate)
+        org = generate(actors=options["actors"], depth=options["depth"],
+            fanout=options["fanout"], seed=options["seed"])
+        try:
+            self.stdout.write("Running %s %s with %s operations each on %s\n\n" % (
+                options["workers"], options["processes"] and "processes" or "threads",
+                options["operations"], connection.vendor))
+
+            summary = load.run_load(org, workers=options["workers"],
+                operations=options["operations"], write_ratio=options["write_ratio"],
+                processes=options["processes"], seed=options["seed"])
+            self.stdout.write(load.format_summary(summary) + "\n")
+        finally:
+            if not options["keep"]:
+                transaction.commit_on_success(generator.remove)()
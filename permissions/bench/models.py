@@ -0,0 +1,37 @@
+# django imports
+from django.db import models
+
+# permissions imports
+import permissions.hierarchy
+from permissions import PermissionBase
+
+class BenchNode(models.Model, PermissionBase):
+    """A node of the synthetic hierarchy of the benchmarks, e.g. a location or
+    a case.
+
+    **Attributes:**
+
+    name
+        The name of the node.
+
+    parent
+        The parent node, from which permissions are inherited.
+    """
+    name = models.CharField(max_length=100)
+    parent = models.ForeignKey("self", blank=True, null=True, related_name="children")
+
+    def __unicode__(self):
+        return self.name
+
+    def get_parent_for_permissions(self):
+        return self.parent
+
+    def get_children_for_permissions(self):
+        return self.children.all()
+
+    @classmethod
+    def get_parents_for_permissions(cls, objs):
+        parents = cls.objects.in_bulk(set([obj.parent_id for obj in objs if obj.parent_id]))
+        return [parents.get(obj.parent_id) for obj in objs]
+
+permissions.hierarchy.register(BenchNode)
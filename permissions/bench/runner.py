@@ -0,0 +1,102 @@
+# python imports
+import random
+import time
+
+# django imports
+from django.conf import settings
+from django.db import connection
+from django.db import reset_queries
+
+# permissions imports
+import permissions.utils
+from permissions.backend import ObjectPermissionsBackend
+from permissions.bench.models import BenchNode
+
+def percentile(values, p):
+    """Returns the p-th percentile of passed sorted values.
+    """
+    if not values:
+        return 0.0
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+def measure(operation, iterations):
+    """Calls passed operation with the iteration number as often as passed
+    and returns a dict with the latency percentiles (in ms) and the mean
+    number of queries per call.
+    """
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        latencies = []
+        queries = 0
+        for i in range(iterations):
+            reset_queries()
+            start = time.time()
+            operation(i)
+            latencies.append((time.time() - start) * 1000)
+            queries += len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+        reset_queries()
+
+    latencies.sort()
+    return {
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / max(len(latencies), 1),
+        "queries": float(queries) / max(iterations, 1),
+    }
+
+def get_operations(org, seed=0):
+    """Returns the benchmarked operations on passed organisation as a list of
+    (name, operation) tuples. Each operation picks its arguments from a
+    reproducible random sequence.
+    """
+    rnd = random.Random(seed)
+    backend = ObjectPermissionsBackend()
+
+    def pick(items):
+        return items[rnd.randint(0, len(items) - 1)]
+
+    def has_permission(i):
+        permissions.utils.has_permission(pick(org.leaves), pick(org.actors), pick(org.codenames))
+
+    def get_roles(i):
+        list(permissions.utils.get_roles(pick(org.actors), pick(org.leaves)))
+
+    def get_actors(i):
+        pick(org.roles).get_actors(pick(org.nodes))
+
+    def backend_has_perm(i):
+        backend.has_perm(pick(org.actors), pick(org.codenames), pick(org.leaves))
+
+    def filter_permitted(i):
+        list(permissions.utils.filter_permitted(
+            BenchNode.objects.filter(pk__in=[node.id for node in org.leaves[:50]]),
+            pick(org.actors), pick(org.codenames)))
+
+    return [
+        ("has_permission", has_permission),
+        ("get_roles", get_roles),
+        ("Role.get_actors", get_actors),
+        ("backend.has_perm", backend_has_perm),
+        ("filter_permitted (50)", filter_permitted),
+    ]
+
+def run(org, iterations=200, seed=0):
+    """Measures all operations on passed organisation. Returns a list of
+    (name, stats) tuples, see ``measure``.
+    """
+    return [(name, measure(operation, iterations))
+        for name, operation in get_operations(org, seed)]
+
+def format_results(results):
+    """Returns passed results as a table.
+    """
+    lines = ["%-24s %9s %9s %9s %9s %9s" % ("operation", "p50 ms", "p95 ms", "p99 ms", "mean ms", "queries")]
+    for name, stats in results:
+        lines.append("%-24s %9.3f %9.3f %9.3f %9.3f %9.1f" % (
+            name, stats["p50"], stats["p95"], stats["p99"], stats["mean"], stats["queries"]))
+    return "\n".join(lines)
@@ -0,0 +1,98 @@
+# django imports
+from django.test import TestCase
+
+# permissions imports
+import permissions.catalog
+import permissions.utils
+from permissions.models import Actor
+from permissions.bench import generator
+from permissions.bench import load
+from permissions.bench.models import BenchNode
+from permissions.bench import runner
+
+class BenchTestCase(TestCase):
+    """Tests the generator and the runner of the benchmarks.
+    """
+    def test_generate(self):
+        """
+        """
+        org = generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        self.assertEqual(len(org.actors), 5)
+        self.assertEqual(len(org.nodes), 7)
+        self.assertEqual(len(org.leaves), 4)
+        self.assertEqual(org.leaves[0].get_parent_for_permissions().get_parent_for_permissions(), org.nodes[0])
+
+    def test_run(self):
+        """
+        """
+        org = generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        results = runner.run(org, iterations=5)
+        self.assertEqual([name for name, stats in results][0], "has_permission")
+        for name, stats in results:
+            self.failUnless(stats["p50"] <= stats["p99"])
+            self.failUnless(stats["queries"] > 0)
+
+        self.failUnless("has_permission" in runner.format_results(results))
+
+    def test_load(self):
+        """
+        """
+        org = generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        result = load.work(load.get_ids(org), operations=20, write_ratio=0.5)
+        self.assertEqual(len(result["reads"]) + len(result["writes"]), 20)
+
+        summary = load.summarize([result, result], 2.0)
+        self.assertEqual(summary["all"]["count"], 40)
+        self.assertEqual(summary["throughput"], 20.0)
+        self.failUnless("throughput" in load.format_summary(summary))
+
+    def test_remove(self):
+        """
+        """
+        generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        generator.remove()
+        self.assertEqual(BenchNode.objects.count(), 0)
+
+    def test_generate_twice(self):
+        """
+        """
+        # Kept data of a former run is replaced
+        generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        org = generator.generate(actors=5, groups=2, roles=2, permissions=2, depth=2, fanout=2)
+        self.assertEqual(BenchNode.objects.count(), 7)
+        self.assertEqual(Actor.objects.filter(name__startswith="bench-actor-").count(), 5)
+        self.failIf(False in org.roles)
+
+class BenchNodeTestCase(TestCase):
+    """Tests the permissions of the benchmark model.
+    """
+    def setUp(self):
+        """
+        """
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.register_permission("Edit", "edit")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.root = BenchNode.objects.create(name="root")
+        for i in range(3):
+            BenchNode.objects.create(name="node-%s" % i, parent=self.root)
+        permissions.utils.grant_permission(self.root, self.role_1, "view")
+        self.nodes = BenchNode.objects.filter(parent=self.root).order_by("id")
+        permissions.utils.add_inheritance_block(self.nodes[2], "view")
+
+    def test_prefetch_permissions(self):
+        """
+        """
+        permissions.catalog.load()
+        nodes = permissions.utils.prefetch_permissions(self.nodes, self.actor, ["view", "edit"])
+        self.assertEqual([node._allowed_perms for node in nodes],
+            [frozenset(["view"]), frozenset(["view"]), frozenset()])
+        self.assertNumQueries(0, lambda: [node.has_permission(self.actor, "view") for node in nodes])
+
+    def test_filter_permitted(self):
+        """
+        """
+        result = permissions.utils.filter_permitted(BenchNode.objects.all(), self.actor, "view")
+        self.assertEqual(set(result), set([self.root, self.nodes[0], self.nodes[1]]))
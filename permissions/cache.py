@@ -0,0 +1,233 @@
+"""Caches for the results of permission checks.
+
+There are two levels of caching:
+
+The request scoped cache is bound to the current thread and only active
+between ``enable()`` and ``disable()``, which are called by
+``permissions.middleware.PermissionCacheMiddleware`` for every request. Outside
+of a request it can be used via the ``permission_cache`` context manager::
+
+    with permission_cache():
+        for obj in objs:
+            has_permission(obj, actor, "view")
+
+The shared cache is optional and stores results within a Django cache
+backend, so that they are shared between processes. It is enabled by setting
+``PERMISSIONS_CACHE_BACKEND`` to a cache alias or URI (e.g. ``"locmem://"``
+or ``"file:///var/tmp/permissions"``). Instead of deleting keys, changes bump
+generation counters which are part of every key: a global one and one per
+actor.
+
+Both caches are invalidated whenever permissions, roles, role relations,
+inheritance blocks or group memberships are changed (see
+``permissions.listeners``), and whenever objects are moved or removed within
+the closure table of ``permissions.hierarchy``. Changes within a managed
+transaction invalidate the shared cache again once the transaction has ended
+(see ``commit``). Moves of objects of models which are not registered within
+``permissions.hierarchy`` are not tracked, so results of the shared cache may
+be stale for ``PERMISSIONS_CACHE_TIMEOUT`` seconds after such an object got a
+new parent.
+"""
+# python imports
+import threading
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+# django imports
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import transaction
+
+GENERATION_KEY = "permissions:generation"
+ACTOR_GENERATION_KEY = "permissions:generation:actor:%s"
+
+_local = threading.local()
+_shared_caches = {}
+
+# Incremented by every invalidation within this process.
+_version = 0
+
+def enable():
+    """Enables an empty request scoped cache for the current thread.
+    """
+    _local.results = {}
+
+def disable():
+    """Disables and drops the request scoped cache of the current thread.
+    """
+    _local.results = None
+
+def is_enabled():
+    """Returns True if the request scoped cache is enabled for the current
+    thread.
+    """
+    return getattr(_local, "results", None) is not None
+
+def clear():
+    """Removes all results from the request scoped cache of the current
+    thread.
+    """
+    results = getattr(_local, "results", None)
+    if results is not None:
+        results.clear()
+
+def invalidate(actor_ids=None):
+    """Invalidates cached results. Clears the request scoped cache and bumps
+    the generation of passed actors within the shared cache. If no actors are
+    passed the global generation is bumped, which invalidates all results.
+
+    Within a managed transaction other processes may still read the data of
+    before the change and cache it under the bumped generations, hence these
+    are bumped again by ``commit()`` once the transaction has ended.
+    """
+    global _version
+    _version += 1
+    clear()
+
+    cache = get_shared_cache()
+    if cache is None:
+        return
+
+    if actor_ids is None:
+        keys = [GENERATION_KEY]
+    else:
+        keys = [ACTOR_GENERATION_KEY % actor_id for actor_id in actor_ids]
+
+    _bump(cache, keys)
+
+    if transaction.is_managed():
+        pending = getattr(_local, "pending", None)
+        if pending is None:
+            pending = _local.pending = set()
+        pending.update(keys)
+
+def get_version():
+    """Returns a number which changes with every invalidation within this
+    process. Data derived from cached results may compare it to tell whether
+    it is outdated.
+    """
+    return _version
+
+def commit():
+    """Bumps the generations which have been invalidated within a managed
+    transaction of the current thread again. Call it after the transaction
+    has been committed or rolled back. ``PermissionCacheMiddleware`` and the
+    ``permission_cache`` context manager call it when they end.
+    """
+    pending = getattr(_local, "pending", None)
+    _local.pending = None
+    if not pending:
+        return
+
+    cache = get_shared_cache()
+    if cache is not None:
+        _bump(cache, pending)
+
+def _bump(cache, keys):
+    """Increments the passed generation counters.
+    """
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _get_initial_generation())
+
+def get_shared_cache():
+    """Returns the cache backend of the shared cache or None if it isn't
+    configured.
+    """
+    backend = getattr(settings, "PERMISSIONS_CACHE_BACKEND", None)
+    if not backend:
+        return None
+
+    try:
+        return _shared_caches[backend]
+    except KeyError:
+        cache = _shared_caches[backend] = get_cache(backend)
+        return cache
+
+def _get_initial_generation():
+    """Returns the value of a new (or evicted) generation counter. It must not
+    repeat a value an evicted counter might have had.
+    """
+    return int(time.time() * 1000000)
+
+def _get_generations(cache, actor_id):
+    """Returns the global generation and the generation of passed actor.
+    """
+    keys = [GENERATION_KEY, ACTOR_GENERATION_KEY % actor_id]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, _get_initial_generation())
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+class CachedResult(object):
+    """A cacheable result for the passed principal. The remaining parts
+    identify the result.
+
+    The key within the shared cache is determined on first access, so a result
+    which has been computed while the data changed is stored under the
+    outdated generation. Results which are set while ``shared`` is False are
+    kept within the request scoped cache only.
+    """
+    shared = True
+
+    def __init__(self, principal_id, *parts):
+        self.principal_id = principal_id
+        self.key = (principal_id, ) + parts
+        self.shared_key = None
+
+    def get(self):
+        """Returns the cached result or None.
+        """
+        results = getattr(_local, "results", None)
+        if results is not None and self.key in results:
+            return results[self.key]
+
+        cache = get_shared_cache()
+        if cache is None:
+            return None
+
+        result = cache.get(self._get_shared_key(cache))
+        if result is not None and results is not None:
+            results[self.key] = result
+        return result
+
+    def set(self, result):
+        """Caches passed result.
+        """
+        results = getattr(_local, "results", None)
+        if results is not None:
+            results[self.key] = result
+
+        cache = get_shared_cache()
+        if cache is not None and self.shared:
+            timeout = getattr(settings, "PERMISSIONS_CACHE_TIMEOUT", None)
+            cache.set(self._get_shared_key(cache), result, timeout)
+
+    def _get_shared_key(self, cache):
+        if self.shared_key is None:
+            generations = _get_generations(cache, self.principal_id)
+            key = u":".join([u"%s" % part for part in generations + list(self.key)])
+            self.shared_key = "permissions:%s" % md5(key.encode("utf-8")).hexdigest()
+        return self.shared_key
+
+class permission_cache(object):
+    """Context manager which enables the request scoped cache for the enclosed
+    block. Nested blocks share the cache of the outermost block.
+    """
+    def __enter__(self):
+        self.enabled = not is_enabled()
+        if self.enabled:
+            enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            disable()
+            commit()
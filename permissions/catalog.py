@@ -0,0 +1,139 @@
+"""An in-process catalog of the ids of permissions, roles and groups by their
+codenames and names.
+
+The catalog is loaded with one query per model on first use. Names which are
+not within the catalog are looked up within the database, so objects created
+by other processes are found. Whenever a permission, role or group is saved or
+deleted, which includes ``register_permission``, ``register_role``,
+``register_group`` and their ``unregister_*`` counterparts, the signal
+handlers within ``permissions.listeners`` drop its entries. They are read
+again from the database on next use, so entries of saves which are rolled back
+later never get into the catalog. Call ``clear`` if objects are renamed or
+deleted by other processes.
+"""
+# permissions imports
+from permissions.models import ActorGroup
+from permissions.models import Permission
+from permissions.models import Role
+
+# Maps each model to the field whose values are catalogued.
+FIELDS = {
+    Permission: "codename",
+    Role: "name",
+    ActorGroup: "name",
+}
+
+# The key of the index of permission ids by app label.
+APPS = "apps"
+
+_catalog = {}
+
+def get_permission_id(codename):
+    """Returns the id of the permission with passed codename or None.
+    """
+    return _get_id(Permission, codename)
+
+def get_role_id(name):
+    """Returns the id of the role with passed name or None.
+    """
+    return _get_id(Role, name)
+
+def get_group_id(name):
+    """Returns the id of the group with passed name or None.
+    """
+    return _get_id(ActorGroup, name)
+
+def get_codenames(permission_ids):
+    """Returns the codenames of the permissions with passed ids as a set. Ids
+    of deleted permissions are skipped.
+    """
+    if Permission not in _catalog:
+        load()
+
+    codenames = set()
+    missing = set(permission_ids)
+    for codename, id in _catalog[Permission].items():
+        if id in missing:
+            codenames.add(codename)
+            missing.remove(id)
+
+    if missing:
+        for codename, id in Permission.objects.filter(pk__in=missing).values_list("codename", "id"):
+            _catalog[Permission][codename] = id
+            codenames.add(codename)
+    return codenames
+
+def get_app_permission_ids(app_label):
+    """Returns the ids of the permissions which are active for a content type
+    of the app with passed label (see ``Permission.content_types``) as a set.
+    """
+    if APPS not in _catalog:
+        apps = {}
+        for permission_id, app_label in Permission.content_types.through.objects.values_list(
+            "permission", "contenttype__app_label"):
+            apps.setdefault(app_label, set()).add(permission_id)
+        _catalog[APPS] = apps
+    return _catalog[APPS].get(app_label, set())
+
+def clear_apps():
+    """Clears the index of permissions by app label, it is built again on
+    next use.
+    """
+    _catalog.pop(APPS, None)
+
+def load():
+    """Loads the catalog for all models.
+    """
+    for model, field in FIELDS.items():
+        _catalog[model] = dict(model._default_manager.values_list(field, "id"))
+
+def clear():
+    """Clears the catalog, it is loaded again on next use.
+    """
+    _catalog.clear()
+
+def invalidate(instance):
+    """Drops the entries of passed saved or deleted permission, role or group,
+    i.e. the ones with its id and its name.
+    """
+    ids = _catalog.get(instance.__class__)
+    if ids is not None:
+        _remove_id(ids, instance.id)
+        ids.pop(getattr(instance, FIELDS[instance.__class__]), None)
+    if isinstance(instance, Permission):
+        clear_apps()
+
+def discard(model, name):
+    """Drops the entry of passed model with passed name, e.g. of an object
+    which has been renamed or deleted by another process.
+    """
+    ids = _catalog.get(model)
+    if ids is not None:
+        ids.pop(name, None)
+
+def _get_id(model, name):
+    """Returns the id of the object of passed model with passed name or None.
+    """
+    if model not in _catalog:
+        load()
+
+    ids = _catalog[model]
+    try:
+        return ids[name]
+    except KeyError:
+        pass
+
+    try:
+        id = model._default_manager.filter(**{FIELDS[model]: name}).values_list("id", flat=True)[0]
+    except IndexError:
+        return None
+    ids[name] = id
+    return id
+
+def _remove_id(ids, id):
+    """Removes the entries with passed id from passed catalog, e.g. the one
+    with the former name of a renamed object.
+    """
+    for name, value in ids.items():
+        if value == id:
+            del ids[name]
@@ -0,0 +1,70 @@
+# permissions imports
+import permissions.cache
+
+class ActorContext(object):
+    """The active actor of a request together with the ids of its groups and
+    of its effective global roles (see ``permissions.utils.get_actor_context``).
+    The utils accept it wherever an actor is expected and take groups and
+    global roles from it instead of querying them. All other attributes are
+    those of the actor.
+
+    The ids are loaded on creation and loaded again on next access after the
+    permission cache has been invalidated within this process, i.e. after
+    roles, groups or grants have changed.
+
+    **Attributes:**
+
+    actor
+        The actor.
+
+    group_ids
+        The ids of the actor's groups as frozenset.
+
+    global_role_ids
+        The ids of the actor's global roles, including the ones of its
+        groups, as frozenset.
+    """
+    def __init__(self, actor, loader):
+        self.actor = actor
+        self.id = actor.id
+        self._loader = loader
+        self.load()
+
+    def load(self):
+        """Loads the ids of the actor's groups and global roles via the
+        loader, which is called with the actor and returns both.
+        """
+        self._version = permissions.cache.get_version()
+        group_ids, global_role_ids = self._loader(self.actor)
+        self._group_ids = frozenset(group_ids)
+        self._global_role_ids = frozenset(global_role_ids)
+
+    def _get_group_ids(self):
+        if self._version != permissions.cache.get_version():
+            self.load()
+        return self._group_ids
+
+    def _get_global_role_ids(self):
+        if self._version != permissions.cache.get_version():
+            self.load()
+        return self._global_role_ids
+
+    group_ids = property(_get_group_ids)
+    global_role_ids = property(_get_global_role_ids)
+
+    def __getattr__(self, name):
+        return getattr(self.actor, name)
+
+    def __eq__(self, other):
+        if isinstance(other, ActorContext):
+            other = other.actor
+        return self.actor == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.actor)
+
+    def __unicode__(self):
+        return unicode(self.actor)
@@ -0,0 +1,140 @@
+"""Dispatch of the permission checks of actors to the authentication
+backends.
+
+The backends of ``AUTHENTICATION_BACKENDS`` are loaded once and their check
+methods are resolved in advance, so ``Actor.has_perm``, ``has_perms`` and
+``has_module_perms`` call them directly. The backends are loaded again as
+soon as the setting changes.
+
+Diagnostics are available via a tracing hook, which costs nothing if it is
+not set::
+
+    import permissions.dispatch
+    permissions.dispatch.set_trace_hook(lambda event, *args: logging.debug("%s %r", event, args))
+"""
+# django imports
+from django.conf import settings
+from django.contrib.auth import load_backend
+from django.core.exceptions import ImproperlyConfigured
+
+_trace_hook = None
+_dispatcher = None
+
+class Dispatcher(object):
+    """The resolved checks of the passed backend paths.
+
+    **Attributes:**
+
+    paths
+        The paths of the backends.
+
+    perm_checks
+        (has_perm, supports_object_permissions) tuples.
+
+    granted_perms_checks
+        The ``get_granted_perms`` methods of the backends which support
+        object permissions.
+
+    module_perms_checks
+        The ``has_module_perms`` methods.
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.perm_checks = []
+        self.granted_perms_checks = []
+        self.module_perms_checks = []
+
+        backends = [load_backend(path) for path in paths]
+        if not backends:
+            raise ImproperlyConfigured("No authentication backends have been defined.")
+
+        for backend in backends:
+            if hasattr(backend, "get_granted_perms") and backend.supports_object_permissions:
+                self.granted_perms_checks.append(backend.get_granted_perms)
+            if hasattr(backend, "has_perm"):
+                self.perm_checks.append((backend.has_perm, backend.supports_object_permissions))
+            if hasattr(backend, "has_module_perms"):
+                self.module_perms_checks.append(backend.has_module_perms)
+
+        # Checks which are asked for the permissions which are not granted by
+        # one of the backends which check many permissions at once.
+        granted_backends = [check.im_self for check in self.granted_perms_checks]
+        self.remaining_perm_checks = [(check, supports_objects)
+            for check, supports_objects in self.perm_checks
+            if check.im_self not in granted_backends]
+
+def get_dispatcher():
+    """Returns the dispatcher of the current backends.
+    """
+    global _dispatcher
+    paths = settings.AUTHENTICATION_BACKENDS
+    if _dispatcher is None or _dispatcher.paths != paths:
+        _dispatcher = Dispatcher(paths)
+    return _dispatcher
+
+def set_trace_hook(hook):
+    """Sets the tracing hook, which is called with the name of the event
+    ("has_perm", "has_perms" or "has_module_perms"), the actor, the arguments
+    and the result of each check. Pass None to remove it.
+    """
+    global _trace_hook
+    _trace_hook = hook
+
+def has_perm(actor, perm, obj=None):
+    """Returns True if one of the backends grants the passed permission to
+    the passed actor (for the passed object).
+    """
+    result = _has_perm(get_dispatcher().perm_checks, actor, perm, obj)
+    if _trace_hook is not None:
+        _trace_hook("has_perm", actor, perm, obj, result)
+    return result
+
+def has_perms(actor, perm_list, obj=None):
+    """Returns True if each of the passed permissions is granted to the
+    passed actor (for the passed object) by one of the backends. Backends
+    which provide ``get_granted_perms`` are asked for all permissions at once.
+    """
+    dispatcher = get_dispatcher()
+    remaining = list(perm_list)
+    if obj is not None and dispatcher.granted_perms_checks:
+        for check in dispatcher.granted_perms_checks:
+            granted = check(actor, remaining, obj)
+            remaining = [perm for perm in remaining if perm not in granted]
+        checks = dispatcher.remaining_perm_checks
+    else:
+        checks = dispatcher.perm_checks
+
+    result = True
+    for perm in remaining:
+        if not _has_perm(checks, actor, perm, obj):
+            result = False
+            break
+
+    if _trace_hook is not None:
+        _trace_hook("has_perms", actor, perm_list, obj, result)
+    return result
+
+def has_module_perms(actor, app_label):
+    """Returns True if one of the backends grants any permission of the
+    passed app to the passed actor.
+    """
+    result = False
+    for check in get_dispatcher().module_perms_checks:
+        if check(actor, app_label):
+            result = True
+            break
+
+    if _trace_hook is not None:
+        _trace_hook("has_module_perms", actor, app_label, result)
+    return result
+
+def _has_perm(checks, actor, perm, obj):
+    """Returns True if one of the passed checks grants the passed permission.
+    """
+    for check, supports_objects in checks:
+        if obj is not None:
+            if supports_objects and check(actor, perm, obj):
+                return True
+        elif check(actor, perm):
+            return True
+    return False
@@ -0,0 +1,212 @@
+"""Closure table of the permission hierarchy.
+
+For the objects of registered models all ancestors (as returned by
+``get_parent_for_permissions()``) are stored within ``PermissionAncestor``.
+Then the ancestor chain of an object is loaded with one query and
+``filter_permitted`` resolves inherited permissions within the SQL of the
+queryset, which it requires for hierarchical models. Register all models of a
+hierarchy like so::
+
+    import permissions.hierarchy
+    permissions.hierarchy.register(Location)
+    permissions.hierarchy.register(Case)
+
+The rows of an object are updated whenever it is saved, which moves its
+descendants along with it and invalidates ``permissions.cache``. Use ``manage.py permissions_rebuild_hierarchy``
+to build the table for existing objects.
+"""
+# django imports
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+# permissions imports
+import permissions.cache
+import permissions.utils
+from permissions.models import PermissionAncestor
+
+_registry = []
+
+def register(model):
+    """Registers passed model, so that the ancestors of its objects are
+    stored within the closure table.
+    """
+    if model in _registry:
+        return
+    _registry.append(model)
+
+    post_save.connect(_update_saved_object, sender=model,
+        dispatch_uid="permissions.hierarchy.%s.post_save" % model.__name__)
+    post_delete.connect(_remove_deleted_object, sender=model,
+        dispatch_uid="permissions.hierarchy.%s.post_delete" % model.__name__)
+
+def unregister(model):
+    """Unregisters passed model.
+    """
+    if model not in _registry:
+        return
+    _registry.remove(model)
+
+    post_save.disconnect(sender=model,
+        dispatch_uid="permissions.hierarchy.%s.post_save" % model.__name__)
+    post_delete.disconnect(sender=model,
+        dispatch_uid="permissions.hierarchy.%s.post_delete" % model.__name__)
+
+def is_registered(model):
+    """Returns True if passed model (or the model of passed object) is
+    registered.
+    """
+    if not isinstance(model, type):
+        model = model.__class__
+    return model in _registry
+
+def get_ancestor_keys(obj):
+    """Returns the content keys of passed object and all of its ancestors from
+    the closure table, starting with the object itself. Returns None if there
+    are no rows for the object.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    keys = [(ctype_id, str(content_id)) for ctype_id, content_id in
+        PermissionAncestor.objects.filter(content_type=ctype, content_id=str(obj.id)).order_by(
+            "depth").values_list("ancestor_type", "ancestor_id")]
+    return keys or None
+
+def get_ancestor_chains(objs):
+    """Returns a dict which maps the content keys of passed objects to the
+    content keys of the object and all of its ancestors from the closure
+    table. Objects without rows are left out.
+    """
+    keys = [permissions.utils._get_content_key(obj) for obj in objs]
+
+    rows = permissions.utils._get_values_for_keys(PermissionAncestor.objects.all(), keys,
+        "content_type", "content_id", "ancestor_type", "ancestor_id", "depth")
+    rows.sort(key=lambda row: row[4])
+
+    chains = {}
+    for ctype_id, content_id, ancestor_type_id, ancestor_id, depth in rows:
+        chains.setdefault((ctype_id, str(content_id)), []).append((ancestor_type_id, str(ancestor_id)))
+    return chains
+
+def get_descendant_keys(obj):
+    """Returns the content keys of all descendants of passed object from the
+    closure table, ordered by their distance to the object.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    return [(ctype_id, str(content_id)) for ctype_id, content_id in
+        PermissionAncestor.objects.filter(ancestor_type=ctype, ancestor_id=str(obj.id),
+            depth__gt=0).order_by("depth").values_list("content_type", "content_id")]
+
+def filter_descendants(queryset, obj, include_self=False):
+    """Returns the passed queryset restricted to the descendants of passed
+    object, with a single join against the closure table.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    model = queryset.model
+    if include_self:
+        min_depth = 0
+    else:
+        min_depth = 1
+
+    sql = """EXISTS (SELECT 1 FROM %(closure)s pa
+                     WHERE pa.content_type_id = %%s
+                     AND pa.content_id = %(content_id)s
+                     AND pa.ancestor_type_id = %%s
+                     AND pa.ancestor_id = %%s
+                     AND pa.depth >= %%s)""" % {
+        "closure": PermissionAncestor._meta.db_table,
+        "content_id": permissions.utils._get_content_id_sql(model),
+    }
+    params = [ContentType.objects.get_for_model(model).id, ctype.id, str(obj.id), min_depth]
+    return queryset.extra(where=[sql], params=params)
+
+def update(obj):
+    """Updates the ancestors of passed object and of all its descendants.
+    Returns True if they have changed.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    content_id = str(obj.id)
+    ancestors = _get_parent_ancestor_keys(obj)
+
+    existing = list(PermissionAncestor.objects.filter(content_type=ctype, content_id=content_id,
+        depth__gt=0).order_by("depth").values_list("ancestor_type", "ancestor_id"))
+    stored = PermissionAncestor.objects.filter(content_type=ctype, content_id=content_id,
+        depth=0).exists()
+    if stored and [(ctype_id, str(ancestor_id)) for ctype_id, ancestor_id in existing] == ancestors:
+        return False
+
+    # The object itself
+    PermissionAncestor.objects.filter(content_type=ctype, content_id=content_id).delete()
+    _create_rows(ctype.id, content_id, [(ctype.id, content_id)] + ancestors, 0)
+
+    # The descendants keep their path to the object, but get its new ancestors
+    for row in PermissionAncestor.objects.filter(ancestor_type=ctype, ancestor_id=content_id, depth__gt=0):
+        PermissionAncestor.objects.filter(content_type=row.content_type_id, content_id=row.content_id,
+            depth__gt=row.depth).delete()
+        _create_rows(row.content_type_id, row.content_id, ancestors, row.depth + 1)
+
+    # The object moved, which changes the inherited permissions of its subtree
+    if stored:
+        permissions.cache.invalidate()
+    return True
+
+def remove(obj):
+    """Removes passed object from the closure table. Its descendants lose all
+    ancestors from the object upwards.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    content_id = str(obj.id)
+
+    rows = list(PermissionAncestor.objects.filter(ancestor_type=ctype, ancestor_id=content_id, depth__gt=0))
+    for row in rows:
+        PermissionAncestor.objects.filter(content_type=row.content_type_id, content_id=row.content_id,
+            depth__gte=row.depth).delete()
+    PermissionAncestor.objects.filter(content_type=ctype, content_id=content_id).delete()
+
+    if rows:
+        permissions.cache.invalidate()
+
+@transaction.commit_on_success
+def rebuild():
+    """Rebuilds the closure table for all objects of all registered models.
+    """
+    PermissionAncestor.objects.all().delete()
+    for model in _registry:
+        ctype = ContentType.objects.get_for_model(model)
+        for obj in model._default_manager.all():
+            _create_rows(ctype.id, str(obj.id), permissions.utils._walk_ancestor_keys(obj), 0)
+
+def _get_parent_ancestor_keys(obj):
+    """Returns the content keys of all ancestors of passed object (without the
+    object itself). The rows of a registered parent are reused.
+    """
+    try:
+        parent = obj.get_parent_for_permissions()
+    except AttributeError:
+        parent = None
+
+    if parent is None:
+        return []
+
+    if is_registered(parent):
+        keys = get_ancestor_keys(parent)
+        if keys is not None:
+            return keys
+
+    return permissions.utils._walk_ancestor_keys(parent)
+
+def _create_rows(ctype_id, content_id, ancestor_keys, depth):
+    """Creates the rows for passed content and ancestors. The first ancestor
+    gets passed depth.
+    """
+    for i, (ancestor_type_id, ancestor_id) in enumerate(ancestor_keys):
+        PermissionAncestor.objects.create(content_type_id=ctype_id, content_id=content_id,
+            ancestor_type_id=ancestor_type_id, ancestor_id=ancestor_id, depth=depth + i)
+
+def _update_saved_object(sender, instance, **kwargs):
+    # Remembered for the handlers of other modules, e.g. of
+    # permissions.materialized, which run after the update.
+    instance._permissions_moved = update(instance)
+
+def _remove_deleted_object(sender, instance, **kwargs):
+    remove(instance)
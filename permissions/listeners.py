@@ -0,0 +1,229 @@
+# django imports
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+
+# permissions imports
+import permissions.cache
+import permissions.catalog
+import permissions.materialized
+import permissions.utils
+from permissions.models import Actor
+from permissions.models import ActorGroup
+from permissions.models import ObjectPermission
+from permissions.models import ObjectPermissionInheritanceBlock
+from permissions.models import Permission
+from permissions.models import PrincipalRoleRelation
+from permissions.models import Role
+
+# Catalog ####################################################################
+
+def invalidate_catalog(sender, instance, **kwargs):
+    """Drops the entries of a saved or deleted permission, role or group from
+    the catalog.
+    """
+    permissions.catalog.invalidate(instance)
+
+def clear_catalog_apps(sender, action, **kwargs):
+    """Clears the index of permissions by app label as soon as the content
+    types of a permission change.
+    """
+    if action.startswith("post_"):
+        permissions.catalog.clear_apps()
+
+m2m_changed.connect(clear_catalog_apps, sender=Permission.content_types.through,
+    dispatch_uid="permissions.catalog.permission_content_types.m2m_changed")
+
+for model in (Permission, Role, ActorGroup):
+    post_save.connect(invalidate_catalog, sender=model,
+        dispatch_uid="permissions.catalog.%s.post_save" % model.__name__)
+    post_delete.connect(invalidate_catalog, sender=model,
+        dispatch_uid="permissions.catalog.%s.post_delete" % model.__name__)
+
+# Role index #################################################################
+
+def update_role_index_for_relation(sender, instance, **kwargs):
+    """Updates the role index for the actors which are affected by the changed
+    global role relation.
+    """
+    if not permissions.utils.is_role_index_enabled():
+        return
+    if instance.content_type_id is not None:
+        return
+
+    if instance.actor_id is not None:
+        permissions.utils.update_role_index([instance.actor_id])
+    else:
+        permissions.utils.update_role_index(Actor.groups.through.objects.filter(
+            actorgroup=instance.group_id).values_list("actor", flat=True))
+
+def update_role_index_for_groups(sender, instance, action, pk_set, **kwargs):
+    """Updates the role index for the actors whose groups changed.
+    """
+    if not permissions.utils.is_role_index_enabled():
+        return
+
+    if isinstance(instance, Actor):
+        if action.startswith("post_"):
+            permissions.utils.update_role_index([instance.id])
+    elif action == "pre_clear":
+        instance._permissions_actor_ids = list(
+            instance.actor_set.values_list("id", flat=True))
+    elif action == "post_clear":
+        permissions.utils.update_role_index(
+            getattr(instance, "_permissions_actor_ids", []))
+    elif action.startswith("post_"):
+        permissions.utils.update_role_index(pk_set)
+
+def remember_group_actors(sender, instance, **kwargs):
+    """Remembers the members of a group which is about to be deleted.
+    """
+    if permissions.utils.is_role_index_enabled():
+        instance._permissions_actor_ids = list(
+            instance.actor_set.values_list("id", flat=True))
+
+def update_role_index_for_group(sender, instance, **kwargs):
+    """Updates the role index for the former members of a deleted group.
+    """
+    if permissions.utils.is_role_index_enabled():
+        permissions.utils.update_role_index(
+            getattr(instance, "_permissions_actor_ids", []))
+
+post_save.connect(update_role_index_for_relation, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.role_index.PrincipalRoleRelation.post_save")
+post_delete.connect(update_role_index_for_relation, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.role_index.PrincipalRoleRelation.post_delete")
+m2m_changed.connect(update_role_index_for_groups, sender=Actor.groups.through,
+    dispatch_uid="permissions.role_index.actor_groups.m2m_changed")
+pre_delete.connect(remember_group_actors, sender=ActorGroup,
+    dispatch_uid="permissions.role_index.ActorGroup.pre_delete")
+post_delete.connect(update_role_index_for_group, sender=ActorGroup,
+    dispatch_uid="permissions.role_index.ActorGroup.post_delete")
+
+# Materialized permissions ###################################################
+
+def refresh_materialized_content(sender, instance, **kwargs):
+    """Refreshes the materialized permissions which are affected by a changed
+    grant, inheritance block or role relation.
+    """
+    if not permissions.materialized.is_enabled():
+        return
+
+    if instance.content_type_id is not None:
+        permissions.materialized.refresh_content(instance.content_type_id, instance.content_id)
+    elif instance.actor_id is not None:
+        permissions.materialized.refresh_actors([instance.actor_id], [instance.role_id])
+    else:
+        permissions.materialized.refresh_actors(Actor.groups.through.objects.filter(
+            actorgroup=instance.group_id).values_list("actor", flat=True), [instance.role_id])
+
+def refresh_materialized_groups(sender, instance, action, pk_set, **kwargs):
+    """Refreshes the materialized permissions of the actors whose groups
+    changed, for the roles of these groups.
+    """
+    if not permissions.materialized.is_enabled():
+        return
+
+    if isinstance(instance, Actor):
+        if action == "pre_clear":
+            instance._permissions_materialized_group_ids = list(
+                instance.groups.values_list("id", flat=True))
+        elif action == "post_clear":
+            permissions.materialized.refresh_actors([instance.id],
+                permissions.materialized.get_group_role_ids(
+                    getattr(instance, "_permissions_materialized_group_ids", [])))
+        elif action.startswith("post_"):
+            permissions.materialized.refresh_actors([instance.id],
+                permissions.materialized.get_group_role_ids(pk_set))
+    elif action == "pre_clear":
+        instance._permissions_materialized_actor_ids = list(
+            instance.actor_set.values_list("id", flat=True))
+    elif action == "post_clear":
+        permissions.materialized.refresh_actors(
+            getattr(instance, "_permissions_materialized_actor_ids", []),
+            permissions.materialized.get_group_role_ids([instance.id]))
+    elif action.startswith("post_"):
+        permissions.materialized.refresh_actors(pk_set,
+            permissions.materialized.get_group_role_ids([instance.id]))
+
+def remember_materialized_group_actors(sender, instance, **kwargs):
+    """Remembers the members and the roles of a group which is about to be
+    deleted.
+    """
+    if permissions.materialized.is_enabled():
+        instance._permissions_materialized_actor_ids = list(
+            instance.actor_set.values_list("id", flat=True))
+        instance._permissions_materialized_role_ids = \
+            permissions.materialized.get_group_role_ids([instance.id])
+
+def refresh_materialized_group(sender, instance, **kwargs):
+    """Refreshes the materialized permissions of the former members of a
+    deleted group.
+    """
+    if permissions.materialized.is_enabled():
+        permissions.materialized.refresh_actors(
+            getattr(instance, "_permissions_materialized_actor_ids", []),
+            getattr(instance, "_permissions_materialized_role_ids", set()))
+
+for model in (ObjectPermission, ObjectPermissionInheritanceBlock):
+    post_save.connect(refresh_materialized_content, sender=model,
+        dispatch_uid="permissions.materialized.%s.post_save" % model.__name__)
+    post_delete.connect(refresh_materialized_content, sender=model,
+        dispatch_uid="permissions.materialized.%s.post_delete" % model.__name__)
+
+post_save.connect(refresh_materialized_content, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.materialized.PrincipalRoleRelation.post_save")
+post_delete.connect(refresh_materialized_content, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.materialized.PrincipalRoleRelation.post_delete")
+m2m_changed.connect(refresh_materialized_groups, sender=Actor.groups.through,
+    dispatch_uid="permissions.materialized.actor_groups.m2m_changed")
+pre_delete.connect(remember_materialized_group_actors, sender=ActorGroup,
+    dispatch_uid="permissions.materialized.ActorGroup.pre_delete")
+post_delete.connect(refresh_materialized_group, sender=ActorGroup,
+    dispatch_uid="permissions.materialized.ActorGroup.post_delete")
+
+# Caches #####################################################################
+
+def invalidate_permission_cache(sender, **kwargs):
+    """Invalidates all cached permission results as soon as any of the data
+    they are based on changes.
+    """
+    permissions.cache.invalidate()
+
+def invalidate_principal_role_relation(sender, instance, **kwargs):
+    """Invalidates the cached results of the actor of the changed relation.
+    Changes of group relations invalidate all results.
+    """
+    if instance.actor_id is not None:
+        permissions.cache.invalidate([instance.actor_id])
+    else:
+        permissions.cache.invalidate()
+
+def invalidate_actor_groups(sender, instance, action, pk_set, **kwargs):
+    """Invalidates the cached results of the actors whose groups changed.
+    """
+    if not action.startswith("post_"):
+        return
+
+    if isinstance(instance, Actor):
+        permissions.cache.invalidate([instance.id])
+    elif pk_set:
+        permissions.cache.invalidate(pk_set)
+    else:
+        permissions.cache.invalidate()
+
+for model in (ObjectPermission, ObjectPermissionInheritanceBlock,
+              Permission, Role, ActorGroup):
+    post_save.connect(invalidate_permission_cache, sender=model,
+        dispatch_uid="permissions.cache.%s.post_save" % model.__name__)
+    post_delete.connect(invalidate_permission_cache, sender=model,
+        dispatch_uid="permissions.cache.%s.post_delete" % model.__name__)
+
+post_save.connect(invalidate_principal_role_relation, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.cache.PrincipalRoleRelation.post_save")
+post_delete.connect(invalidate_principal_role_relation, sender=PrincipalRoleRelation,
+    dispatch_uid="permissions.cache.PrincipalRoleRelation.post_delete")
+
+m2m_changed.connect(invalidate_actor_groups, sender=Actor.groups.through,
+    dispatch_uid="permissions.cache.actor_groups.m2m_changed")
@@ -0,0 +1,15 @@
+# django imports
+from django.core.management.base import NoArgsCommand
+
+# permissions imports
+import permissions.utils
+
+class Command(NoArgsCommand):
+    help = ("Removes duplicate role relations and sets the relation key of "
+            "existing ones. Run it after updating role relations without "
+            "saving them.")
+
+    def handle_noargs(self, **options):
+        count = permissions.utils.remove_duplicate_role_relations()
+        if int(options.get("verbosity", 1)):
+            self.stdout.write("Removed %s duplicate role relations.\n" % count)
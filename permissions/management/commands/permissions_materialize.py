@@ -0,0 +1,39 @@
+# python imports
+from optparse import make_option
+
+# django imports
+from django.core.management.base import CommandError
+from django.core.management.base import NoArgsCommand
+
+# permissions imports
+import permissions.materialized
+
+class Command(NoArgsCommand):
+    help = ("Rebuilds the materialized effective permissions for all registered "
+            "models and verifies them against the rule engine.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--verify-only", action="store_true", dest="verify_only", default=False,
+            help="Only verify the materialized permissions, don't rebuild them."),
+        make_option("--no-verify", action="store_false", dest="verify", default=True,
+            help="Only rebuild the materialized permissions, don't verify them."),
+        make_option("--sample", type="int", dest="sample", default=100,
+            help="Number of objects per model which are checked against the "
+                 "walk of has_permission, 0 checks all objects (default: 100)."),
+    )
+
+    def handle_noargs(self, **options):
+        if not options["verify_only"]:
+            permissions.materialized.rebuild()
+
+        if options["verify"] or options["verify_only"]:
+            errors = permissions.materialized.verify(options["sample"] or None)
+            for actor_id, ctype_id, content_id, codename, expected in errors:
+                if expected:
+                    problem = "missing"
+                else:
+                    problem = "unexpected"
+                self.stderr.write("%s: actor %s, content type %s, content %s, permission %s\n" % (
+                    problem, actor_id, ctype_id, content_id, codename))
+            if errors:
+                raise CommandError("%s materialized permissions are wrong." % len(errors))
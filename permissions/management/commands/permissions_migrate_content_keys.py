@@ -0,0 +1,58 @@
+# django imports
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import DatabaseError
+from django.db import connection
+from django.db import transaction
+
+# permissions imports
+from permissions.models import ObjectPermission
+from permissions.models import ObjectPermissionInheritanceBlock
+from permissions.models import PrincipalRoleRelation
+
+class Command(NoArgsCommand):
+    help = ("Migrates a database created by an older version: stores the "
+            "content ids of inheritance blocks as strings, like the other "
+            "permission models do, and creates the composite content indexes.")
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        transaction.commit_on_success(self.migrate)(verbosity)
+
+    def migrate(self, verbosity):
+        qn = connection.ops.quote_name
+        table = qn(ObjectPermissionInheritanceBlock._meta.db_table)
+
+        # SQLite stores the ids of existing rows as they are and compares
+        # them with strings by the column affinity, hence there is nothing to
+        # convert.
+        if connection.vendor == "postgresql":
+            statements = [
+                "ALTER TABLE %s DROP CONSTRAINT %s" % (table,
+                    qn("%s_content_id_check" % ObjectPermissionInheritanceBlock._meta.db_table)),
+                "ALTER TABLE %s ALTER COLUMN content_id TYPE varchar(32) USING content_id::varchar(32)" % table,
+            ]
+        elif connection.vendor == "mysql":
+            statements = ["ALTER TABLE %s MODIFY content_id varchar(32) NOT NULL" % table]
+        else:
+            statements = []
+
+        for model in (ObjectPermission, ObjectPermissionInheritanceBlock, PrincipalRoleRelation):
+            statements.extend(custom_sql_for_model(model, no_style(), connection))
+
+        cursor = connection.cursor()
+        for statement in statements:
+            # Statements which have been applied already fail, which must not
+            # abort the whole migration.
+            sid = transaction.savepoint()
+            try:
+                cursor.execute(statement)
+            except DatabaseError, e:
+                transaction.savepoint_rollback(sid)
+                if verbosity:
+                    self.stdout.write("Skipped: %s (%s)\n" % (statement, e))
+            else:
+                transaction.savepoint_commit(sid)
+                if verbosity:
+                    self.stdout.write("Applied: %s\n" % statement)
@@ -0,0 +1,55 @@
+# django imports
+from django.core.management.base import NoArgsCommand
+from django.db import DatabaseError
+from django.db import connection
+from django.db import transaction
+
+# permissions imports
+import permissions.utils
+from permissions.models import PrincipalRoleRelation
+
+class Command(NoArgsCommand):
+    help = ("Migrates a database created by an older version: adds the "
+            "relation key of role relations, removes duplicate relations, sets "
+            "the keys of existing ones and makes the keys unique.")
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        opts = PrincipalRoleRelation._meta
+        qn = connection.ops.quote_name
+        table = opts.db_table
+        column = opts.get_field("relation_key").column
+
+        # The unique index is created once duplicates are removed and all keys
+        # are set, which would violate it otherwise. SQLite can't add unique
+        # columns anyway.
+        self.apply("ALTER TABLE %s ADD COLUMN %s varchar(255) NULL" % (qn(table), qn(column)),
+            verbosity)
+
+        count = permissions.utils.remove_duplicate_role_relations()
+        if verbosity:
+            self.stdout.write("Removed %s duplicate role relations.\n" % count)
+
+        cursor = connection.cursor()
+        indexes = connection.introspection.get_indexes(cursor, table)
+        if indexes.get(column, {}).get("unique"):
+            if verbosity:
+                self.stdout.write("Skipped: unique index on %s exists already\n" % column)
+        else:
+            self.apply("CREATE UNIQUE INDEX %s ON %s (%s)" % (qn("%s_%s" % (table, column)),
+                qn(table), qn(column)), verbosity)
+
+    def apply(self, statement, verbosity):
+        """Executes passed statement within its own transaction. Statements
+        which have been applied already fail, which must not abort the whole
+        migration.
+        """
+        cursor = connection.cursor()
+        try:
+            transaction.commit_on_success(cursor.execute)(statement)
+        except DatabaseError, e:
+            if verbosity:
+                self.stdout.write("Skipped: %s (%s)\n" % (statement, e))
+        else:
+            if verbosity:
+                self.stdout.write("Applied: %s\n" % statement)
@@ -0,0 +1,11 @@
+# django imports
+from django.core.management.base import NoArgsCommand
+
+# permissions imports
+import permissions.hierarchy
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the closure table of the permission hierarchy for all registered models."
+
+    def handle_noargs(self, **options):
+        permissions.hierarchy.rebuild()
@@ -0,0 +1,11 @@
+# django imports
+from django.core.management.base import NoArgsCommand
+
+# permissions imports
+import permissions.utils
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the index of the effective global roles of all actors."
+
+    def handle_noargs(self, **options):
+        permissions.utils.rebuild_role_index()
@@ -0,0 +1,37 @@
+# django imports
+from django.db import models
+from django.db.models.query import QuerySet
+
+# permissions imports
+import permissions.utils
+
+class PermissionQuerySetMixin(object):
+    """Mix-in class for querysets of models using PermissionBase.
+    """
+    def permitted(self, actor, codename, roles=None):
+        """Returns only the objects for which the passed actor has the passed
+        permission. See ``permissions.utils.filter_permitted``.
+        """
+        return permissions.utils.filter_permitted(self, actor, codename, roles)
+
+class PermissionQuerySet(PermissionQuerySetMixin, QuerySet):
+    """QuerySet which can be filtered by permissions.
+    """
+    pass
+
+class PermissionManager(models.Manager):
+    """Manager for models using PermissionBase. Use it like::
+
+        class Document(models.Model, PermissionBase):
+            objects = PermissionManager()
+
+        Document.objects.permitted(actor, "view")
+    """
+    def get_query_set(self):
+        return PermissionQuerySet(self.model, using=self._db)
+
+    def permitted(self, actor, codename, roles=None):
+        """Returns only the objects for which the passed actor has the passed
+        permission.
+        """
+        return self.get_query_set().permitted(actor, codename, roles)
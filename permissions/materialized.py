@@ -0,0 +1,349 @@
+"""Materialized effective permissions.
+
+If ``PERMISSIONS_MATERIALIZE`` is True the effective permissions of all actors
+for the objects of registered models are stored within
+``EffectivePermission`` and ``has_permission`` answers checks for these objects
+with a single lookup. Register models like so::
+
+    import permissions.materialized
+    permissions.materialized.register(Document)
+
+The table is maintained incrementally by the signal handlers within
+``permissions.listeners``. Changes of grants, inheritance blocks and local
+roles are propagated to the descendants of the changed object, which are
+taken from the closure table of ``permissions.hierarchy``. Hence models with
+``get_parent_for_permissions()`` must be registered there first. Their rows
+within the closure table contain all ancestors, whatever their model, so
+changes on e.g. a site reach the pages below it. Changes of global roles and
+of group memberships refresh the rows of the affected actors for the objects
+which grant a permission to one of the affected roles and for their
+descendants.
+
+Use ``manage.py permissions_materialize`` to build the table for existing
+data and to verify it against the rule engine.
+"""
+# python imports
+import random
+
+# django imports
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+# permissions imports
+import permissions.catalog
+import permissions.hierarchy
+import permissions.utils
+from permissions.models import Actor
+from permissions.models import EffectivePermission
+from permissions.models import ObjectPermission
+from permissions.models import Permission
+from permissions.models import PrincipalRoleRelation
+
+_registry = []
+
+def register(model):
+    """Registers passed model, so that the effective permissions for its
+    objects are materialized.
+
+    The rows of its objects are found from the closure table when one of
+    their ancestors changes, hence a model with ``get_parent_for_permissions``
+    must be registered within ``permissions.hierarchy`` first. Otherwise
+    ImproperlyConfigured is raised.
+    """
+    if model in _registry:
+        return
+
+    if hasattr(model, "get_parent_for_permissions") and \
+       not permissions.hierarchy.is_registered(model):
+        raise ImproperlyConfigured("%s must be registered within permissions.hierarchy "
+            "to be materialized." % model.__name__)
+    _registry.append(model)
+
+    post_save.connect(_refresh_saved_object, sender=model,
+        dispatch_uid="permissions.materialized.%s.post_save" % model.__name__)
+    post_delete.connect(_remove_deleted_object, sender=model,
+        dispatch_uid="permissions.materialized.%s.post_delete" % model.__name__)
+
+def unregister(model):
+    """Unregisters passed model.
+    """
+    if model not in _registry:
+        return
+    _registry.remove(model)
+
+    post_save.disconnect(sender=model,
+        dispatch_uid="permissions.materialized.%s.post_save" % model.__name__)
+    post_delete.disconnect(sender=model,
+        dispatch_uid="permissions.materialized.%s.post_delete" % model.__name__)
+
+def is_enabled():
+    """Returns True if effective permissions are materialized.
+    """
+    return getattr(settings, "PERMISSIONS_MATERIALIZE", False)
+
+def is_materialized(obj):
+    """Returns True if the effective permissions for passed object are
+    materialized.
+    """
+    return is_enabled() and obj.__class__ in _registry
+
+def has_permission(obj, actor, codename):
+    """Returns True if the materialized permissions contain passed permission
+    of passed actor for passed object.
+    """
+    permission_id = permissions.catalog.get_permission_id(codename)
+    if permission_id is None:
+        return False
+
+    ctype = ContentType.objects.get_for_model(obj)
+    return EffectivePermission.objects.filter(actor=actor.id, content_type=ctype,
+        content_id=str(obj.id), permission=permission_id).exists()
+
+def refresh_object(obj, actor_ids=None):
+    """Brings the materialized permissions for passed object in line with the
+    rule engine.
+
+    **Parameters:**
+
+    obj
+        The object whose permissions are refreshed.
+
+    actor_ids
+        If given only the rows of these actors are refreshed.
+    """
+    if actor_ids is not None:
+        actor_ids = set(actor_ids)
+
+    ctype = ContentType.objects.get_for_model(obj)
+    content_id = str(obj.id)
+
+    expected = set()
+    for permission_id, ids in permissions.utils._get_holder_ids(obj, actor_ids).items():
+        for actor_id in ids:
+            expected.add((actor_id, permission_id))
+
+    existing = EffectivePermission.objects.filter(content_type=ctype, content_id=content_id)
+    if actor_ids is not None:
+        existing = existing.filter(actor__in=actor_ids)
+
+    obsolete = []
+    for row_id, actor_id, permission_id in existing.values_list("id", "actor", "permission"):
+        try:
+            expected.remove((actor_id, permission_id))
+        except KeyError:
+            obsolete.append(row_id)
+
+    if obsolete:
+        EffectivePermission.objects.filter(pk__in=obsolete).delete()
+
+    for actor_id, permission_id in expected:
+        EffectivePermission.objects.create(actor_id=actor_id,
+            permission_id=permission_id, content_type=ctype, content_id=content_id)
+
+def refresh_subtree(obj):
+    """Refreshes the materialized permissions for passed object and all of its
+    descendants.
+    """
+    for descendant in [obj] + get_descendants(obj):
+        if descendant.__class__ in _registry:
+            refresh_object(descendant)
+
+def refresh_content(ctype_id, content_id):
+    """Refreshes the materialized permissions for the object with passed
+    content type and id and all of its descendants.
+    """
+    ctype = ContentType.objects.get_for_id(ctype_id)
+    try:
+        obj = ctype.get_object_for_this_type(pk=content_id)
+    except ctype.model_class().DoesNotExist:
+        EffectivePermission.objects.filter(content_type=ctype, content_id=content_id).delete()
+    else:
+        refresh_subtree(obj)
+
+def refresh_actors(actor_ids, role_ids=None):
+    """Refreshes the materialized permissions of the actors with passed ids.
+
+    **Parameters:**
+
+    actor_ids
+        The ids of the actors whose rows are refreshed.
+
+    role_ids
+        The ids of the roles the actors gained or lost. If given only the
+        objects which grant a permission to one of these roles and their
+        descendants are refreshed, otherwise all objects of all registered
+        models.
+    """
+    actor_ids = set(actor_ids)
+    if not actor_ids:
+        return
+
+    if role_ids is None:
+        for model in _registry:
+            for obj in model._default_manager.all():
+                refresh_object(obj, actor_ids)
+        return
+
+    seen = set()
+    for obj in _get_granting_objects(role_ids):
+        for descendant in [obj] + get_descendants(obj):
+            key = permissions.utils._get_content_key(descendant)
+            if descendant.__class__ in _registry and key not in seen:
+                seen.add(key)
+                refresh_object(descendant, actor_ids)
+
+def get_group_role_ids(group_ids):
+    """Returns the ids of the global and local roles of the groups with passed
+    ids, i.e. the roles members gain or lose with their membership.
+    """
+    group_ids = list(group_ids)
+    if not group_ids:
+        return set()
+    return set(PrincipalRoleRelation.objects.filter(
+        group__in=group_ids).values_list("role", flat=True))
+
+def _get_granting_objects(role_ids):
+    """Returns the objects which grant a permission to one of the roles with
+    passed ids.
+    """
+    role_ids = list(role_ids)
+    if not role_ids:
+        return []
+
+    ids_by_ctype = {}
+    for ctype_id, content_id in ObjectPermission.objects.filter(
+        role__in=role_ids).values_list("content_type", "content_id").distinct():
+        ids_by_ctype.setdefault(ctype_id, set()).add(content_id)
+
+    objs = []
+    for ctype_id, content_ids in ids_by_ctype.items():
+        model = ContentType.objects.get_for_id(ctype_id).model_class()
+        objs.extend(model._default_manager.filter(pk__in=list(content_ids)))
+    return objs
+
+def get_descendants(obj):
+    """Returns all descendants of passed object from the closure table. Its
+    model doesn't need to be registered there, as the rows of registered
+    objects contain all of their ancestors.
+    """
+    ids_by_ctype = {}
+    for ctype_id, content_id in permissions.hierarchy.get_descendant_keys(obj):
+        ids_by_ctype.setdefault(ctype_id, []).append(content_id)
+
+    descendants = []
+    for ctype_id, content_ids in ids_by_ctype.items():
+        model = ContentType.objects.get_for_id(ctype_id).model_class()
+        for i in range(0, len(content_ids), permissions.utils.CONTENT_KEYS_CHUNK_SIZE):
+            descendants.extend(model._default_manager.filter(
+                pk__in=content_ids[i:i + permissions.utils.CONTENT_KEYS_CHUNK_SIZE]))
+    return descendants
+
+@transaction.commit_on_success
+def rebuild():
+    """Rebuilds the materialized permissions for all objects of all registered
+    models.
+    """
+    EffectivePermission.objects.all().delete()
+    for model in _registry:
+        for obj in model._default_manager.all():
+            refresh_object(obj)
+
+def verify(sample=100):
+    """Verifies the materialized permissions against the rule engine. Returns
+    a list of (actor id, content type id, content id, codename, expected)
+    tuples for each row which is missing (expected is True) or wrong
+    (expected is False).
+
+    The rows of all objects are compared against the holders which are
+    resolved in bulk (see ``permissions.utils._get_holder_ids``). For a
+    random sample of objects per model every permission of every actor is
+    additionally checked by walking the ancestors like ``has_permission``
+    does without materialized permissions.
+
+    **Parameters:**
+
+    sample
+        The number of objects per model which are checked against the walk.
+        None checks all objects, which takes a query per actor, permission
+        and level of each object.
+    """
+    codenames = dict(Permission.objects.values_list("id", "codename"))
+    actors = list(Actor.objects.all())
+    errors = []
+    found = set()
+
+    def add(actor_id, ctype_id, content_id, permission_id, expected):
+        if (actor_id, ctype_id, content_id, permission_id) not in found:
+            found.add((actor_id, ctype_id, content_id, permission_id))
+            errors.append((actor_id, ctype_id, content_id, codenames[permission_id], expected))
+
+    for model in _registry:
+        ctype = ContentType.objects.get_for_model(model)
+        objs = list(model._default_manager.all())
+
+        materialized = {}
+        for actor_id, content_id, permission_id in EffectivePermission.objects.filter(
+            content_type=ctype).values_list("actor", "content_id", "permission"):
+            materialized.setdefault(content_id, set()).add((actor_id, permission_id))
+
+        for obj in objs:
+            content_id = str(obj.id)
+            expected = set()
+            for permission_id, ids in permissions.utils._get_holder_ids(obj).items():
+                for actor_id in ids:
+                    expected.add((actor_id, permission_id))
+
+            rows = materialized.get(content_id, set())
+            for actor_id, permission_id in sorted(expected - rows):
+                add(actor_id, ctype.id, content_id, permission_id, True)
+            for actor_id, permission_id in sorted(rows - expected):
+                add(actor_id, ctype.id, content_id, permission_id, False)
+
+        if sample is not None and sample < len(objs):
+            objs = random.sample(objs, sample)
+
+        for obj in objs:
+            content_id = str(obj.id)
+            rows = materialized.get(content_id, set())
+            for actor in actors:
+                for permission_id, codename in codenames.items():
+                    permitted = permissions.utils._walk_permission(obj, actor, codename, [])
+                    if permitted != ((actor.id, permission_id) in rows):
+                        add(actor.id, ctype.id, content_id, permission_id, permitted)
+
+        # Rows of objects which don't exist anymore
+        for content_id in set(materialized) - set([str(obj.id) for obj in
+            model._default_manager.all()]):
+            for actor_id, permission_id in sorted(materialized[content_id]):
+                add(actor_id, ctype.id, content_id, permission_id, False)
+    return errors
+
+def _refresh_saved_object(sender, instance, created=False, **kwargs):
+    """Refreshes the permissions of a created object and of a moved object
+    and its descendants.
+    """
+    if not is_enabled():
+        return
+
+    # The closure table must be up to date before the descendants are taken
+    # from it. Usually its own handler has updated it already and remembered
+    # whether the object moved.
+    moved = False
+    if permissions.hierarchy.is_registered(instance):
+        moved = permissions.hierarchy.update(instance) or \
+            getattr(instance, "_permissions_moved", False)
+        instance._permissions_moved = False
+
+    if created or moved:
+        refresh_subtree(instance)
+
+def _remove_deleted_object(sender, instance, **kwargs):
+    """Removes the permissions of a deleted object.
+    """
+    if is_enabled():
+        ctype = ContentType.objects.get_for_model(instance)
+        EffectivePermission.objects.filter(content_type=ctype, content_id=str(instance.id)).delete()
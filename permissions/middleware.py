@@ -0,0 +1,78 @@
+# permissions imports
+import permissions.cache
+import permissions.utils
+from permissions.models import Actor
+
+# The session key of the id of the active actor.
+ACTOR_SESSION_KEY = "permissions_actor_id"
+
+class PermissionCacheMiddleware(object):
+    """Enables the request scoped permission cache for each request. Add it to
+    MIDDLEWARE_CLASSES like so::
+
+        MIDDLEWARE_CLASSES = (
+            ...
+            'permissions.middleware.PermissionCacheMiddleware',
+            'django.middleware.transaction.TransactionMiddleware',
+        )
+
+    It must be listed before the TransactionMiddleware, so that the shared
+    cache is invalidated again after the transaction has ended (see
+    ``permissions.cache.commit``).
+    """
+    def process_request(self, request):
+        permissions.cache.enable()
+
+    def process_response(self, request, response):
+        permissions.cache.disable()
+        permissions.cache.commit()
+        return response
+
+    def process_exception(self, request, exception):
+        permissions.cache.disable()
+        permissions.cache.commit()
+
+class ActiveActorMiddleware(object):
+    """Resolves the active actor of the current user once per request and
+    exposes it as ``request.actor``, an ``ActorContext`` with the ids of the
+    actor's groups and global roles loaded (see
+    ``permissions.utils.get_actor_context``), or None. Add it after the
+    authentication middleware::
+
+        MIDDLEWARE_CLASSES = (
+            ...
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'permissions.middleware.ActiveActorMiddleware',
+        )
+
+    The active actor is the one whose id is stored within the session under
+    ``ACTOR_SESSION_KEY``, otherwise the oldest active actor of the user.
+    """
+    def process_request(self, request):
+        actor = self.get_actor(request)
+        if actor is None:
+            request.actor = None
+        else:
+            request.actor = permissions.utils.get_actor_context(actor)
+
+    def get_actor(self, request):
+        """Returns the active actor of passed request or None.
+        """
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated():
+            return None
+
+        actors = permissions.utils.get_actors(user).filter(
+            is_active=True, suspended=False)
+
+        session = getattr(request, "session", None)
+        if session is not None and session.get(ACTOR_SESSION_KEY):
+            try:
+                return actors.get(pk=session[ACTOR_SESSION_KEY])
+            except Actor.DoesNotExist:
+                pass
+
+        actors = list(actors[:1])
+        if actors:
+            return actors[0]
+        return None
@@ -5,8 +5,6 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext_lazy as _
-from django.contrib import auth
-import logging
 import uuid
 def make_uuid():
     return uuid.uuid1().hex
@@ -19,30 +17,6 @@ class ActorGroup(models.Model):
     class Meta:
         ordering = ("name", )
 
-def _actor_has_perm(actor, perm, obj):
-    logging.error("actor_has_perm #%s# #%s# #%s#" % (actor, perm, obj))
-    for backend in auth.get_backends():
-        logging.error("using backend %s" % (backend))
-        if hasattr(backend, "has_perm"):
-            logging.error("using has_perm")
-            if obj is not None:
-                if (backend.supports_object_permissions and
-                    backend.has_perm(actor, perm, obj)):
-                        return True
-            else:
-                if backend.has_perm(actor, perm):
-                    return True
-    return False
-
-
-def _actor_has_module_perms(actor, app_label):
-    for backend in auth.get_backends():
-        if hasattr(backend, "has_module_perms"):
-            if backend.has_module_perms(actor, app_label):
-                return True
-    return False
-
-
 class Actor(models.Model):
     """
     Actors are one level of abstraction provided for uniquely identifying a role or set of roles for a given user.
@@ -86,7 +60,7 @@ class Actor(models.Model):
             return False
 
         # Otherwise we need to check the backends.
-        return _actor_has_perm(self, perm, obj)
+        return permissions.dispatch.has_perm(self, perm, obj)
 
     def has_perms(self, perm_list, obj=None):
         """
@@ -94,10 +68,12 @@ class Actor(models.Model):
         If object is passed, it checks if the user has all required perms
         for this object.
         """
-        for perm in perm_list:
-            if not self.has_perm(perm, obj):
-                return False
-        return True
+        if not self.is_active:
+            return False
+        if self.suspended:
+            return False
+
+        return permissions.dispatch.has_perms(self, perm_list, obj)
 
     def has_module_perms(self, app_label):
         """
@@ -107,15 +83,17 @@ class Actor(models.Model):
         if not self.is_active:
             return False
 
-        if self.is_suspended:
+        if self.suspended:
             return False
 
-        return _actor_has_module_perms(self, app_label)
+        return permissions.dispatch.has_module_perms(self, app_label)
 
 
 
 
 # permissions imports
+import permissions.context
+import permissions.dispatch
 import permissions.utils
 
 class Permission(models.Model):
@@ -179,7 +157,7 @@ class ObjectPermissionInheritanceBlock(models.Model):
     permission = models.ForeignKey(Permission, verbose_name=_(u"Permission"))
 
     content_type = models.ForeignKey(ContentType, verbose_name=_(u"Content type"))
-    content_id = models.PositiveIntegerField(verbose_name=_(u"Content id"))
+    content_id = models.CharField(max_length=32, verbose_name=_(u"Content id"))
     content = generic.GenericForeignKey(ct_field="content_type", fk_field="content_id")
 
     def __unicode__(self):
@@ -255,6 +233,12 @@ class PrincipalRoleRelation(models.Model):
 
     content
         The content object which gets the local role (optional).
+
+    relation_key
+        Identifies the principal, role and content of the relation, see
+        ``get_relation_key``. It is set on save and unique. Updates via
+        ``QuerySet.update()`` leave it stale, use
+        ``permissions.utils.remove_duplicate_role_relations`` afterwards.
     """
     actor = models.ForeignKey(Actor, verbose_name=_(u"Actor"), blank=True, null=True)
     group = models.ForeignKey(ActorGroup, verbose_name=_(u"ActorGroup"), blank=True, null=True)
@@ -264,8 +248,24 @@ class PrincipalRoleRelation(models.Model):
     content_id = models.CharField(max_length=32, verbose_name=_(u"Content id"), blank=True, null=True)
     content = generic.GenericForeignKey(ct_field="content_type", fk_field="content_id")
 
+    relation_key = models.CharField(max_length=255, unique=True, blank=True, null=True, editable=False)
+
     class Meta:
         order_with_respect_to='role'
+
+    def save(self, *args, **kwargs):
+        self.relation_key = self.get_relation_key(self.actor_id, self.group_id,
+            self.role_id, self.content_type_id, self.content_id)
+        super(PrincipalRoleRelation, self).save(*args, **kwargs)
+
+    @staticmethod
+    def get_relation_key(actor_id, group_id, role_id, content_type_id, content_id):
+        """Returns the key which identifies a relation with passed values.
+        Unlike the values themselves it is never NULL, hence the unique index
+        on it also prevents duplicate global roles.
+        """
+        return "|".join([value is not None and str(value) or ""
+            for value in (actor_id, group_id, role_id, content_type_id, content_id)])
     
     def __unicode__(self):
         if self.actor:
@@ -283,9 +283,100 @@ class PrincipalRoleRelation(models.Model):
     def set_principal(self, principal):
         """Sets the principal.
         """
-        if isinstance(principal, Actor):
+        if isinstance(principal, permissions.context.ActorContext):
+            self.actor = principal.actor
+        elif isinstance(principal, Actor):
             self.actor = principal
         else:
             self.group = principal
 
-    principal = property(get_principal, set_principal)
\ No newline at end of file
+    principal = property(get_principal, set_principal)
+
+class ActorRoleIndex(models.Model):
+    """Index of the effective global roles of an actor, i.e. its direct global
+    roles and the global roles of its groups. It is maintained by
+    ``permissions.listeners`` and used by ``get_roles`` if
+    ``PERMISSIONS_ROLE_INDEX`` is True.
+
+    **Attributes:**
+
+    actor
+        The actor which has the role.
+
+    role
+        The role the actor has globally.
+    """
+    actor = models.ForeignKey(Actor, verbose_name=_(u"Actor"))
+    role = models.ForeignKey(Role, verbose_name=_(u"Role"))
+
+    class Meta:
+        unique_together = ("actor", "role")
+
+    def __unicode__(self):
+        return "%s - %s" % (self.actor.name, self.role)
+
+class EffectivePermission(models.Model):
+    """A permission an actor effectively has for a content object, derived
+    from grants, roles, group memberships, the ancestors of the object and
+    inheritance blocks. These rows are maintained by
+    ``permissions.materialized`` if ``PERMISSIONS_MATERIALIZE`` is True.
+
+    **Attributes:**
+
+    actor
+        The actor which has the permission.
+
+    permission
+        The permission the actor has.
+
+    content
+        The object for which the actor has the permission.
+    """
+    actor = models.ForeignKey(Actor, verbose_name=_(u"Actor"))
+    permission = models.ForeignKey(Permission, verbose_name=_(u"Permission"))
+
+    content_type = models.ForeignKey(ContentType, verbose_name=_(u"Content type"))
+    content_id = models.CharField(max_length=32, verbose_name=_(u"Content id"))
+    content = generic.GenericForeignKey(ct_field="content_type", fk_field="content_id")
+
+    class Meta:
+        unique_together = ("actor", "content_type", "content_id", "permission")
+
+    def __unicode__(self):
+        return "%s / %s / %s - %s" % (self.actor.name, self.permission.name, self.content_type, self.content_id)
+
+class PermissionAncestor(models.Model):
+    """An ancestor of a content object within the permission hierarchy, i.e.
+    one row of the closure of ``get_parent_for_permissions()``. Each object
+    of a registered model also has a row for itself with depth 0. These rows
+    are maintained by ``permissions.hierarchy``.
+
+    **Attributes:**
+
+    content
+        The content object.
+
+    ancestor
+        The ancestor of the content object.
+
+    depth
+        The distance between the content object and its ancestor.
+    """
+    content_type = models.ForeignKey(ContentType, verbose_name=_(u"Content type"), related_name="permission_ancestors")
+    content_id = models.CharField(max_length=32, verbose_name=_(u"Content id"), db_index=True)
+    content = generic.GenericForeignKey(ct_field="content_type", fk_field="content_id")
+
+    ancestor_type = models.ForeignKey(ContentType, verbose_name=_(u"Ancestor type"), related_name="permission_descendants")
+    ancestor_id = models.CharField(max_length=32, verbose_name=_(u"Ancestor id"), db_index=True)
+    ancestor = generic.GenericForeignKey(ct_field="ancestor_type", fk_field="ancestor_id")
+
+    depth = models.PositiveIntegerField(verbose_name=_(u"Depth"))
+
+    class Meta:
+        unique_together = ("content_type", "content_id", "ancestor_type", "ancestor_id")
+
+    def __unicode__(self):
+        return "%s - %s / %s - %s (%s)" % (self.content_type, self.content_id, self.ancestor_type, self.ancestor_id, self.depth)
+
+# permissions imports
+import permissions.listeners
@@ -0,0 +1,3 @@
+-- Covers the lookups of grants by content and permission (and role).
+CREATE INDEX permissions_objectpermission_content_permission ON permissions_objectpermission (content_type_id, content_id, permission_id, role_id);
+CREATE INDEX permissions_objectpermission_content_role ON permissions_objectpermission (content_type_id, content_id, role_id);
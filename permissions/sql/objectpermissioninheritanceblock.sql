@@ -0,0 +1,2 @@
+-- Covers the lookups of inheritance blocks by content and permission.
+CREATE INDEX permissions_objectpermissioninheritanceblock_content ON permissions_objectpermissioninheritanceblock (content_type_id, content_id, permission_id);
@@ -0,0 +1,2 @@
+-- Covers the lookups of local roles by content.
+CREATE INDEX permissions_principalrolerelation_content ON permissions_principalrolerelation (content_type_id, content_id, role_id);
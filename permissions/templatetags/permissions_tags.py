@@ -1,19 +1,52 @@
 # django imports
 from django import template
+from django.contrib.contenttypes.models import ContentType
 
 import permissions.utils
 register = template.Library()
 
+# The attribute of the context which holds the memo of permission results.
+MEMO_ATTRIBUTE = "_permissions_memo"
+
+def _get_memo(context):
+    """Returns the memo of permission results of the current rendering. It is
+    stored on the context object itself, so that it outlives the scopes of the
+    tags which fill it without being written into the passed dicts.
+    """
+    memo = getattr(context, MEMO_ATTRIBUTE, None)
+    if memo is None:
+        memo = {}
+        setattr(context, MEMO_ATTRIBUTE, memo)
+    return memo
+
+def _get_memo_key(actor, obj, codename):
+    """Returns the key of the permission result within the memo.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    return (permissions.utils._get_principal_type(actor), actor.id, ctype.id, str(obj.id), codename)
+
+def _get_actor(context, actor):
+    """Returns the resolved actor variable, the active actor of the current
+    request (see ``ActiveActorMiddleware``) or its user.
+    """
+    if actor is not None:
+        return actor.resolve(context)
+
+    request = context.get("request")
+    if getattr(request, "actor", None) is not None:
+        return request.actor
+    return request.user
+
 class PermissionComparisonNode(template.Node):
-    """Implements a node to provide an if current user has passed permission 
+    """Implements a node to provide an if current user has passed permission
     for current object.
     """
     @classmethod
     def handle_token(cls, parser, token):
         bits = token.contents.split()
-        if len(bits) != 2:
+        if len(bits) < 2 or len(bits) > 4:
             raise template.TemplateSyntaxError(
-                "'%s' tag takes one argument" % bits[0])
+                "'%s' tag takes one to three arguments" % bits[0])
         end_tag = 'endifhasperm'
         nodelist_true = parser.parse(('else', end_tag))
         token = parser.next_token()
@@ -21,22 +54,74 @@ class PermissionComparisonNode(template.Node):
             nodelist_false = parser.parse((end_tag,))
             parser.delete_first_token()
         else:
-            nodelist_false = ""
+            nodelist_false = template.NodeList()
+
+        obj = actor = None
+        if len(bits) > 2:
+            obj = parser.compile_filter(bits[2])
+        if len(bits) > 3:
+            actor = parser.compile_filter(bits[3])
 
-        return cls(bits[1], nodelist_true, nodelist_false)
+        return cls(bits[1], nodelist_true, nodelist_false, obj, actor)
 
-    def __init__(self, codename, nodelist_true, nodelist_false):
+    def __init__(self, codename, nodelist_true, nodelist_false, obj=None, actor=None):
         self.codename = codename
         self.nodelist_true = nodelist_true
         self.nodelist_false = nodelist_false
+        self.obj = obj
+        self.actor = actor
 
     def render(self, context):
-        obj = context.get("obj")
-        request = context.get("request")
-        if permissions.utils.has_permission(obj, request.user, self.codename):
+        if self.obj is not None:
+            obj = self.obj.resolve(context)
+        else:
+            obj = context.get("obj")
+        actor = _get_actor(context, self.actor)
+
+        memo = _get_memo(context)
+        key = _get_memo_key(actor, obj, self.codename)
+        if key not in memo:
+            memo[key] = permissions.utils.has_permission(obj, actor, self.codename)
+
+        if memo[key]:
             return self.nodelist_true.render(context)
         else:
-            return self.nodelist_false
+            return self.nodelist_false.render(context)
+
+class PrefetchPermissionsNode(template.Node):
+    """Implements a node which checks the passed permissions for all passed
+    objects at once and stores the results for ``ifhasperm``.
+    """
+    @classmethod
+    def handle_token(cls, parser, token):
+        bits = token.split_contents()
+        if len(bits) not in (3, 4):
+            raise template.TemplateSyntaxError(
+                "'%s' tag takes two or three arguments" % bits[0])
+
+        actor = None
+        if len(bits) == 4:
+            actor = parser.compile_filter(bits[3])
+
+        return cls(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), actor)
+
+    def __init__(self, objs, codenames, actor=None):
+        self.objs = objs
+        self.codenames = codenames
+        self.actor = actor
+
+    def render(self, context):
+        objs = self.objs.resolve(context) or []
+        codenames = (self.codenames.resolve(context) or "").split()
+        actor = _get_actor(context, self.actor)
+
+        memo = _get_memo(context)
+        triples = [(actor, obj, codename) for obj in objs for codename in codenames
+            if _get_memo_key(actor, obj, codename) not in memo]
+        results = permissions.utils.has_permissions_batch(triples)
+        for (actor, obj, codename), result in zip(triples, results):
+            memo[_get_memo_key(actor, obj, codename)] = result
+        return ""
 
 @register.tag
 def ifhasperm(parser, token):
@@ -44,3 +129,9 @@ def ifhasperm(parser, token):
     """
     return PermissionComparisonNode.handle_token(parser, token)
 
+@register.tag
+def prefetch_perms(parser, token):
+    """This function provides functionality for the 'prefetch_perms' template
+    tag.
+    """
+    return PrefetchPermissionsNode.handle_token(parser, token)
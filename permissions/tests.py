@@ -1,17 +1,48 @@
+# python imports
+from datetime import datetime
+
 # django imports
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.db.models.signals import pre_save
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.template import Context
+from django.template import Template
 from django.test import TestCase
 from django.test.client import Client
 
 # permissions imports
 from django.test.testcases import TransactionTestCase
+from permissions import PermissionBase
 from permissions.models import Permission, Actor, ActorGroup
 from permissions.models import ObjectPermission
 from permissions.models import ObjectPermissionInheritanceBlock
+from permissions.models import PrincipalRoleRelation
 from permissions.models import Role
-
+from permissions.models import ActorRoleIndex
+from permissions.context import ActorContext
+from permissions.models import EffectivePermission
+from permissions.managers import PermissionManager
+from permissions.middleware import ACTOR_SESSION_KEY
+from permissions.middleware import ActiveActorMiddleware
+from permissions.middleware import PermissionCacheMiddleware
+from permissions.cache import permission_cache
+
+import permissions.backend
+import permissions.cache
+import permissions.catalog
+import permissions.dispatch
+import permissions.hierarchy
+import permissions.materialized
 import permissions.utils
 
 class BackendTestCase(TestCase):
@@ -45,6 +76,61 @@ class BackendTestCase(TestCase):
         result = self.actor.has_perm("view", self.page_1)
         self.assertEqual(result, True)
     
+class DispatchTestCase(TestCase):
+    """Tests the dispatch of permission checks to the backends.
+    """
+    def setUp(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = (
+            'django.contrib.auth.backends.ModelBackend',
+            'permissions.backend.ObjectPermissionsBackend',
+        )
+
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+    def tearDown(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
+        permissions.dispatch.set_trace_hook(None)
+
+    def test_dispatcher(self):
+        """
+        """
+        dispatcher = permissions.dispatch.get_dispatcher()
+        self.failUnless(permissions.dispatch.get_dispatcher() is dispatcher)
+        self.assertEqual(len(dispatcher.perm_checks), 2)
+        self.assertEqual(len(dispatcher.granted_perms_checks), 1)
+        self.assertEqual(len(dispatcher.remaining_perm_checks), 1)
+
+        # A changed setting is picked up
+        settings.AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
+        self.failIf(permissions.dispatch.get_dispatcher() is dispatcher)
+        self.assertEqual(self.actor.has_perm("view", self.page_1), False)
+
+    def test_trace_hook(self):
+        """
+        """
+        events = []
+        permissions.dispatch.set_trace_hook(lambda *args: events.append(args))
+
+        self.assertEqual(self.actor.has_perm("view", self.page_1), True)
+        self.assertEqual(self.actor.has_perms(["view"], self.page_1), True)
+        self.assertEqual(events, [
+            ("has_perm", self.actor, "view", self.page_1, True),
+            ("has_perms", self.actor, ["view"], self.page_1, True),
+        ])
+
+        permissions.dispatch.set_trace_hook(None)
+        self.actor.has_perm("view", self.page_1)
+        self.assertEqual(len(events), 2)
+
 class RoleTestCase(TestCase):
     """
     """    
@@ -181,6 +267,28 @@ class RoleTestCase(TestCase):
         result = permissions.utils.get_global_roles(self.group)
         self.assertEqual(result, [])
 
+    def test_role_ids(self):
+        """
+        """
+        self.page_2.get_parent_for_permissions = lambda: self.page_1
+
+        permissions.utils.add_role(self.group, self.role_1)
+        permissions.utils.add_local_role(self.page_1, self.actor, self.role_2)
+
+        # Global roles, group roles and local roles of ancestors at once
+        self.assertNumQueries(1, lambda: permissions.utils.get_role_ids(self.actor, self.page_2))
+        result = permissions.utils.get_role_ids(self.actor, self.page_2)
+        self.assertEqual(result, set([self.role_1.id, self.role_2.id]))
+
+        result = permissions.utils.get_role_ids(self.actor)
+        self.assertEqual(result, set([self.role_1.id]))
+
+        result = permissions.utils.get_role_ids(self.group, self.page_2)
+        self.assertEqual(result, set([self.role_1.id]))
+
+        result = permissions.utils.get_roles(self.group)
+        self.assertEqual(list(result), [self.role_1])
+
     def test_remove_roles_actor(self):
         """
         """
@@ -657,6 +765,1795 @@ class PermissionTestCase(TestCase):
 
         permissions.utils.reset(self.page_1)
 
+class CollapsedAncestorsTestCase(TestCase):
+    """Tests the collapsed ancestor walk of has_permission.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_3 = FlatPage.objects.create(url="/page-3/", title="Page 3")
+
+        # page_3 -> page_2 -> page_1
+        parents = {self.page_2.id: self.page_1, self.page_3.id: self.page_2}
+        FlatPage.get_parent_for_permissions = lambda page: parents.get(page.id)
+
+        self.view = permissions.utils.register_permission("View", "view")
+
+    def tearDown(self):
+        """
+        """
+        del FlatPage.get_parent_for_permissions
+        settings.PERMISSIONS_COLLAPSE_ANCESTORS = False
+
+    def assertBothModes(self, obj, expected):
+        """Asserts that the walk and the collapsed mode return expected.
+        """
+        settings.PERMISSIONS_COLLAPSE_ANCESTORS = False
+        self.assertEqual(permissions.utils.has_permission(obj, self.actor, "view"), expected)
+        settings.PERMISSIONS_COLLAPSE_ANCESTORS = True
+        self.assertEqual(permissions.utils.has_permission(obj, self.actor, "view"), expected)
+
+    def test_inherited_grant(self):
+        """
+        """
+        self.assertBothModes(self.page_3, False)
+
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        self.assertBothModes(self.page_1, True)
+        self.assertBothModes(self.page_3, True)
+
+    def test_inheritance_block(self):
+        """
+        """
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        permissions.utils.add_inheritance_block(self.page_2, "view")
+
+        self.assertBothModes(self.page_1, True)
+        self.assertBothModes(self.page_2, False)
+        self.assertBothModes(self.page_3, False)
+
+        # A grant on the blocking object itself still counts
+        permissions.utils.grant_permission(self.page_2, self.role_1, "view")
+        self.assertBothModes(self.page_3, True)
+
+    def test_local_role_on_ancestor(self):
+        """
+        """
+        permissions.utils.grant_permission(self.page_1, self.role_2, "view")
+        permissions.utils.add_local_role(self.page_2, self.actor, self.role_2)
+
+        self.assertBothModes(self.page_1, False)
+        self.assertBothModes(self.page_2, True)
+        self.assertBothModes(self.page_3, True)
+
+    def test_num_queries(self):
+        """
+        """
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        permissions.utils.add_inheritance_block(self.page_1, "view")
+
+        settings.PERMISSIONS_COLLAPSE_ANCESTORS = True
+        permissions.utils.has_permission(self.page_3, self.actor, "view")
+
+        self.assertNumQueries(3, permissions.utils.has_permission,
+            self.page_3, self.actor, "view")
+
+class ActiveActorTestCase(TestCase):
+    """Tests the active actor of requests.
+    """
+    def setUp(self):
+        """
+        """
+        permissions.utils.register_permission("View", "view")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.group = permissions.utils.register_group("brights")
+
+        self.user = User.objects.create(username="john")
+        self.actor = Actor.objects.create(name="john", user=self.user)
+        self.actor_2 = Actor.objects.create(name="john-2", user=self.user)
+        self.actor.groups.add(self.group)
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.add_role(self.group, self.role_2)
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        permissions.utils.grant_permission(self.page_1, self.role_2, "view")
+
+    def test_middleware(self):
+        """
+        """
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        request.user = self.user
+
+        middleware = ActiveActorMiddleware()
+        middleware.process_request(request)
+        self.assertEqual(request.actor, self.actor)
+        self.assertEqual(request.actor.group_ids, frozenset([self.group.id]))
+        self.assertEqual(request.actor.global_role_ids, frozenset([self.role_1.id, self.role_2.id]))
+
+        request.session[ACTOR_SESSION_KEY] = self.actor_2.id
+        middleware.process_request(request)
+        self.assertEqual(request.actor.name, "john-2")
+
+        request.user = AnonymousUser()
+        middleware.process_request(request)
+        self.assertEqual(request.actor, None)
+
+    def test_utils(self):
+        """
+        """
+        context = permissions.utils.get_actor_context(self.actor)
+        self.failUnless(isinstance(context, ActorContext))
+
+        # Neither groups nor global roles are queried
+        self.assertNumQueries(0, permissions.utils.get_role_ids, context)
+        self.assertEqual(permissions.utils.get_role_ids(context),
+            set([self.role_1.id, self.role_2.id]))
+
+        self.assertEqual(permissions.utils.has_permission(self.page_1, context, "view"), True)
+        self.assertEqual(permissions.utils.has_permissions_batch([(context, self.page_1, "view")]), [True])
+        self.assertEqual(list(permissions.utils.filter_permitted(
+            FlatPage.objects.all(), context, "view")), [self.page_1])
+
+        # Changes are made for the actor
+        self.assertEqual(permissions.utils.add_local_role(self.page_1, context, self.role_1), True)
+        self.assertEqual(permissions.utils.get_local_roles(self.page_1, self.actor), [self.role_1])
+
+    def test_changes(self):
+        """
+        """
+        context = permissions.utils.get_actor_context(self.actor)
+        page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        permissions.utils.grant_permission(page_2, self.role_1, "view")
+        self.assertEqual(permissions.utils.has_permission(page_2, context, "view"), True)
+
+        # Changes within the process reload the context
+        permissions.utils.remove_role(context, self.role_1)
+        self.assertEqual(context.global_role_ids, frozenset([self.role_2.id]))
+        self.assertEqual(permissions.utils.has_permission(page_2, context, "view"), False)
+
+        permissions.utils.add_role(context, self.role_1)
+        self.assertEqual(permissions.utils.has_permission(page_2, context, "view"), True)
+
+    def test_shared_cache(self):
+        """
+        """
+        settings.PERMISSIONS_CACHE_BACKEND = "locmem://"
+        try:
+            cache = permissions.cache.get_shared_cache()
+            cache.clear()
+            context = permissions.utils.get_actor_context(self.actor)
+
+            # The role is removed by another process
+            PrincipalRoleRelation.objects.filter(group=self.group).update(group=None, actor=self.actor_2)
+            permissions.utils.remove_duplicate_role_relations()
+            permissions.cache.invalidate()
+            permissions.cache._version -= 1
+
+            # The outdated result of the context is not shared
+            self.assertEqual(permissions.utils.has_permission(self.page_1, context, "view"), True)
+            permissions.cache.clear()
+            self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), False)
+        finally:
+            permissions.cache.commit()
+            settings.PERMISSIONS_CACHE_BACKEND = None
+
+    def test_oldest_actor(self):
+        """
+        """
+        Actor.objects.filter(pk=self.actor_2.id).update(created_date=datetime(2000, 1, 1))
+
+        request = RequestFactory().get("/")
+        request.user = self.user
+        ActiveActorMiddleware().process_request(request)
+        self.assertEqual(request.actor, self.actor_2)
+
+class TemplateTagsTestCase(TestCase):
+    """Tests the permission template tags.
+    """
+    def setUp(self):
+        """
+        """
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.register_permission("Edit", "edit")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.pages = []
+        for i in range(5):
+            page = FlatPage.objects.create(url="/page-%s/" % i, title="Page %s" % i)
+            self.pages.append(page)
+        for page in self.pages[:3]:
+            permissions.utils.grant_permission(page, self.role_1, "view")
+
+    def test_ifhasperm(self):
+        """
+        """
+        template = Template("{% load permissions_tags %}"
+            "{% ifhasperm view page actor %}yes{% else %}no{% endifhasperm %}")
+        self.assertEqual(template.render(Context({"page": self.pages[0], "actor": self.actor})), "yes")
+        self.assertEqual(template.render(Context({"page": self.pages[4], "actor": self.actor})), "no")
+
+        # The memo is not written into the passed dict
+        data = {"page": self.pages[0], "actor": self.actor}
+        self.assertEqual(template.render(Context(data)), "yes")
+        permissions.utils.remove_permission(self.pages[0], self.role_1, "view")
+        self.assertEqual(template.render(Context(data)), "no")
+        self.assertEqual(sorted(data.keys()), ["actor", "page"])
+
+    def test_prefetch_perms(self):
+        """
+        """
+        template = Template("{% load permissions_tags %}"
+            "{% prefetch_perms pages \"view edit\" actor %}"
+            "{% for page in pages %}"
+            "{% ifhasperm view page actor %}v{% endifhasperm %}"
+            "{% ifhasperm edit page actor %}e{% else %}-{% endifhasperm %}"
+            "{% endfor %}")
+
+        context = Context({"pages": self.pages, "actor": self.actor})
+        permissions.catalog.load()
+        ContentType.objects.get_for_model(FlatPage)
+
+        # One bulk evaluation, the loop is answered from the memo
+        self.assertNumQueries(4, lambda: template.render(context))
+        self.assertEqual(template.render(Context({"pages": self.pages, "actor": self.actor})),
+            "v-v-v---")
+
+class ModulePermsTestCase(TestCase):
+    """Tests all permissions and module permissions of the backend.
+    """
+    def setUp(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = ('permissions.backend.ObjectPermissionsBackend',)
+        permissions.catalog.clear()
+
+        self.view = permissions.utils.register_permission("View", "view", [FlatPage])
+        self.edit = permissions.utils.register_permission("Edit", "edit")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        permissions.utils.add_local_role(self.page_1, self.actor, self.role_1)
+
+    def tearDown(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
+
+    def test_get_all_permissions(self):
+        """
+        """
+        backend = permissions.backend.ObjectPermissionsBackend()
+        self.assertEqual(backend.get_all_permissions(self.actor), set())
+
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        actor = Actor.objects.get(pk=self.actor.id)
+        self.assertEqual(backend.get_all_permissions(actor), set(["view"]))
+        self.assertEqual(backend.get_all_permissions(actor, self.page_1), set(["view"]))
+
+        # Cached on the actor
+        self.assertNumQueries(0, lambda: backend.get_all_permissions(actor))
+
+    def test_unrelated_local_grants(self):
+        """
+        """
+        backend = permissions.backend.ObjectPermissionsBackend()
+        page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+
+        # The local role on page_1 doesn't reach grants on page_2
+        permissions.utils.grant_permission(page_2, self.role_1, "view")
+        self.assertEqual(backend.get_all_permissions(self.actor), set())
+        self.assertEqual(self.actor.has_module_perms("flatpages"), False)
+
+        # Unless page_2 is a descendant of page_1
+        FlatPage.get_parent_for_permissions = lambda page: page.id == page_2.id and self.page_1 or None
+        permissions.hierarchy.register(FlatPage)
+        try:
+            permissions.hierarchy.rebuild()
+            actor = Actor.objects.get(pk=self.actor.id)
+            self.assertEqual(backend.get_all_permissions(actor), set(["view"]))
+            self.assertEqual(actor.has_module_perms("flatpages"), True)
+        finally:
+            permissions.hierarchy.unregister(FlatPage)
+            del FlatPage.get_parent_for_permissions
+
+        # Grants to global roles count for any object
+        permissions.utils.grant_permission(page_2, self.role_1, "edit")
+        actor = Actor.objects.create(name="jane")
+        permissions.utils.add_role(actor, self.role_1)
+        self.assertEqual(backend.get_all_permissions(actor), set(["view", "edit"]))
+
+    def test_has_module_perms(self):
+        """
+        """
+        self.assertEqual(self.actor.has_module_perms("flatpages"), False)
+
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        actor = Actor.objects.get(pk=self.actor.id)
+        self.assertEqual(actor.has_module_perms("flatpages"), True)
+        self.assertEqual(actor.has_module_perms("sites"), False)
+
+        # The index follows the content types of permissions
+        self.edit.content_types.add(ContentType.objects.get_for_model(Actor))
+        permissions.utils.grant_permission(self.page_1, self.role_1, "edit")
+        actor = Actor.objects.get(pk=self.actor.id)
+        self.assertEqual(actor.has_module_perms("permissions"), True)
+
+        actor.suspended = True
+        self.assertEqual(actor.has_module_perms("flatpages"), False)
+
+class PermissionMaskTestCase(TestCase):
+    """Tests the evaluation of many permissions at once.
+    """
+    def setUp(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = (
+            'django.contrib.auth.backends.ModelBackend',
+            'permissions.backend.ObjectPermissionsBackend',
+        )
+
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_2.get_parent_for_permissions = lambda: self.page_1
+
+        self.view = permissions.utils.register_permission("View", "view")
+        self.edit = permissions.utils.register_permission("Edit", "edit")
+        self.delete = permissions.utils.register_permission("Delete", "delete")
+
+        # view is inherited, edit is blocked, delete is granted on page_2
+        permissions.utils.grant_permissions([self.page_1], [self.role_1], ["view", "edit"])
+        permissions.utils.grant_permission(self.page_2, self.role_1, "delete")
+        permissions.utils.add_inheritance_block(self.page_2, "edit")
+
+    def tearDown(self):
+        """
+        """
+        settings.AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.ModelBackend',)
+
+    def test_mask(self):
+        """
+        """
+        mask = permissions.utils.get_permission_mask(self.page_2, self.actor)
+        self.assertEqual(mask, permissions.utils.get_permissions_bits(["view", "delete"]))
+
+        for codename in ("view", "edit", "delete"):
+            self.assertEqual(bool(mask & permissions.utils.get_permission_bit(codename)),
+                permissions.utils.has_permission(self.page_2, self.actor, codename))
+
+        # roles, grants and blocks
+        permissions.catalog.load()
+        self.assertNumQueries(3, permissions.utils.get_permission_mask, self.page_2, self.actor)
+
+    def test_mask_codename(self):
+        """
+        """
+        # A cached check of a permission called "mask" isn't taken as the mask
+        permissions.utils.register_permission("Mask", "mask")
+        permissions.utils.grant_permission(self.page_2, self.role_1, "mask")
+
+        permissions.cache.enable()
+        try:
+            self.assertEqual(permissions.utils.has_permission(self.page_2, self.actor, "mask"), True)
+            self.assertEqual(permissions.utils.get_permissions(self.page_2, self.actor),
+                set(["view", "delete", "mask"]))
+            self.assertEqual(permissions.utils.has_permission(self.page_2, self.actor, "mask"), True)
+        finally:
+            permissions.cache.disable()
+
+    def test_get_permissions(self):
+        """
+        """
+        self.assertEqual(permissions.utils.get_permissions(self.page_2, self.actor), set(["view", "delete"]))
+        self.assertEqual(permissions.utils.get_permissions(self.page_1, self.actor), set(["view", "edit"]))
+
+        role_2 = permissions.utils.register_role("Role 2")
+        permissions.utils.grant_permission(self.page_2, role_2, "edit")
+        self.assertEqual(permissions.utils.get_permissions(self.page_2, self.actor, [role_2]),
+            set(["view", "edit", "delete"]))
+
+        # The same budget as a single check
+        permissions.catalog.load()
+        permissions.utils.get_permissions(self.page_1, self.actor)
+        self.assertNumQueries(3, permissions.utils.get_permissions, self.page_2, self.actor)
+
+    def test_has_permissions(self):
+        """
+        """
+        self.assertEqual(permissions.utils.has_permissions(self.page_2, self.actor, ["view", "delete"]), True)
+        self.assertEqual(permissions.utils.has_permissions(self.page_2, self.actor, ["view", "edit"]), False)
+        self.assertEqual(permissions.utils.has_permissions(self.page_2, self.actor, ["view", "unknown"]), False)
+
+        self.assertEqual(permissions.utils.has_any_permission(self.page_2, self.actor, ["edit", "view"]), True)
+        self.assertEqual(permissions.utils.has_any_permission(self.page_2, self.actor, ["edit", "unknown"]), False)
+
+    def test_actor_has_perms(self):
+        """
+        """
+        self.assertEqual(self.actor.has_perms(["view", "delete"], self.page_2), True)
+        self.assertEqual(self.actor.has_perms(["view", "edit"], self.page_2), False)
+        self.assertEqual(self.actor.has_perms(["view", "edit"], self.page_1), True)
+
+class PermittedActorsTestCase(TestCase):
+    """Tests the lookup of the actors which have a permission.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.view = permissions.utils.register_permission("View", "view")
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_2.get_parent_for_permissions = lambda: self.page_1
+
+        self.group = ActorGroup.objects.create(name="brights")
+        self.john = Actor.objects.create(name="john")
+        self.jane = Actor.objects.create(name="jane")
+        self.jim = Actor.objects.create(name="jim", is_active=False)
+        self.joe = Actor.objects.create(name="joe")
+        self.jane.groups.add(self.group)
+        self.jim.groups.add(self.group)
+
+        permissions.utils.add_role(self.john, self.role_1)
+        permissions.utils.add_role(self.group, self.role_1)
+        permissions.utils.add_local_role(self.page_2, self.joe, self.role_2)
+        permissions.utils.grant_permissions([self.page_1], [self.role_1, self.role_2], ["view"])
+
+    def assertActors(self, obj, actors, **kwargs):
+        """
+        """
+        result = permissions.utils.get_permitted_actors(obj, "view", **kwargs)
+        self.assertEqual(set(result), set(actors))
+        for actor in actors:
+            self.assertEqual(permissions.utils.has_permission(obj, actor, "view"), True)
+
+    def test_permitted_actors(self):
+        """
+        """
+        self.assertActors(self.page_1, [self.john, self.jane, self.jim])
+        self.assertActors(self.page_2, [self.john, self.jane, self.jim, self.joe])
+        self.assertActors(self.page_2, [self.john, self.jane, self.joe], is_active=True)
+        self.assertEqual(list(permissions.utils.get_permitted_actors(self.page_2, "unknown")), [])
+
+    def test_inheritance_block(self):
+        """
+        """
+        permissions.utils.add_inheritance_block(self.page_2, "view")
+        self.assertActors(self.page_2, [])
+
+        permissions.utils.grant_permission(self.page_2, self.role_2, "view")
+        self.assertActors(self.page_2, [self.joe])
+
+class PrefetchPermissionsTestCase(TestCase):
+    """Tests the prefetch of permissions for many objects.
+    """
+    def setUp(self):
+        """
+        """
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.register_permission("Edit", "edit")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.other = Actor.objects.create(name="jane")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.root = FlatPage.objects.create(url="/root/", title="Root")
+        self.pages = [FlatPage.objects.create(url="/page-%s/" % i, title="Page %s" % i)
+            for i in range(3)]
+
+        parents = dict([(page.id, self.root) for page in self.pages])
+        FlatPage.get_parent_for_permissions = lambda page: parents.get(page.id)
+        FlatPage.has_permission = PermissionBase.__dict__["has_permission"]
+
+        permissions.utils.grant_permission(self.root, self.role_1, "view")
+        permissions.utils.add_inheritance_block(self.pages[2], "view")
+
+    def tearDown(self):
+        """
+        """
+        del FlatPage.get_parent_for_permissions
+        del FlatPage.has_permission
+
+    def test_prefetch_permissions(self):
+        """
+        """
+        permissions.catalog.load()
+        queryset = FlatPage.objects.filter(pk__in=[page.id for page in self.pages]).order_by("id")
+        pages = permissions.utils.prefetch_permissions(queryset, self.actor, ["view", "edit"])
+        self.assertEqual([page._allowed_perms for page in pages],
+            [frozenset(["view"]), frozenset(["view"]), frozenset()])
+
+        # Answered from memory
+        self.assertNumQueries(0, lambda: [page.has_permission(self.actor, "view") for page in pages])
+        self.assertEqual(pages[0].has_permission(self.actor, "edit"), False)
+        self.assertEqual(pages[2].has_permission(self.actor, "view"), False)
+
+        # Other actors and codenames are checked as usual
+        self.assertEqual(pages[0].has_permission(self.other, "view"), False)
+        permissions.utils.register_permission("Delete", "delete")
+        permissions.utils.grant_permission(self.root, self.role_1, "delete")
+        self.assertEqual(pages[0].has_permission(self.actor, "delete"), True)
+
+class BatchCheckTestCase(TestCase):
+    """Tests the checking of many permissions at once.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.register_permission("Edit", "edit")
+
+        self.pages = [FlatPage.objects.create(url="/%s/" % i, title="%s" % i) for i in range(4)]
+        parents = {self.pages[1].id: self.pages[0], self.pages[2].id: self.pages[1]}
+        FlatPage.get_parent_for_permissions = lambda page: parents.get(page.id)
+
+        self.group = ActorGroup.objects.create(name="brights")
+        self.john = Actor.objects.create(name="john")
+        self.jane = Actor.objects.create(name="jane")
+        self.jane.groups.add(self.group)
+
+        permissions.utils.add_role(self.john, self.role_1)
+        permissions.utils.add_role(self.group, self.role_2)
+        permissions.utils.add_local_role(self.pages[1], self.john, self.role_2)
+
+        permissions.utils.grant_permissions(self.pages[:1], [self.role_1, self.role_2], ["view"])
+        permissions.utils.grant_permission(self.pages[0], self.role_2, "edit")
+        permissions.utils.grant_permission(self.pages[3], self.role_1, "edit")
+        permissions.utils.add_inheritance_block(self.pages[2], "edit")
+
+    def tearDown(self):
+        """
+        """
+        del FlatPage.get_parent_for_permissions
+
+    def test_batch(self):
+        """
+        """
+        triples = []
+        for actor in (self.john, self.jane, self.group):
+            for page in self.pages:
+                for codename in ("view", "edit", "unknown"):
+                    triples.append((actor, page, codename))
+
+        expected = [permissions.utils.has_permission(page, actor, codename)
+            for actor, page, codename in triples]
+        self.failUnless(True in expected)
+        self.assertEqual(permissions.utils.has_permissions_batch(triples), expected)
+        self.assertEqual(permissions.utils.has_permissions_batch([]), [])
+
+    def test_queries(self):
+        """
+        """
+        triples = [(actor, page, "view") for actor in (self.john, self.jane) for page in self.pages]
+        permissions.catalog.load()
+
+        # memberships, roles, grants and blocks
+        self.assertNumQueries(4, permissions.utils.has_permissions_batch, triples)
+
+class FilterPermittedTestCase(TestCase):
+    """Tests filtering of querysets by permissions.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.role_3 = permissions.utils.register_role("Role 3")
+
+        self.actor = Actor.objects.create(name="john")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.actor.groups.add(self.group)
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_3 = FlatPage.objects.create(url="/page-3/", title="Page 3")
+        self.page_4 = FlatPage.objects.create(url="/page-4/", title="Page 4")
+
+        self.view = permissions.utils.register_permission("View", "view")
+        self.edit = permissions.utils.register_permission("Edit", "edit")
+
+        # Global role
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        # Local role
+        permissions.utils.grant_permission(self.page_2, self.role_2, "view")
+        permissions.utils.add_local_role(self.page_2, self.actor, self.role_2)
+        # Local role via group
+        permissions.utils.grant_permission(self.page_3, self.role_3, "view")
+        permissions.utils.add_local_role(self.page_3, self.group, self.role_3)
+        # Other permission only
+        permissions.utils.grant_permission(self.page_4, self.role_1, "edit")
+        # Local role on another object
+        permissions.utils.grant_permission(self.page_4, self.role_2, "view")
+
+    def test_filter_permitted(self):
+        """
+        """
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+        self.assertEqual(set(result), set([self.page_1, self.page_2, self.page_3]))
+
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "edit")
+        self.assertEqual(list(result), [self.page_4])
+
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "hurz")
+        self.assertEqual(list(result), [])
+
+        owner = permissions.utils.register_role("Owner")
+        permissions.utils.grant_permission(self.page_4, owner, "view")
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view", [owner])
+        self.assertEqual(set(result), set([self.page_1, self.page_2, self.page_3, self.page_4]))
+
+    def test_matches_has_permission(self):
+        """
+        """
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+        expected = [page for page in FlatPage.objects.all()
+            if permissions.utils.has_permission(page, self.actor, "view")]
+        self.assertEqual(set(result), set(expected))
+
+    def test_num_queries(self):
+        """
+        """
+        queryset = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+        self.assertNumQueries(1, list, queryset)
+
+    def test_hierarchy(self):
+        """
+        """
+        parents = {self.page_4.id: self.page_1}
+        FlatPage.get_parent_for_permissions = lambda page: parents.get(page.id)
+        try:
+            # Hierarchical models need the closure table
+            self.assertRaises(ImproperlyConfigured, permissions.utils.filter_permitted,
+                FlatPage.objects.all(), self.actor, "view")
+
+            permissions.hierarchy.register(FlatPage)
+            permissions.hierarchy.rebuild()
+            result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+            self.assertEqual(set(result), set([self.page_1, self.page_2, self.page_3, self.page_4]))
+
+            permissions.utils.add_inheritance_block(self.page_4, "view")
+            result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+            self.assertEqual(set(result), set([self.page_1, self.page_2, self.page_3]))
+        finally:
+            permissions.hierarchy.unregister(FlatPage)
+            del FlatPage.get_parent_for_permissions
+
+    def test_manager(self):
+        """
+        """
+        manager = PermissionManager()
+        manager.model = FlatPage
+
+        result = manager.permitted(self.actor, "edit")
+        self.assertEqual(list(result), [self.page_4])
+
+        result = manager.filter(url="/page-1/").permitted(self.actor, "view")
+        self.assertEqual(list(result), [self.page_1])
+
+class PermissionCacheTestCase(TestCase):
+    """Tests the request scoped permission cache.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.actor_2 = Actor.objects.create(name="jane")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.view = permissions.utils.register_permission("View", "view")
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+    def tearDown(self):
+        """
+        """
+        permissions.cache.disable()
+
+    def test_cache(self):
+        """
+        """
+        with permission_cache():
+            result = permissions.utils.has_permission(self.page_1, self.actor, "view")
+            self.assertEqual(result, True)
+
+            self.assertNumQueries(0, permissions.utils.has_permission,
+                self.page_1, self.actor, "view")
+
+            # The key covers the actor
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+        # Outside of the block nothing is cached
+        self.assertEqual(permissions.cache.is_enabled(), False)
+
+    def test_invalidation(self):
+        """
+        """
+        with permission_cache():
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+            permissions.utils.add_role(self.actor_2, self.role_1)
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, True)
+
+            permissions.utils.remove_permission(self.page_1, self.role_1, "view")
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+            permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+            permissions.utils.remove_role(self.actor_2, self.role_1)
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+            # Group membership
+            permissions.utils.add_role(self.group, self.role_1)
+            self.actor_2.groups.add(self.group)
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, True)
+
+            self.actor_2.groups.remove(self.group)
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+    def test_roles_not_cached(self):
+        """
+        """
+        owner = permissions.utils.register_role("Owner")
+        permissions.utils.grant_permission(self.page_1, owner, "view")
+
+        with permission_cache():
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view", [owner])
+            self.assertEqual(result, True)
+
+            result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+            self.assertEqual(result, False)
+
+    def test_middleware(self):
+        """
+        """
+        middleware = PermissionCacheMiddleware()
+        middleware.process_request(None)
+        self.assertEqual(permissions.cache.is_enabled(), True)
+
+        permissions.utils.has_permission(self.page_1, self.actor, "view")
+        self.assertNumQueries(0, permissions.utils.has_permission,
+            self.page_1, self.actor, "view")
+
+        middleware.process_response(None, None)
+        self.assertEqual(permissions.cache.is_enabled(), False)
+
+class SharedPermissionCacheTestCase(TestCase):
+    """Tests the shared permission cache.
+    """
+    def setUp(self):
+        """
+        """
+        settings.PERMISSIONS_CACHE_BACKEND = "locmem://"
+        permissions.cache.get_shared_cache().clear()
+
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.actor_2 = Actor.objects.create(name="jane")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.view = permissions.utils.register_permission("View", "view")
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+    def tearDown(self):
+        """
+        """
+        permissions.cache.commit()
+        settings.PERMISSIONS_CACHE_BACKEND = None
+
+    def test_cache(self):
+        """
+        """
+        result = permissions.utils.has_permission(self.page_1, self.actor, "view")
+        self.assertEqual(result, True)
+
+        self.assertNumQueries(0, permissions.utils.has_permission,
+            self.page_1, self.actor, "view")
+
+        result = permissions.utils.get_roles(self.actor, self.page_1)
+        self.assertEqual(list(result), [self.role_1])
+
+        # Only the roles themselves are loaded
+        self.assertNumQueries(1, lambda: list(permissions.utils.get_roles(self.actor, self.page_1)))
+
+    def test_invalidation(self):
+        """
+        """
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, False)
+        result = permissions.utils.get_roles(self.actor_2)
+        self.assertEqual(list(result), [])
+
+        permissions.utils.add_role(self.actor_2, self.role_1)
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, True)
+        result = permissions.utils.get_roles(self.actor_2)
+        self.assertEqual(list(result), [self.role_1])
+
+        permissions.utils.add_inheritance_block(self.page_1, "view")
+        permissions.utils.remove_permission(self.page_1, self.role_1, "view")
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, False)
+
+    def test_group_invalidation(self):
+        """
+        """
+        permissions.utils.add_role(self.group, self.role_1)
+
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, False)
+
+        self.actor_2.groups.add(self.group)
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, True)
+
+        self.group.actor_set.remove(self.actor_2)
+        result = permissions.utils.has_permission(self.page_1, self.actor_2, "view")
+        self.assertEqual(result, False)
+
+    def test_generations(self):
+        """
+        """
+        cache = permissions.cache.get_shared_cache()
+
+        permissions.cache.invalidate()
+        generation = cache.get(permissions.cache.GENERATION_KEY)
+        permissions.cache.invalidate()
+        self.assertEqual(cache.get(permissions.cache.GENERATION_KEY), generation + 1)
+
+        permissions.cache.invalidate([self.actor.id])
+        key = permissions.cache.ACTOR_GENERATION_KEY % self.actor.id
+        generation = cache.get(key)
+        permissions.cache.invalidate([self.actor.id])
+        self.assertEqual(cache.get(key), generation + 1)
+
+    def test_commit(self):
+        """
+        """
+        permissions.cache.commit()
+        self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), True)
+
+        # Results which are cached before the commit, e.g. by other
+        # processes reading the old data, are dropped by the commit.
+        permissions.utils.remove_role(self.actor, self.role_1)
+        permissions.cache.CachedResult(self.actor.id, "Actor", ContentType.objects.get_for_model(
+            self.page_1).id, str(self.page_1.id), "view").set(True)
+        self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), True)
+
+        permissions.cache.commit()
+        self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), False)
+
+class RoleIndexTestCase(TestCase):
+    """Tests the index of the effective global roles of actors.
+    """
+    def setUp(self):
+        """
+        """
+        settings.PERMISSIONS_ROLE_INDEX = True
+
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.actor = Actor.objects.create(name="john")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+
+    def tearDown(self):
+        """
+        """
+        settings.PERMISSIONS_ROLE_INDEX = False
+
+    def assertIndexed(self, roles):
+        """
+        """
+        indexed = ActorRoleIndex.objects.filter(actor=self.actor).values_list("role", flat=True)
+        self.assertEqual(set(indexed), set([role.id for role in roles]))
+        self.assertEqual(set(permissions.utils.get_roles(self.actor)), set(roles))
+
+    def test_actor_roles(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        self.assertIndexed([self.role_1])
+
+        permissions.utils.add_role(self.actor, self.role_2)
+        self.assertIndexed([self.role_1, self.role_2])
+
+        permissions.utils.remove_role(self.actor, self.role_1)
+        self.assertIndexed([self.role_2])
+
+        permissions.utils.remove_roles(self.actor)
+        self.assertIndexed([])
+
+        # Local roles are not indexed
+        permissions.utils.add_local_role(self.page_1, self.actor, self.role_1)
+        self.assertIndexed([])
+        self.assertEqual(list(permissions.utils.get_roles(self.actor, self.page_1)), [self.role_1])
+
+    def test_group_roles(self):
+        """
+        """
+        permissions.utils.add_role(self.group, self.role_1)
+        self.assertIndexed([])
+
+        self.actor.groups.add(self.group)
+        self.assertIndexed([self.role_1])
+
+        # Role of the group and directly
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.remove_role(self.group, self.role_1)
+        self.assertIndexed([self.role_1])
+
+        permissions.utils.add_role(self.group, self.role_2)
+        self.assertIndexed([self.role_1, self.role_2])
+
+        self.group.actor_set.clear()
+        self.assertIndexed([self.role_1])
+
+        self.group.actor_set.add(self.actor)
+        self.assertIndexed([self.role_1, self.role_2])
+
+        self.group.delete()
+        self.assertIndexed([self.role_1])
+
+    def test_num_queries(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        self.assertNumQueries(2, lambda: list(permissions.utils.get_roles(self.actor)))
+
+        # Indexed and local roles are read with one statement
+        self.actor.groups.add(self.group)
+        permissions.utils.add_local_role(self.page_1, self.group, self.role_2)
+        self.assertNumQueries(1, permissions.utils.get_role_ids, self.actor, self.page_1)
+        self.assertEqual(permissions.utils.get_role_ids(self.actor, self.page_1),
+            set([self.role_1.id, self.role_2.id]))
+
+    def test_concurrent_update(self):
+        """
+        """
+        # Another process creates the entry between reading and creating it
+        def create_entry(sender, instance, **kwargs):
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO %s (actor_id, role_id) VALUES (%%s, %%s)" % ActorRoleIndex._meta.db_table,
+                [instance.actor_id, instance.role_id])
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        ActorRoleIndex.objects.all().delete()
+
+        pre_save.connect(create_entry, sender=ActorRoleIndex)
+        try:
+            permissions.utils.update_role_index([self.actor.id])
+        finally:
+            pre_save.disconnect(create_entry, sender=ActorRoleIndex)
+
+        self.assertIndexed([self.role_1])
+
+    def test_rebuild(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.add_role(self.group, self.role_2)
+        self.actor.groups.add(self.group)
+
+        ActorRoleIndex.objects.all().delete()
+        self.assertIndexed([])
+
+        permissions.utils.rebuild_role_index()
+        self.assertIndexed([self.role_1, self.role_2])
+
+class MaterializedPermissionsTestCase(TestCase):
+    """Tests the materialized effective permissions.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.actor = Actor.objects.create(name="john")
+        self.group = ActorGroup.objects.create(name="brights")
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_3 = FlatPage.objects.create(url="/page-3/", title="Page 3")
+
+        # page_3 -> page_2 -> page_1
+        self.parents = {self.page_2.id: self.page_1, self.page_3.id: self.page_2}
+        FlatPage.get_parent_for_permissions = lambda page: self.parents.get(page.id)
+
+        permissions.hierarchy.register(FlatPage)
+        permissions.hierarchy.rebuild()
+        settings.PERMISSIONS_MATERIALIZE = True
+        permissions.materialized.register(FlatPage)
+
+        self.view = permissions.utils.register_permission("View", "view")
+
+    def tearDown(self):
+        """
+        """
+        del FlatPage.get_parent_for_permissions
+        permissions.materialized.unregister(FlatPage)
+        permissions.hierarchy.unregister(FlatPage)
+        settings.PERMISSIONS_MATERIALIZE = False
+
+    def assertPermitted(self, pages):
+        """Asserts that the actor has the view permission exactly for passed
+        pages, both materialized and live.
+        """
+        for page in (self.page_1, self.page_2, self.page_3):
+            self.assertEqual(permissions.utils.has_permission(page, self.actor, "view"), page in pages)
+
+        settings.PERMISSIONS_MATERIALIZE = False
+        for page in (self.page_1, self.page_2, self.page_3):
+            self.assertEqual(permissions.utils.has_permission(page, self.actor, "view"), page in pages)
+        settings.PERMISSIONS_MATERIALIZE = True
+
+    def test_maintenance(self):
+        """
+        """
+        self.assertPermitted([])
+
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        self.assertPermitted([])
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        self.assertPermitted([self.page_1, self.page_2, self.page_3])
+
+        permissions.utils.add_inheritance_block(self.page_2, "view")
+        self.assertPermitted([self.page_1])
+
+        permissions.utils.grant_permission(self.page_2, self.role_2, "view")
+        permissions.utils.add_local_role(self.page_3, self.group, self.role_2)
+        self.assertPermitted([self.page_1])
+
+        self.actor.groups.add(self.group)
+        self.assertPermitted([self.page_1, self.page_3])
+
+        permissions.utils.remove_inheritance_block(self.page_2, "view")
+        permissions.utils.remove_role(self.actor, self.role_1)
+        self.assertPermitted([self.page_3])
+
+        self.actor.groups.remove(self.group)
+        self.assertPermitted([])
+
+        self.assertEqual(permissions.materialized.verify(), [])
+
+    def test_num_queries(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+        self.assertNumQueries(1, permissions.utils.has_permission,
+            self.page_3, self.actor, "view")
+
+    def test_refresh_scope(self):
+        """
+        """
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        permissions.utils.grant_permission(self.page_3, self.role_2, "view")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        # Rows of objects which don't grant to the changed roles and of saved
+        # objects which didn't move are left alone.
+        ctype = ContentType.objects.get_for_model(FlatPage)
+        EffectivePermission.objects.filter(content_type=ctype, content_id=str(self.page_1.id)).delete()
+
+        permissions.utils.add_role(self.actor, self.role_2)
+        self.page_1.save()
+        self.assertEqual(len(permissions.materialized.verify()), 1)
+
+        self.actor.groups.add(self.group)
+        permissions.utils.add_role(self.group, self.role_1)
+        self.assertEqual(permissions.materialized.verify(), [])
+
+    def test_rebuild_and_verify(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+        EffectivePermission.objects.all().delete()
+        errors = permissions.materialized.verify()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(errors[0][3:], ("view", True))
+
+        call_command("permissions_materialize")
+        self.assertEqual(EffectivePermission.objects.count(), 3)
+        self.assertPermitted([self.page_1, self.page_2, self.page_3])
+
+        # Wrong rows are reported as well
+        EffectivePermission.objects.create(actor=self.actor, permission=self.view,
+            content_type=ContentType.objects.get_for_model(FlatPage), content_id="999")
+        EffectivePermission.objects.filter(content_id=str(self.page_2.id)).delete()
+        self.assertEqual(sorted([error[2:] for error in permissions.materialized.verify()]),
+            [(str(self.page_2.id), "view", True), ("999", "view", False)])
+
+    def test_move(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        self.assertPermitted([self.page_1, self.page_2, self.page_3])
+
+        # Move page_2 (and page_3 with it) below page_4
+        page_4 = FlatPage.objects.create(url="/page-4/", title="Page 4")
+        self.parents[self.page_2.id] = page_4
+        self.page_2.save()
+        self.assertPermitted([self.page_1])
+        self.assertEqual(permissions.materialized.verify(), [])
+
+    def test_unregistered_ancestor(self):
+        """
+        """
+        # page_1 -> site, which is neither within the closure table nor
+        # materialized
+        site = Site.objects.get_current()
+        self.parents[self.page_1.id] = site
+        self.page_1.save()
+
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(site, self.role_1, "view")
+        self.assertPermitted([self.page_1, self.page_2, self.page_3])
+
+        permissions.utils.add_inheritance_block(self.page_2, "view")
+        permissions.utils.remove_permission(site, self.role_1, "view")
+        self.assertPermitted([])
+        self.assertEqual(permissions.materialized.verify(sample=None), [])
+
+    def test_verify_against_walk(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+        # The bulk resolution is wrong as well, e.g. by a bug within it
+        get_holder_ids = permissions.utils._get_holder_ids
+        permissions.utils._get_holder_ids = lambda obj, actor_ids=None, permission_id=None: {}
+        try:
+            EffectivePermission.objects.all().delete()
+            self.assertEqual(len(permissions.materialized.verify(sample=None)), 3)
+            self.assertEqual(len(permissions.materialized.verify(sample=1)), 1)
+        finally:
+            permissions.utils._get_holder_ids = get_holder_ids
+
+    def test_register(self):
+        """
+        """
+        permissions.materialized.unregister(FlatPage)
+        permissions.hierarchy.unregister(FlatPage)
+        try:
+            self.assertRaises(ImproperlyConfigured, permissions.materialized.register, FlatPage)
+        finally:
+            permissions.hierarchy.register(FlatPage)
+            permissions.materialized.register(FlatPage)
+
+class HierarchyTestCase(TestCase):
+    """Tests the closure table of the permission hierarchy.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+        self.page_3 = FlatPage.objects.create(url="/page-3/", title="Page 3")
+        self.page_4 = FlatPage.objects.create(url="/page-4/", title="Page 4")
+
+        # page_3 -> page_2 -> page_1, page_4
+        self.parents = {self.page_2.id: self.page_1, self.page_3.id: self.page_2}
+        FlatPage.get_parent_for_permissions = lambda page: self.parents.get(page.id)
+
+        permissions.hierarchy.register(FlatPage)
+        call_command("permissions_rebuild_hierarchy")
+
+        self.view = permissions.utils.register_permission("View", "view")
+
+    def tearDown(self):
+        """
+        """
+        permissions.hierarchy.unregister(FlatPage)
+        del FlatPage.get_parent_for_permissions
+
+    def test_ancestor_keys(self):
+        """
+        """
+        keys = permissions.utils._walk_ancestor_keys(self.page_3)
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(permissions.utils._get_ancestor_keys(self.page_3), keys)
+        self.assertNumQueries(1, permissions.utils._get_ancestor_keys, self.page_3)
+
+        keys = permissions.hierarchy.get_descendant_keys(self.page_1)
+        self.assertEqual([content_id for ctype_id, content_id in keys],
+            [str(self.page_2.id), str(self.page_3.id)])
+
+    def test_move(self):
+        """
+        """
+        # Move page_2 (and page_3 with it) below page_4
+        self.parents[self.page_2.id] = self.page_4
+        self.page_2.save()
+
+        self.assertEqual(permissions.utils._get_ancestor_keys(self.page_3),
+            permissions.utils._walk_ancestor_keys(self.page_3))
+        result = permissions.hierarchy.filter_descendants(FlatPage.objects.all(), self.page_4)
+        self.assertEqual(set(result), set([self.page_2, self.page_3]))
+
+        # Saving without changes doesn't touch the table
+        self.assertEqual(permissions.hierarchy.update(self.page_2), False)
+
+        # Remove page_2, page_3 loses its ancestors
+        del self.parents[self.page_3.id]
+        self.page_2.delete()
+        self.assertEqual(permissions.hierarchy.get_ancestor_keys(self.page_3),
+            permissions.utils._walk_ancestor_keys(self.page_3))
+
+    def test_invalidation(self):
+        """
+        """
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+        with permission_cache():
+            self.assertEqual(permissions.utils.has_permission(self.page_3, self.actor, "view"), True)
+
+            # Move page_2 (and page_3 with it) below page_4
+            self.parents[self.page_2.id] = self.page_4
+            self.page_2.save()
+            self.assertEqual(permissions.utils.has_permission(self.page_3, self.actor, "view"), False)
+
+            self.parents[self.page_2.id] = self.page_1
+            self.page_2.save()
+            self.assertEqual(permissions.utils.has_permission(self.page_3, self.actor, "view"), True)
+
+            # Remove page_2, page_3 loses its ancestors
+            del self.parents[self.page_3.id]
+            self.page_2.delete()
+            self.assertEqual(permissions.utils.has_permission(self.page_3, self.actor, "view"), False)
+
+    def test_filter_descendants(self):
+        """
+        """
+        result = permissions.hierarchy.filter_descendants(FlatPage.objects.all(), self.page_1)
+        self.assertEqual(set(result), set([self.page_2, self.page_3]))
+
+        result = permissions.hierarchy.filter_descendants(FlatPage.objects.all(), self.page_2, include_self=True)
+        self.assertEqual(set(result), set([self.page_2, self.page_3]))
+
+    def assertPermitted(self, pages):
+        """
+        """
+        result = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+        self.assertEqual(set(result), set(pages))
+
+        for page in FlatPage.objects.all():
+            self.assertEqual(permissions.utils.has_permission(page, self.actor, "view"), page in pages)
+
+    def test_filter_permitted(self):
+        """
+        """
+        self.assertPermitted([])
+
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+        self.assertPermitted([self.page_1, self.page_2, self.page_3])
+
+        permissions.utils.add_inheritance_block(self.page_2, "view")
+        self.assertPermitted([self.page_1])
+
+        permissions.utils.grant_permission(self.page_2, self.role_2, "view")
+        permissions.utils.add_local_role(self.page_3, self.actor, self.role_2)
+        self.assertPermitted([self.page_1, self.page_3])
+
+        queryset = permissions.utils.filter_permitted(FlatPage.objects.all(), self.actor, "view")
+        self.assertNumQueries(1, list, queryset)
+
+class BatchParentsTestCase(TestCase):
+    """Tests the batch resolution of ancestor chains.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+        self.view = permissions.utils.register_permission("View", "view")
+
+        self.root = FlatPage.objects.create(url="/root/", title="Root")
+        self.pages = []
+        for i in range(2):
+            parent = FlatPage.objects.create(url="/parent-%s/" % i, title="Parent %s" % i)
+            self.pages.extend([FlatPage.objects.create(url="/page-%s-%s/" % (i, j), title="Page")
+                for j in range(3)])
+            self.parents = getattr(self, "parents", {})
+            self.parents[parent.id] = self.root
+            for page in self.pages[-3:]:
+                self.parents[page.id] = parent
+
+        self.calls = []
+        parents = self.parents
+        calls = self.calls
+        def get_parents_for_permissions(cls, pages):
+            calls.append(len(pages))
+            return [parents.get(page.id) for page in pages]
+
+        FlatPage.get_parent_for_permissions = lambda page: parents.get(page.id)
+        FlatPage.get_parents_for_permissions = classmethod(get_parents_for_permissions)
+
+    def tearDown(self):
+        """
+        """
+        del FlatPage.get_parent_for_permissions
+        del FlatPage.get_parents_for_permissions
+
+    def test_chains(self):
+        """
+        """
+        chains = permissions.utils._get_ancestor_chains(self.pages + [self.root])
+        self.assertEqual(chains, [permissions.utils._walk_ancestor_keys(page)
+            for page in self.pages + [self.root]])
+
+        # One call per level, ancestors are resolved once (the root has been
+        # passed itself)
+        self.assertEqual(self.calls, [7, 2])
+
+    def test_batch_check(self):
+        """
+        """
+        permissions.utils.grant_permission(self.root, self.role_1, "view")
+        permissions.utils.add_inheritance_block(self.parents[self.pages[0].id], "view")
+
+        result = permissions.utils.has_permissions_batch(
+            [(self.actor, page, "view") for page in self.pages])
+        self.assertEqual(result, [False] * 3 + [True] * 3)
+        self.assertEqual(self.calls, [6, 2, 1])
+
+class BulkRolesTestCase(TestCase):
+    """Tests the assignment of many roles at once.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.actor = Actor.objects.create(name="john")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+        self.page_2 = FlatPage.objects.create(url="/page-2/", title="Page 2")
+
+    def test_add_roles(self):
+        """
+        """
+        permissions.utils.add_local_role(self.page_1, self.actor, self.role_1)
+
+        result = permissions.utils.add_roles([
+            (self.actor, self.role_1, self.page_1),
+            (self.actor, self.role_1, self.page_2),
+            (self.actor, self.role_1, self.page_2),
+            (self.actor, self.role_2, None),
+            (self.group, self.role_1, self.page_1),
+            (self.group, self.role_2, None),
+        ], batch_size=2)
+        self.assertEqual(result, 4)
+
+        self.assertEqual(permissions.utils.get_global_roles(self.actor), [self.role_2])
+        self.assertEqual(permissions.utils.get_local_roles(self.page_2, self.actor), [self.role_1])
+        self.assertEqual(permissions.utils.get_global_roles(self.group), [self.role_2])
+        self.assertEqual(permissions.utils.get_local_roles(self.page_1, self.group), [self.role_1])
+
+        # The relations are ordered like the saved ones
+        self.assertEqual(list(self.role_1.get_principalrolerelation_order()),
+            list(self.role_1.principalrolerelation_set.values_list("id", flat=True)))
+
+        result = permissions.utils.add_roles([(self.actor, self.role_1, self.page_2)])
+        self.assertEqual(result, 0)
+
+    def test_concurrent_insert(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        # The relation is inserted by someone else after the check
+        get_existing = permissions.utils._get_existing_role_relation_rows
+        permissions.utils._get_existing_role_relation_rows = lambda rows: set()
+        try:
+            result = permissions.utils.add_roles([
+                (self.actor, self.role_1, None),
+                (self.actor, self.role_2, None),
+                (self.group, self.role_1, None),
+            ])
+        finally:
+            permissions.utils._get_existing_role_relation_rows = get_existing
+
+        self.assertEqual(result, 2)
+        self.assertEqual(permissions.utils.get_global_roles(self.actor), [self.role_1, self.role_2])
+        self.assertEqual(permissions.utils.get_global_roles(self.group), [self.role_1])
+
+    def test_queries(self):
+        """
+        """
+        assignments = [(self.actor, self.role_1, page) for page in
+            [FlatPage.objects.create(url="/%s/" % i, title="%s" % i) for i in range(20)]]
+        self.assertNumQueries(3, lambda: permissions.utils.add_roles(assignments, batch_size=50))
+
+    def test_materialized_queries(self):
+        """
+        """
+        permissions.materialized.register(FlatPage)
+        settings.PERMISSIONS_MATERIALIZE = True
+        try:
+            for i in range(20):
+                FlatPage.objects.create(url="/%s/" % i, title="%s" % i)
+            permissions.utils.register_permission("View", "view")
+            permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+            permissions.catalog.load()
+
+            # Only the objects which grant to the assigned roles are refreshed
+            self.assertNumQueries(12, lambda: permissions.utils.add_roles([
+                (self.actor, self.role_1, None), (self.group, self.role_2, None)]))
+            self.assertEqual(permissions.materialized.verify(), [])
+            self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), True)
+        finally:
+            settings.PERMISSIONS_MATERIALIZE = False
+            permissions.materialized.unregister(FlatPage)
+
+    def test_invalidation(self):
+        """
+        """
+        self.actor.groups.add(self.group)
+        permissions.utils.register_permission("View", "view")
+        permissions.utils.grant_permission(self.page_1, self.role_1, "view")
+
+        with permission_cache():
+            self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), False)
+            permissions.utils.add_roles([(self.group, self.role_1, None)])
+            self.assertEqual(permissions.utils.has_permission(self.page_1, self.actor, "view"), True)
+
+        settings.PERMISSIONS_ROLE_INDEX = True
+        try:
+            permissions.utils.add_roles([(self.actor, self.role_2, None)])
+            indexed = ActorRoleIndex.objects.filter(actor=self.actor).values_list("role", flat=True)
+            self.assertEqual(set(indexed), set([self.role_1.id, self.role_2.id]))
+        finally:
+            settings.PERMISSIONS_ROLE_INDEX = False
+
+class BulkPermissionsTestCase(TestCase):
+    """Tests the granting and removing of many permissions at once.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.role_2 = permissions.utils.register_role("Role 2")
+        self.view = permissions.utils.register_permission("View", "view")
+        permissions.utils.register_permission("Edit", "edit")
+
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_2)
+
+        self.pages = [FlatPage.objects.create(url="/%s/" % i, title="%s" % i) for i in range(10)]
+
+    def test_grant_permissions(self):
+        """
+        """
+        permissions.utils.grant_permission(self.pages[0], self.role_1, "view")
+
+        result = permissions.utils.grant_permissions(self.pages + self.pages[:1],
+            [self.role_1, self.role_2], [self.view, "edit", "unknown"], batch_size=7)
+        self.assertEqual(result, 39)
+        self.assertEqual(ObjectPermission.objects.count(), 40)
+
+        for page in self.pages:
+            self.assertEqual(permissions.utils.has_permission(page, self.actor, "edit"), True)
+
+        result = permissions.utils.grant_permissions(self.pages, [self.role_1], ["view"])
+        self.assertEqual(result, 0)
+
+    def test_duplicate_roles(self):
+        """
+        """
+        result = permissions.utils.grant_permissions([self.pages[0]], [self.role_1, self.role_1], ["view"])
+        self.assertEqual(result, 1)
+        self.assertEqual(ObjectPermission.objects.count(), 1)
+
+        result = permissions.utils.remove_permissions([self.pages[0]], [self.role_1, self.role_1], ["view"])
+        self.assertEqual(result, 1)
+        self.assertEqual(ObjectPermission.objects.count(), 0)
+
+    def test_remove_permissions(self):
+        """
+        """
+        permissions.utils.grant_permissions(self.pages, [self.role_1, self.role_2], ["view", "edit"])
+
+        result = permissions.utils.remove_permissions(self.pages[:5], [self.role_2], ["edit"], batch_size=2)
+        self.assertEqual(result, 5)
+        self.assertEqual(ObjectPermission.objects.count(), 35)
+
+        self.assertEqual(permissions.utils.has_permission(self.pages[0], self.actor, "edit"), False)
+        self.assertEqual(permissions.utils.has_permission(self.pages[0], self.actor, "view"), True)
+        self.assertEqual(permissions.utils.has_permission(self.pages[5], self.actor, "edit"), True)
+
+        result = permissions.utils.remove_permissions(self.pages[:5], [self.role_2], ["edit"])
+        self.assertEqual(result, 0)
+
+    def test_queries(self):
+        """
+        """
+        # Codenames are taken from the catalog
+        permissions.catalog.load()
+
+        # existing grants and one insert
+        self.assertNumQueries(2, lambda: permissions.utils.grant_permissions(
+            self.pages, [self.role_1, self.role_2], ["view", "edit"], batch_size=100))
+
+        # grants and one delete
+        self.assertNumQueries(2, lambda: permissions.utils.remove_permissions(
+            self.pages, [self.role_1, self.role_2], ["view", "edit"], batch_size=100))
+
+        # existing grants and one insert per batch of 15 rows
+        self.assertNumQueries(4, lambda: permissions.utils.grant_permissions(
+            self.pages, [self.role_1, self.role_2], ["view", "edit"], batch_size=15))
+        self.assertEqual(ObjectPermission.objects.count(), 40)
+
+        # batches are reduced to stay within the parameter limit
+        ObjectPermission.objects.all().delete()
+        limit = permissions.utils.QUERY_PARAMS_LIMIT
+        permissions.utils.QUERY_PARAMS_LIMIT = 40
+        try:
+            self.assertNumQueries(5, lambda: permissions.utils.grant_permissions(
+                self.pages, [self.role_1, self.role_2], ["view", "edit"], batch_size=100))
+        finally:
+            permissions.utils.QUERY_PARAMS_LIMIT = limit
+        self.assertEqual(ObjectPermission.objects.count(), 40)
+
+    def test_invalidation(self):
+        """
+        """
+        with permission_cache():
+            self.assertEqual(permissions.utils.has_permission(self.pages[0], self.actor, "view"), False)
+            permissions.utils.grant_permissions(self.pages, [self.role_2], ["view"])
+            self.assertEqual(permissions.utils.has_permission(self.pages[0], self.actor, "view"), True)
+            permissions.utils.remove_permissions(self.pages, [self.role_2], ["view"])
+            self.assertEqual(permissions.utils.has_permission(self.pages[0], self.actor, "view"), False)
+
+class UniqueRoleRelationsTestCase(TestCase):
+    """Tests the uniqueness of role relations.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.actor = Actor.objects.create(name="john")
+        self.group = ActorGroup.objects.create(name="brights")
+        self.page_1 = FlatPage.objects.create(url="/page-1/", title="Page 1")
+
+    def test_unique(self):
+        """
+        """
+        self.assertEqual(permissions.utils.add_role(self.actor, self.role_1), True)
+        self.assertEqual(permissions.utils.add_role(self.actor, self.role_1), False)
+        self.assertEqual(permissions.utils.add_role(self.group, self.role_1), True)
+        self.assertEqual(permissions.utils.add_local_role(self.page_1, self.actor, self.role_1), True)
+        self.assertEqual(permissions.utils.add_local_role(self.page_1, self.actor, self.role_1), False)
+        self.assertEqual(PrincipalRoleRelation.objects.count(), 3)
+
+        self.assertRaises(IntegrityError, PrincipalRoleRelation.objects.create,
+            actor=self.actor, role=self.role_1)
+
+    def test_remove_duplicates(self):
+        """
+        """
+        permissions.utils.add_role(self.actor, self.role_1)
+        permissions.utils.add_local_role(self.page_1, self.group, self.role_1)
+
+        # Duplicates of relations from before the relation key existed
+        for i in range(2):
+            prr = PrincipalRoleRelation.objects.create(actor=self.actor, role=self.role_1, content=self.page_1)
+            PrincipalRoleRelation.objects.filter(pk=prr.id).update(relation_key=None)
+            prr = PrincipalRoleRelation.objects.create(group=self.group, role=self.role_1)
+            PrincipalRoleRelation.objects.filter(pk=prr.id).update(relation_key=None)
+
+        self.assertEqual(permissions.utils.remove_duplicate_role_relations(), 2)
+        self.assertEqual(PrincipalRoleRelation.objects.count(), 4)
+        self.assertEqual(PrincipalRoleRelation.objects.filter(relation_key=None).count(), 0)
+
+        call_command("permissions_dedupe_roles", verbosity=0)
+        self.assertEqual(PrincipalRoleRelation.objects.count(), 4)
+
+class ContentKeysTestCase(TestCase):
+    """Tests the content keys of the permission models.
+    """
+    def setUp(self):
+        """
+        """
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.view = permissions.utils.register_permission("View", "view")
+        self.actor = Actor.objects.create(name="john")
+        permissions.utils.add_role(self.actor, self.role_1)
+
+        # Actors have uuid hex primary keys
+        self.child = Actor.objects.create(name="jane")
+        self.child.get_parent_for_permissions = lambda: self.actor
+
+    def test_string_ids(self):
+        """
+        """
+        permissions.utils.grant_permission(self.actor, self.role_1, "view")
+        self.assertEqual(permissions.utils.has_permission(self.child, self.actor, "view"), True)
+
+        permissions.utils.add_inheritance_block(self.child, "view")
+        self.assertEqual(permissions.utils.is_inherited(self.child, "view"), False)
+        self.assertEqual(permissions.utils.has_permission(self.child, self.actor, "view"), False)
+
+        permissions.utils.remove_inheritance_block(self.child, "view")
+        self.assertEqual(permissions.utils.is_inherited(self.child, "view"), True)
+
+class ContentKeysMigrationTestCase(TransactionTestCase):
+    """Tests the migration of the content keys. DDL statements commit on some
+    databases, hence this is a TransactionTestCase.
+    """
+    def test_migrate(self):
+        """
+        """
+        # Applies nothing twice
+        call_command("permissions_migrate_content_keys", verbosity=0)
+        call_command("permissions_migrate_content_keys", verbosity=0)
+
+        if connection.vendor == "sqlite":
+            cursor = connection.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = %s",
+                ["permissions_objectpermissioninheritanceblock_content"])
+            self.assertEqual(len(cursor.fetchall()), 1)
+
+class RelationKeysMigrationTestCase(TransactionTestCase):
+    """Tests the migration of the relation keys of role relations.
+    """
+    def test_migrate(self):
+        """
+        """
+        role = permissions.utils.register_role("Role 1")
+        actor = Actor.objects.create(name="john")
+
+        # Relations from before the relation key existed
+        if connection.vendor == "sqlite":
+            cursor = connection.cursor()
+            cursor.execute("DROP TABLE permissions_principalrolerelation")
+            cursor.execute("""CREATE TABLE permissions_principalrolerelation (
+                id integer NOT NULL PRIMARY KEY, actor_id integer NULL, group_id integer NULL,
+                role_id integer NOT NULL, content_type_id integer NULL,
+                content_id varchar(32) NULL, _order integer NOT NULL)""")
+            for i in range(2):
+                cursor.execute("""INSERT INTO permissions_principalrolerelation
+                    (actor_id, role_id, _order) VALUES (%s, %s, %s)""", [actor.id, role.id, i])
+            transaction.commit_unless_managed()
+        else:
+            for i in range(2):
+                prr = PrincipalRoleRelation.objects.create(actor=actor, role=role)
+                PrincipalRoleRelation.objects.filter(pk=prr.id).update(relation_key=None)
+
+        # Applies nothing twice
+        call_command("permissions_migrate_relation_keys", verbosity=0)
+        call_command("permissions_migrate_relation_keys", verbosity=0)
+
+        self.assertEqual(PrincipalRoleRelation.objects.count(), 1)
+        self.assertEqual(PrincipalRoleRelation.objects.filter(relation_key=None).count(), 0)
+        self.assertEqual(permissions.utils.add_role(actor, role), False)
+        self.assertRaises(IntegrityError, PrincipalRoleRelation.objects.create, actor=actor, role=role)
+
+class CatalogTestCase(TestCase):
+    """Tests the catalog of permissions, roles and groups.
+    """
+    def setUp(self):
+        """
+        """
+        permissions.catalog.clear()
+        self.view = permissions.utils.register_permission("View", "view")
+        self.role_1 = permissions.utils.register_role("Role 1")
+        self.group = permissions.utils.register_group("brights")
+
+    def test_lookups(self):
+        """
+        """
+        # Loaded once
+        self.assertNumQueries(3, lambda: permissions.catalog.get_permission_id("view"))
+        self.assertNumQueries(0, lambda: permissions.catalog.get_role_id("Role 1"))
+
+        self.assertEqual(permissions.catalog.get_permission_id("view"), self.view.id)
+        self.assertEqual(permissions.catalog.get_role_id("Role 1"), self.role_1.id)
+        self.assertEqual(permissions.catalog.get_group_id("brights"), self.group.id)
+        self.assertEqual(permissions.catalog.get_codenames([self.view.id]), set(["view"]))
+
+        # The getters read by id
+        self.assertEqual(permissions.utils.get_role("Role 1"), self.role_1)
+        self.assertEqual(permissions.utils.get_group("brights"), self.group)
+        self.assertNumQueries(1, permissions.utils.get_role, "Role 1")
+
+    def test_refresh(self):
+        """
+        """
+        permissions.catalog.load()
+
+        edit = permissions.utils.register_permission("Edit", "edit")
+        self.assertEqual(permissions.catalog.get_permission_id("edit"), edit.id)
+
+        edit.codename = "change"
+        edit.save()
+        self.assertEqual(permissions.catalog.get_permission_id("edit"), None)
+        self.assertEqual(permissions.catalog.get_permission_id("change"), edit.id)
+
+        permissions.utils.unregister_permission("change")
+        self.assertEqual(permissions.catalog.get_permission_id("change"), None)
+
+        permissions.utils.unregister_role("Role 1")
+        self.assertEqual(permissions.utils.get_role("Role 1"), None)
+
+        self.group.name = "darks"
+        self.group.save()
+        self.assertEqual(permissions.utils.get_group("brights"), None)
+        self.assertEqual(permissions.utils.get_group("darks"), self.group)
+
+    def test_rollback(self):
+        """
+        """
+        permissions.catalog.load()
+
+        # Saves which are rolled back don't get into the catalog. The rollback
+        # is simulated by removing the row without signals.
+        delete = permissions.utils.register_permission("Delete", "delete")
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE id = %%s" % Permission._meta.db_table, [delete.id])
+
+        edit = permissions.utils.register_permission("Edit", "edit")
+        self.assertEqual(permissions.catalog.get_permission_id("delete"), None)
+        self.assertEqual(permissions.catalog.get_permission_id("edit"), edit.id)
+
+    def test_other_process(self):
+        """
+        """
+        permissions.catalog.load()
+
+        # Renamed without signals, e.g. by another process
+        Permission.objects.filter(pk=self.view.pk).update(codename="read")
+        self.assertEqual(permissions.catalog.get_permission_id("read"), self.view.id)
+
+        Role.objects.filter(pk=self.role_1.pk).update(name="Role 2")
+        self.assertEqual(permissions.utils.get_role("Role 1"), None)
+        self.assertEqual(permissions.utils.get_role("Role 2"), self.role_1)
+
+        Role.objects.filter(pk=self.role_1.pk).delete()
+        self.assertEqual(permissions.utils.get_role("Role 2"), None)
+
 class RegistrationTestCase(TransactionTestCase):
     """Tests the registration of different components.
     """
@@ -1,23 +1,40 @@
 # python imports
 import warnings
-import logging
 
 # django imports
+from django.conf import settings
 from django.db import IntegrityError
 from django.db import connection
+from django.db import transaction
+from django.db.models import Count
 from django.db.models import Q
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
 from django.core.exceptions import ObjectDoesNotExist
 
 # permissions imports
+import permissions.cache
+import permissions.catalog
+import permissions.hierarchy
+import permissions.materialized
+from permissions.context import ActorContext
 from permissions.exceptions import Unauthorized
 from permissions.models import ObjectPermission, Actor, ActorGroup
+from permissions.models import ActorRoleIndex
 from permissions.models import ObjectPermissionInheritanceBlock
 from permissions.models import Permission
+from permissions.models import PermissionAncestor
 from permissions.models import PrincipalRoleRelation
 from permissions.models import Role
 
+# The maximum number of content keys which are passed to one query.
+CONTENT_KEYS_CHUNK_SIZE = 400
+
+# The maximum number of parameters which are passed to one statement (the
+# limit of older SQLite builds).
+QUERY_PARAMS_LIMIT = 999
+
 # Roles ######################################################################
 
 def add_role(principal, role):
@@ -31,20 +48,7 @@ def add_role(principal, role):
     role
         The role which is assigned.
     """
-    if isinstance(principal, Actor):
-        try:
-            PrincipalRoleRelation.objects.get(actor=principal, role=role, content_id=None, content_type=None)
-        except PrincipalRoleRelation.DoesNotExist:
-            PrincipalRoleRelation.objects.create(actor=principal, role=role)
-            return True
-    else:
-        try:
-            PrincipalRoleRelation.objects.get(group=principal, role=role, content_id=None, content_type=None)
-        except PrincipalRoleRelation.DoesNotExist:
-            PrincipalRoleRelation.objects.create(group=principal, role=role)
-            return True
-
-    return False
+    return _create_role_relation(principal, role)
 
 def add_local_role(obj, principal, role):
     """Adds a local role to a principal.
@@ -60,21 +64,219 @@ def add_local_role(obj, principal, role):
     role
         The role which is assigned.
     """
-    ctype = ContentType.objects.get_for_model(obj)
-    if isinstance(principal, Actor):
-        try:
-            PrincipalRoleRelation.objects.get(actor=principal, role=role, content_id=obj.id, content_type=ctype)
-        except PrincipalRoleRelation.DoesNotExist:
-            PrincipalRoleRelation.objects.create(actor=principal, role=role, content=obj)
-            return True
+    return _create_role_relation(principal, role, obj)
+
+def _create_role_relation(principal, role, obj=None):
+    """Creates a role relation unless it exists already, which the unique
+    relation key tells. Returns True if the relation has been created.
+    """
+    prr = PrincipalRoleRelation(role=role)
+    prr.principal = principal
+    if obj is not None:
+        prr.content = obj
+
+    sid = transaction.savepoint()
+    try:
+        prr.save()
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return False
+    transaction.savepoint_commit(sid)
+    return True
+
+def add_roles(assignments, batch_size=500):
+    """Assigns roles to many principals at once. Relations which exist already
+    are skipped, the others are inserted in batches within one transaction.
+    Returns the number of created relations.
+
+    **Parameters:**
+
+    assignments
+        An iterable of (principal, role, obj) tuples. If obj is None the role
+        is assigned globally, otherwise locally for obj.
+
+    batch_size
+        The maximum number of relations which are inserted with one statement.
+    """
+    rows = []
+    seen = set()
+    for principal, role, obj in assignments:
+        row = _get_role_relation_row(principal, role, obj)
+        if row not in seen:
+            seen.add(row)
+            rows.append(row)
+
+    for i in range(0, len(rows), CONTENT_KEYS_CHUNK_SIZE):
+        seen.difference_update(_get_existing_role_relation_rows(rows[i:i + CONTENT_KEYS_CHUNK_SIZE]))
+    rows = [row for row in rows if row in seen]
+    if not rows:
+        return 0
+
+    rows = _insert_role_relation_rows(rows, batch_size)
+    if rows:
+        _role_relations_changed(rows)
+    return len(rows)
+
+def _get_role_relation_row(principal, role, obj=None):
+    """Returns passed role assignment as an (actor id, group id, role id,
+    content type id, content id) tuple.
+    """
+    if obj is None:
+        ctype_id = content_id = None
+    else:
+        ctype_id = ContentType.objects.get_for_model(obj).id
+        content_id = str(obj.id)
+
+    if _is_actor(principal):
+        return (principal.id, None, role.id, ctype_id, content_id)
     else:
+        return (None, principal.id, role.id, ctype_id, content_id)
+
+def _get_existing_role_relation_rows(rows):
+    """Returns the ones of passed rows (see ``_get_role_relation_row``) which
+    exist already with one query.
+    """
+    actor_ids = set([row[0] for row in rows if row[0] is not None])
+    group_ids = set([row[1] for row in rows if row[1] is not None])
+    keys = set([(row[3], row[4]) for row in rows if row[3] is not None])
+
+    content_q = Q(content_type=None, content_id=None)
+    if keys:
+        content_q |= _get_content_q(keys)
+
+    prrs = PrincipalRoleRelation.objects.filter(
+        Q(actor__in=actor_ids) | Q(group__in=group_ids),
+        role__in=set([row[2] for row in rows])).filter(content_q)
+
+    existing = set()
+    for actor_id, group_id, role_id, ctype_id, content_id in prrs.values_list(
+        "actor", "group", "role", "content_type", "content_id"):
+        if content_id is not None:
+            content_id = str(content_id)
+        existing.add((actor_id, group_id, role_id, ctype_id, content_id))
+    return existing
+
+@transaction.commit_on_success
+def _insert_role_relation_rows(rows, batch_size):
+    """Inserts passed rows (see ``_get_role_relation_row``) into the role
+    relation table and returns the inserted ones. Rows which have been
+    inserted by someone else in the meantime are skipped.
+    """
+    # Role relations are ordered with respect to their role, hence new rows
+    # are numbered after the existing ones, like save() does.
+    role_ids = set([row[2] for row in rows])
+    orders = {}
+    for row in PrincipalRoleRelation.objects.filter(role__in=role_ids).order_by().values(
+        "role").annotate(count=Count("id")):
+        orders[row["role"]] = row["count"]
+
+    params = []
+    for row in rows:
+        order = orders.get(row[2], 0)
+        orders[row[2]] = order + 1
+        params.append(row + (order, PrincipalRoleRelation.get_relation_key(*row)))
+
+    fields = ("actor", "group", "role", "content_type", "content_id", "_order", "relation_key")
+    inserted = []
+    for i in range(0, len(params), batch_size):
+        batch = params[i:i + batch_size]
+        sid = transaction.savepoint()
         try:
-            PrincipalRoleRelation.objects.get(group=principal, role=role, content_id=obj.id, content_type=ctype)
-        except PrincipalRoleRelation.DoesNotExist:
-            PrincipalRoleRelation.objects.create(group=principal, role=role, content=obj)
-            return True
+            _insert_rows(PrincipalRoleRelation, fields, batch, batch_size)
+        except IntegrityError:
+            # A concurrent insert hit the unique relation key, hence the rows
+            # of the batch are inserted one by one.
+            transaction.savepoint_rollback(sid)
+            for row in batch:
+                sid = transaction.savepoint()
+                try:
+                    _insert_rows(PrincipalRoleRelation, fields, [row], 1)
+                except IntegrityError:
+                    transaction.savepoint_rollback(sid)
+                else:
+                    transaction.savepoint_commit(sid)
+                    inserted.append(row[:5])
+        else:
+            transaction.savepoint_commit(sid)
+            inserted.extend([row[:5] for row in batch])
+    return inserted
+
+def _insert_rows(model, fields, rows, batch_size):
+    """Inserts passed rows with the values of passed fields into the table of
+    passed model with one multi-row statement per batch. Batches are reduced
+    to stay within ``QUERY_PARAMS_LIMIT``. Signals are not sent.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES " % (qn(opts.db_table),
+        ", ".join([qn(opts.get_field(name).column) for name in fields]))
+    values = "(%s)" % ", ".join(["%s"] * len(fields))
+    batch_size = max(1, min(batch_size, QUERY_PARAMS_LIMIT // len(fields)))
 
-    return False
+    cursor = connection.cursor()
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        params = []
+        for row in batch:
+            params.extend(row)
+        cursor.execute(sql + ", ".join([values] * len(batch)), params)
+    transaction.set_dirty()
+
+def _delete_rows(model, ids, batch_size):
+    """Deletes the rows with passed ids from the table of passed model with
+    one statement per batch. Signals are not sent and nothing is cascaded.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (qn(opts.db_table),
+            qn(opts.pk.column), ", ".join(["%s"] * len(batch))), batch)
+    transaction.set_dirty()
+
+def _role_relations_changed(rows):
+    """Does what the signal handlers of ``permissions.listeners`` do for role
+    relations which are saved or deleted in bulk, i.e. without signals.
+    """
+    actor_ids = set()
+    group_ids = set()
+    global_actor_ids = set()
+    global_group_ids = set()
+    global_role_ids = set()
+    keys = set()
+    for actor_id, group_id, role_id, ctype_id, content_id in rows:
+        if actor_id is not None:
+            actor_ids.add(actor_id)
+        else:
+            group_ids.add(group_id)
+
+        if ctype_id is not None:
+            keys.add((ctype_id, content_id))
+            continue
+
+        global_role_ids.add(role_id)
+        if actor_id is not None:
+            global_actor_ids.add(actor_id)
+        else:
+            global_group_ids.add(group_id)
+
+    if group_ids:
+        permissions.cache.invalidate()
+    else:
+        permissions.cache.invalidate(actor_ids)
+
+    if global_group_ids and (is_role_index_enabled() or permissions.materialized.is_enabled()):
+        global_actor_ids.update(Actor.groups.through.objects.filter(
+            actorgroup__in=global_group_ids).values_list("actor", flat=True))
+
+    if is_role_index_enabled():
+        update_role_index(global_actor_ids)
+
+    if permissions.materialized.is_enabled():
+        for ctype_id, content_id in keys:
+            permissions.materialized.refresh_content(ctype_id, content_id)
+        permissions.materialized.refresh_actors(global_actor_ids, global_role_ids)
 
 def remove_role(principal, role):
     """Removes role from passed principal.
@@ -88,7 +290,7 @@ def remove_role(principal, role):
         The role which is removed.
     """
     try:
-        if isinstance(principal, Actor):
+        if _is_actor(principal):
             ppr = PrincipalRoleRelation.objects.get(
                     actor=principal, role=role, content_id=None, content_type=None)
         else:
@@ -119,7 +321,7 @@ def remove_local_role(obj, principal, role):
     try:
         ctype = ContentType.objects.get_for_model(obj)
 
-        if isinstance(principal, Actor):
+        if _is_actor(principal):
             ppr = PrincipalRoleRelation.objects.get(
                 actor=principal, role=role, content_id=obj.id, content_type=ctype)
         else:
@@ -141,7 +343,7 @@ def remove_roles(principal):
     principal
         The principal (actor or group) from which all roles are removed.
     """
-    if isinstance(principal, Actor):
+    if _is_actor(principal):
         ppr = PrincipalRoleRelation.objects.filter(
             actor=principal, content_id=None, content_type=None)
     else:
@@ -168,7 +370,7 @@ def remove_local_roles(obj, principal):
     """
     ctype = ContentType.objects.get_for_model(obj)
 
-    if isinstance(principal, Actor):
+    if _is_actor(principal):
         ppr = PrincipalRoleRelation.objects.filter(
             actor=principal, content_id=obj.id, content_type=ctype)
     else:
@@ -181,6 +383,52 @@ def remove_local_roles(obj, principal):
     else:
         return False
 
+def remove_duplicate_role_relations(batch_size=500):
+    """Removes duplicate role relations, keeping the oldest one of each, and
+    sets the relation key of relations which have none yet (e.g. ones created
+    before the key existed). Returns the number of removed relations.
+
+    **Parameters:**
+
+    batch_size
+        The maximum number of relations which are deleted or updated with one
+        statement.
+    """
+    seen = set()
+    duplicates = []
+    missing = []
+    for values in PrincipalRoleRelation.objects.order_by("id").values_list("id",
+        "actor", "group", "role", "content_type", "content_id", "relation_key").iterator():
+        key = PrincipalRoleRelation.get_relation_key(*values[1:6])
+        if key in seen:
+            duplicates.append(values[0])
+        else:
+            seen.add(key)
+            if values[6] != key:
+                missing.append((key, values[0]))
+
+    transaction.commit_on_success(_remove_and_update_relations)(duplicates, missing, batch_size)
+
+    if duplicates:
+        permissions.cache.invalidate()
+    return len(duplicates)
+
+def _remove_and_update_relations(ids, keys, batch_size):
+    """Deletes the role relations with passed ids and sets the passed
+    relation keys, which are (key, id) tuples.
+    """
+    _delete_rows(PrincipalRoleRelation, ids, batch_size)
+
+    opts = PrincipalRoleRelation._meta
+    qn = connection.ops.quote_name
+    sql = "UPDATE %s SET %s = %%s WHERE %s = %%s" % (qn(opts.db_table),
+        qn(opts.get_field("relation_key").column), qn(opts.pk.column))
+
+    cursor = connection.cursor()
+    for i in range(0, len(keys), batch_size):
+        cursor.executemany(sql, keys[i:i + batch_size])
+    transaction.set_dirty()
+
 def get_roles(principal, obj=None):
     """Returns *all* roles of the passed actor.
 
@@ -201,67 +449,63 @@ def get_roles(principal, obj=None):
         The object for which local roles will returned.
 
     """
-    role_ids = []
-    groups = principal.groups.all()
+    return Role.objects.filter(pk__in=get_role_ids(principal, obj))
 
-    if isinstance(principal, Actor):
-        groups = principal.groups.all()
+def get_role_ids(principal, obj=None):
+    """Returns the ids of *all* roles of the passed actor as a set, see
+    ``get_roles``. Global roles and the local roles on all ancestors are
+    resolved with one statement and no roles are instantiated.
 
-    elif isinstance(principal, ActorGroup):
-        groups = [principal]
+    **Parameters:**
 
+    principal
+        The actor or group for which the role ids are returned.
 
-    groups_ids_str = ", ".join(["'%s'" % (str(g.id)) for g in groups])
-    groups_ids_str = groups_ids_str  or "''"
-    # Global roles for actor and the actor's groups
-    cursor = connection.cursor()
+    obj
+        The object for which the ids of local roles will returned.
+    """
+    # The global roles of an actor context are loaded already
+    if obj is None and isinstance(principal, ActorContext):
+        return set(principal.global_role_ids)
 
-    if groups_ids_str:
-        cursor.execute("""SELECT role_id
-                          FROM permissions_principalrolerelation
-                          WHERE (actor_id='%s' OR group_id IN (%s))
-                          AND content_id is Null""" % (principal.id, groups_ids_str))
+    if obj is None:
+        cached = _get_cached_result(principal, "roles")
     else:
-        cursor.execute("""SELECT role_id
-                          FROM permissions_principalrolerelation
-                          WHERE actor_id=%s
-                          AND content_id is Null""" % principal.id)
+        cached = _get_cached_result(principal, "roles",
+            ContentType.objects.get_for_model(obj).id, str(obj.id))
 
-    for row in cursor.fetchall():
-        role_ids.append(row[0])
-
-    # Local roles for actor and the actor's groups and all ancestors of the
-    # passed object.
-    while obj:
-        ctype = ContentType.objects.get_for_model(obj)
+    role_ids = cached.get()
+    if role_ids is not None:
+        return set(role_ids)
 
-        if groups_ids_str:
-            cursor.execute("""SELECT role_id
-                              FROM permissions_principalrolerelation
-                              WHERE (actor_id='%s' OR group_id IN (%s))
-                              AND content_id='%s'
-                              AND content_type_id='%s'""" % (principal.id, groups_ids_str, obj.id, ctype.id))
+    if obj is None:
+        keys = []
+    else:
+        keys = _get_ancestor_keys(obj)
+
+    # Global roles for actor and the actor's groups from the role index, local
+    # roles within the same statement
+    if isinstance(principal, ActorContext):
+        role_ids = _get_role_ids(principal, keys)
+    elif _is_actor(principal) and is_role_index_enabled():
+        indexed = ActorRoleIndex.objects.filter(actor=principal).values("role")
+        if keys:
+            local = PrincipalRoleRelation.objects.filter(_get_principal_q(
+                principal)).filter(_get_content_q(keys)).values("role")
+            role_ids = set(Role.objects.filter(Q(pk__in=indexed) | Q(pk__in=local)).values_list(
+                "id", flat=True))
         else:
-            cursor.execute("""SELECT role_id
-                              FROM permissions_principalrolerelation
-                              WHERE actor_id='%s'
-                              AND content_id='%s'
-                              AND content_type_id='%s'""" % (principal.id, obj.id, ctype.id))
+            role_ids = set([row["role"] for row in indexed])
+    else:
+        role_ids = _get_role_ids(principal, keys)
 
-        for row in cursor.fetchall():
-            role_ids.append(row[0])
-
-        try:
-            obj = obj.get_parent_for_permissions()
-        except AttributeError:
-            obj = None
-    
-    return Role.objects.filter(pk__in=role_ids)
+    cached.set(list(role_ids))
+    return role_ids
 
 def get_global_roles(principal):
     """Returns *direct* global roles of passed principal (user or group).
     """
-    if isinstance(principal, Actor):
+    if _is_actor(principal):
         return [prr.role for prr in PrincipalRoleRelation.objects.filter(
             actor=principal, content_id=None, content_type=None).order_by('role')]
     else:
@@ -275,13 +519,83 @@ def get_local_roles(obj, principal):
     """
     ctype = ContentType.objects.get_for_model(obj)
 
-    if isinstance(principal, Actor):
+    if _is_actor(principal):
         return [prr.role for prr in PrincipalRoleRelation.objects.filter(
             actor=principal, content_id=obj.id, content_type=ctype).order_by('role')]
     else:
         return [prr.role for prr in PrincipalRoleRelation.objects.filter(
             group=principal, content_id=obj.id, content_type=ctype).order_by('role')]
 
+# Role index #################################################################
+
+def is_role_index_enabled():
+    """Returns True if the effective global roles of actors are read from the
+    role index (see ``PERMISSIONS_ROLE_INDEX``).
+    """
+    return getattr(settings, "PERMISSIONS_ROLE_INDEX", False)
+
+def update_role_index(actor_ids):
+    """Updates the role index for the actors with passed ids, i.e. brings
+    their indexed roles in line with their direct global roles and the global
+    roles of their groups.
+
+    **Parameters:**
+
+    actor_ids
+        The ids of the actors whose index entries should be updated.
+    """
+    actor_ids = list(actor_ids)
+    if not actor_ids:
+        return
+
+    effective = {}
+    for actor_id, role_id in PrincipalRoleRelation.objects.filter(
+        actor__in=actor_ids, content_type=None, content_id=None).values_list("actor", "role"):
+        effective.setdefault(actor_id, set()).add(role_id)
+
+    memberships = Actor.groups.through.objects.filter(
+        actor__in=actor_ids).values_list("actor", "actorgroup")
+    if memberships:
+        group_roles = {}
+        for group_id, role_id in PrincipalRoleRelation.objects.filter(
+            group__in=set([group_id for actor_id, group_id in memberships]),
+            content_type=None, content_id=None).values_list("group", "role"):
+            group_roles.setdefault(group_id, set()).add(role_id)
+
+        for actor_id, group_id in memberships:
+            effective.setdefault(actor_id, set()).update(group_roles.get(group_id, ()))
+
+    obsolete = []
+    for index_id, actor_id, role_id in ActorRoleIndex.objects.filter(
+        actor__in=actor_ids).values_list("id", "actor", "role"):
+        try:
+            effective[actor_id].remove(role_id)
+        except KeyError:
+            obsolete.append(index_id)
+
+    if obsolete:
+        ActorRoleIndex.objects.filter(pk__in=obsolete).delete()
+
+    for actor_id, role_ids in effective.items():
+        for role_id in role_ids:
+            # A concurrent update may have created the entry meanwhile
+            sid = transaction.savepoint()
+            try:
+                ActorRoleIndex.objects.create(actor_id=actor_id, role_id=role_id)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.savepoint_commit(sid)
+
+@transaction.commit_on_success
+def rebuild_role_index():
+    """Rebuilds the role index for all actors within one transaction.
+    """
+    ActorRoleIndex.objects.all().delete()
+    actor_ids = list(Actor.objects.values_list("id", flat=True))
+    for i in range(0, len(actor_ids), CONTENT_KEYS_CHUNK_SIZE):
+        update_role_index(actor_ids[i:i + CONTENT_KEYS_CHUNK_SIZE])
+
 # Permissions ################################################################
 
 def check_permission(obj, actor, codename, roles=None):
@@ -322,17 +636,15 @@ def grant_permission(obj, role, permission):
         The permission which should be granted. Either a permission
         object or the codename of a permission.
     """
-    if not isinstance(permission, Permission):
-        try:
-            permission = Permission.objects.get(codename = permission)
-        except Permission.DoesNotExist:
-            return False
+    permission_id = _get_permission_id(permission)
+    if permission_id is None:
+        return False
 
     ct = ContentType.objects.get_for_model(obj)
     try:
-        ObjectPermission.objects.get(role=role, content_type = ct, content_id=obj.id, permission=permission)
+        ObjectPermission.objects.get(role=role, content_type = ct, content_id=obj.id, permission=permission_id)
     except ObjectPermission.DoesNotExist:
-        ObjectPermission.objects.create(role=role, content=obj, permission=permission)
+        ObjectPermission.objects.create(role=role, content=obj, permission_id=permission_id)
 
     return True
 
@@ -352,22 +664,143 @@ def remove_permission(obj, role, permission):
         The permission which should be removed. Either a permission object
         or the codename of a permission.
     """
-    if not isinstance(permission, Permission):
-        try:
-            permission = Permission.objects.get(codename = permission)
-        except Permission.DoesNotExist:
-            return False
+    permission_id = _get_permission_id(permission)
+    if permission_id is None:
+        return False
 
     ct = ContentType.objects.get_for_model(obj)
 
     try:
-        op = ObjectPermission.objects.get(role=role, content_type = ct, content_id=obj.id, permission = permission)
+        op = ObjectPermission.objects.get(role=role, content_type = ct, content_id=obj.id, permission=permission_id)
     except ObjectPermission.DoesNotExist:
         return False
 
     op.delete()
     return True
 
+def grant_permissions(objs, roles, codenames, batch_size=500):
+    """Grants all passed permissions to all passed roles for all passed
+    objects. Grants which exist already are skipped, the others are inserted
+    in batches within one transaction. Returns the number of created grants.
+
+    **Parameters:**
+
+    objs
+        The content objects for which the permissions should be granted.
+
+    roles
+        The roles for which the permissions should be granted.
+
+    codenames
+        The permissions which should be granted. Either permission objects or
+        codenames of permissions. Unknown codenames are ignored.
+
+    batch_size
+        The maximum number of grants which are inserted with one statement.
+    """
+    role_ids = list(set([role.id for role in roles]))
+    permission_ids = _get_permission_ids(codenames)
+    keys = _get_unique_content_keys(objs)
+    if not (role_ids and permission_ids and keys):
+        return 0
+
+    existing = set()
+    queryset = ObjectPermission.objects.filter(role__in=role_ids, permission__in=permission_ids)
+    for role_id, permission_id, ctype_id, content_id in _get_values_for_keys(
+        queryset, keys, "role", "permission", "content_type", "content_id"):
+        existing.add((role_id, permission_id, ctype_id, str(content_id)))
+
+    rows = []
+    for ctype_id, content_id in keys:
+        for role_id in role_ids:
+            for permission_id in permission_ids:
+                row = (role_id, permission_id, ctype_id, content_id)
+                if row not in existing:
+                    rows.append(row)
+
+    if rows:
+        transaction.commit_on_success(_insert_rows)(ObjectPermission,
+            ("role", "permission", "content_type", "content_id"), rows, batch_size)
+        _object_permissions_changed(set([(row[2], row[3]) for row in rows]))
+    return len(rows)
+
+def remove_permissions(objs, roles, codenames, batch_size=500):
+    """Removes all passed permissions from all passed roles for all passed
+    objects. The grants are deleted in batches within one transaction. Returns
+    the number of removed grants.
+
+    **Parameters:**
+
+    objs
+        The content objects for which the permissions should be removed.
+
+    roles
+        The roles for which the permissions should be removed.
+
+    codenames
+        The permissions which should be removed. Either permission objects or
+        codenames of permissions.
+
+    batch_size
+        The maximum number of grants which are deleted with one statement.
+    """
+    role_ids = list(set([role.id for role in roles]))
+    permission_ids = _get_permission_ids(codenames)
+    keys = _get_unique_content_keys(objs)
+    if not (role_ids and permission_ids and keys):
+        return 0
+
+    ids = []
+    changed = set()
+    queryset = ObjectPermission.objects.filter(role__in=role_ids, permission__in=permission_ids)
+    for id, ctype_id, content_id in _get_values_for_keys(
+        queryset, keys, "id", "content_type", "content_id"):
+        ids.append(id)
+        changed.add((ctype_id, str(content_id)))
+
+    if ids:
+        transaction.commit_on_success(_delete_rows)(ObjectPermission, ids, batch_size)
+        _object_permissions_changed(changed)
+    return len(ids)
+
+def _get_permission_id(permission):
+    """Returns the id of passed permission, which is either a permission
+    object or a codename, or None if there is no such permission.
+    """
+    if isinstance(permission, Permission):
+        return permission.id
+    return permissions.catalog.get_permission_id(permission)
+
+def _get_permission_ids(codenames):
+    """Returns the ids of passed permissions, which are either permission
+    objects or codenames. Unknown codenames are skipped.
+    """
+    ids = set([_get_permission_id(permission) for permission in codenames])
+    ids.discard(None)
+    return list(ids)
+
+def _get_unique_content_keys(objs):
+    """Returns the content keys of passed objects without duplicates, in the
+    order of the objects.
+    """
+    keys = []
+    seen = set()
+    for obj in objs:
+        key = _get_content_key(obj)
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys
+
+def _object_permissions_changed(keys):
+    """Does what the signal handlers of ``permissions.listeners`` do for
+    grants of passed content keys which are saved or deleted in bulk.
+    """
+    permissions.cache.invalidate()
+    if permissions.materialized.is_enabled():
+        for ctype_id, content_id in keys:
+            permissions.materialized.refresh_content(ctype_id, content_id)
+
 def has_permission(obj, actor, codename, roles=None):
     """Checks whether the passed actor has passed permission for passed object.
 
@@ -386,43 +819,986 @@ def has_permission(obj, actor, codename, roles=None):
         If given these roles will be assigned to the actor temporarily before
         the permissions are checked.
     """
+    if roles is None:
+        roles = []
+
     ctype = ContentType.objects.get_for_model(obj)
-    cache_key = "%s-%s-%s" % (ctype.id, obj.id, codename)
-    result = None # _get_cached_permission(user, cache_key)
-    if result is not None:
+
+    # Results which depend on temporarily assigned roles are not cached.
+    cached = None
+    if not roles:
+        cached = _get_cached_result(actor, ctype.id, str(obj.id), codename)
+        result = cached.get()
+        if result is not None:
+            return result
+
+    if not roles and _is_actor(actor) and permissions.materialized.is_materialized(obj):
+        result = permissions.materialized.has_permission(obj, actor, codename)
+        cached.set(result)
         return result
 
-    if roles is None:
-        roles = []
+    if getattr(settings, "PERMISSIONS_COLLAPSE_ANCESTORS", False):
+        result = _has_permission_collapsed(obj, actor, codename, roles)
+        if cached is not None:
+            cached.set(result)
+        return result
 #
 #    if actor.is_superuser:
 #        return True
 #
-    roles.extend(get_roles(actor, obj))
+    result = _walk_permission(obj, actor, codename, roles)
+    if cached is not None:
+        cached.set(result)
+    return result
+
+def _walk_permission(obj, actor, codename, roles):
+    """Checks passed permission by walking up the ancestors of passed object
+    level by level, i.e. with the rule engine itself. Neither caches nor
+    materialized permissions are consulted.
+    """
+    permission_id = permissions.catalog.get_permission_id(codename)
+    if permission_id is None:
+        return False
+
+    role_ids = get_role_ids(actor, obj)
+    role_ids.update([role.id for role in roles])
 
-    result = False
+    ctype = ContentType.objects.get_for_model(obj)
     while obj is not None:
         p = ObjectPermission.objects.filter(
-            content_type=ctype, content_id=obj.id, role__in=roles, permission__codename = codename).values("id")
+            content_type=ctype, content_id=obj.id, role__in=role_ids, permission=permission_id).values("id")
 
         if len(p) > 0:
-            result = True
-            break
+            return True
 
         if is_inherited(obj, codename) == False:
-            result = False
-            break
+            return False
 
         try:
             obj = obj.get_parent_for_permissions()
             ctype = ContentType.objects.get_for_model(obj)
         except AttributeError:
+            return False
+
+    return False
+
+def _has_permission_collapsed(obj, actor, codename, roles):
+    """Checks whether the passed actor has passed permission for passed object
+    with a constant number of queries.
+
+    The ancestor chain of the object is collected once. Then the roles of the
+    actor, the granted permissions and the inheritance blocks are fetched for
+    the whole chain at once and the chain is resolved in Python with the same
+    semantics as the level by level walk of ``has_permission``.
+
+    This is used by ``has_permission`` if ``PERMISSIONS_COLLAPSE_ANCESTORS``
+    is set to True.
+    """
+    permission_id = permissions.catalog.get_permission_id(codename)
+    if permission_id is None:
+        return False
+
+    keys = _get_ancestor_keys(obj)
+
+    role_ids = set([role.id for role in roles])
+    role_ids.update(_get_role_ids(actor, keys))
+    if not role_ids:
+        return False
+
+    granted = _get_content_keys(ObjectPermission.objects.filter(
+        _get_content_q(keys), role__in=role_ids, permission=permission_id))
+    if not granted:
+        return False
+    if keys[0] in granted:
+        return True
+
+    blocked = _get_content_keys(ObjectPermissionInheritanceBlock.objects.filter(
+        _get_content_q(keys), permission=permission_id))
+
+    for key in keys:
+        if key in granted:
+            return True
+        if key in blocked:
+            return False
+    return False
+
+def get_permission_mask(obj, actor, roles=None):
+    """Returns the bitmask of all permissions the passed actor has for the
+    passed object. The bit of a permission is ``1 << permission.id``, see
+    ``get_permission_bit``.
+
+    Roles, grants and inheritance blocks are fetched for the whole ancestor
+    chain at once and resolved for all permissions in one pass, with the
+    semantics of ``has_permission``.
+
+    **Parameters:**
+
+    obj
+        The object for which the permissions should be checked.
+
+    actor
+        The actor for which the permissions should be checked.
+
+    roles
+        If given these roles will be assigned to the actor temporarily before
+        the permissions are checked.
+    """
+    if roles is None:
+        roles = []
+
+    # Results which depend on temporarily assigned roles are not cached.
+    cached = None
+    if not roles:
+        cached = _get_cached_result(actor, "mask",
+            ContentType.objects.get_for_model(obj).id, str(obj.id))
+        mask = cached.get()
+        if mask is not None:
+            return mask
+
+    mask = _get_permission_mask(_get_ancestor_keys(obj), actor, roles)
+    if cached is not None:
+        cached.set(mask)
+    return mask
+
+def _get_permission_mask(keys, actor, roles):
+    """Returns the bitmask of all permissions the passed actor has for the
+    object with the passed chain of content keys.
+    """
+    role_ids = set([role.id for role in roles])
+    role_ids.update(_get_role_ids(actor, keys))
+    if not role_ids:
+        return 0
+
+    granted = {}
+    for ctype_id, content_id, permission_id in ObjectPermission.objects.filter(
+        _get_content_q(keys), role__in=role_ids).values_list("content_type", "content_id", "permission"):
+        key = (ctype_id, str(content_id))
+        granted[key] = granted.get(key, 0) | 1 << permission_id
+    if not granted:
+        return 0
+
+    blocked = {}
+    for ctype_id, content_id, permission_id in ObjectPermissionInheritanceBlock.objects.filter(
+        _get_content_q(keys)).values_list("content_type", "content_id", "permission"):
+        key = (ctype_id, str(content_id))
+        blocked[key] = blocked.get(key, 0) | 1 << permission_id
+
+    # Each permission is decided by the nearest level which grants or blocks
+    # it, where a grant wins over a block on the same level.
+    mask = decided = 0
+    for key in keys:
+        mask |= granted.get(key, 0) & ~decided
+        decided |= granted.get(key, 0) | blocked.get(key, 0)
+    return mask
+
+def get_permissions(obj, actor, roles=None):
+    """Returns the codenames of all permissions the passed actor has for the
+    passed object as a set. This needs as many queries as a single check, see
+    ``get_permission_mask``.
+
+    **Parameters:**
+
+    obj
+        The object for which the permissions should be returned.
+
+    actor
+        The actor for which the permissions should be returned.
+
+    roles
+        If given these roles will be assigned to the actor temporarily before
+        the permissions are checked.
+    """
+    mask = get_permission_mask(obj, actor, roles)
+
+    permission_ids = []
+    while mask:
+        bit = mask & -mask
+        permission_ids.append(bit.bit_length() - 1)
+        mask ^= bit
+    return permissions.catalog.get_codenames(permission_ids)
+
+def get_permission_bit(permission):
+    """Returns the bit of the passed permission within permission masks, or 0
+    if there is no such permission.
+
+    **Parameters:**
+
+    permission
+        Either a permission object or the codename of a permission.
+    """
+    permission_id = _get_permission_id(permission)
+    if permission_id is None:
+        return 0
+    return 1 << permission_id
+
+def get_permissions_bits(codenames):
+    """Returns the combined bits of the passed permissions, see
+    ``get_permission_bit``. Unknown permissions don't set a bit.
+    """
+    bits = 0
+    for codename in codenames:
+        bits |= get_permission_bit(codename)
+    return bits
+
+def has_permissions(obj, actor, codenames, roles=None):
+    """Returns True if the passed actor has all passed permissions for the
+    passed object. The permissions are evaluated at once, see
+    ``get_permission_mask``.
+
+    **Parameters:**
+
+    obj
+        The object for which the permissions should be checked.
+
+    actor
+        The actor for which the permissions should be checked.
+
+    codenames
+        The codenames of the permissions which should be checked.
+
+    roles
+        If given these roles will be assigned to the actor temporarily before
+        the permissions are checked.
+    """
+    bits = 0
+    for codename in codenames:
+        bit = get_permission_bit(codename)
+        if not bit:
+            return False
+        bits |= bit
+    return get_permission_mask(obj, actor, roles) & bits == bits
+
+def has_any_permission(obj, actor, codenames, roles=None):
+    """Returns True if the passed actor has at least one of the passed
+    permissions for the passed object. The permissions are evaluated at once,
+    see ``get_permission_mask``.
+
+    **Parameters:**
+
+    obj
+        The object for which the permissions should be checked.
+
+    actor
+        The actor for which the permissions should be checked.
+
+    codenames
+        The codenames of the permissions which should be checked.
+
+    roles
+        If given these roles will be assigned to the actor temporarily before
+        the permissions are checked.
+    """
+    bits = get_permissions_bits(codenames)
+    if not bits:
+        return False
+    return get_permission_mask(obj, actor, roles) & bits != 0
+
+def has_permissions_batch(triples):
+    """Checks many permissions at once. Returns a list with the result for
+    each of the passed triples, in the same order, with the semantics of
+    ``has_permission``.
+
+    The ancestor chains of all objects are collected first (see
+    ``_get_ancestor_chains``). Then the groups of all actors, their roles and
+    the grants and inheritance blocks of all permissions are fetched for all
+    content keys at once, and the triples are resolved in Python.
+
+    **Parameters:**
+
+    triples
+        An iterable of (actor, obj, codename) tuples.
+    """
+    triples = list(triples)
+    if not triples:
+        return []
+
+    objs = []
+    index_by_key = {}
+    for actor, obj, codename in triples:
+        key = _get_content_key(obj)
+        if key not in index_by_key:
+            index_by_key[key] = len(objs)
+            objs.append(obj)
+
+    chains = _get_ancestor_chains(objs)
+    keys = set()
+    for chain in chains:
+        keys.update(chain)
+
+    permission_ids = {}
+    for actor, obj, codename in triples:
+        if codename not in permission_ids:
+            permission_ids[codename] = permissions.catalog.get_permission_id(codename)
+    ids = set(permission_ids.values())
+    ids.discard(None)
+
+    global_role_ids, local_role_ids = _get_role_ids_by_principal(
+        [actor for actor, obj, codename in triples], keys)
+
+    granted = {}
+    blocked = set()
+    if ids:
+        for ctype_id, content_id, permission_id, role_id in _get_values_for_keys(
+            ObjectPermission.objects.filter(permission__in=ids), keys,
+            "content_type", "content_id", "permission", "role"):
+            granted.setdefault((ctype_id, str(content_id), permission_id), set()).add(role_id)
+
+        for ctype_id, content_id, permission_id in _get_values_for_keys(
+            ObjectPermissionInheritanceBlock.objects.filter(permission__in=ids), keys,
+            "content_type", "content_id", "permission"):
+            blocked.add((ctype_id, str(content_id), permission_id))
+
+    results = []
+    memo = {}
+    for actor, obj, codename in triples:
+        principal = _get_principal_key(actor)
+        chain = chains[index_by_key[_get_content_key(obj)]]
+        permission_id = permission_ids[codename]
+
+        memo_key = (principal, chain[0], permission_id)
+        if memo_key not in memo:
+            role_ids = set(global_role_ids.get(principal, ()))
+            for key in chain:
+                role_ids.update(local_role_ids.get((principal, key), ()))
+
             result = False
-            break
+            if permission_id is not None:
+                for ctype_id, content_id in chain:
+                    if granted.get((ctype_id, content_id, permission_id), set()) & role_ids:
+                        result = True
+                        break
+                    if (ctype_id, content_id, permission_id) in blocked:
+                        break
+            memo[memo_key] = result
+        results.append(memo[memo_key])
+    return results
+
+def _get_principal_key(principal):
+    """Returns a key which identifies the passed actor or group.
+    """
+    return (_is_actor(principal), principal.id)
+
+def _is_actor(principal):
+    """Returns True if the passed principal is an actor or an actor context.
+    """
+    return isinstance(principal, (Actor, ActorContext))
+
+def _get_principal_type(principal):
+    """Returns the name of the type of the passed principal within cache keys.
+    Actor contexts share the results of their actors.
+    """
+    if isinstance(principal, ActorContext):
+        return Actor.__name__
+    return principal.__class__.__name__
+
+def _get_cached_result(principal, *parts):
+    """Returns the cached result of the passed principal which is identified
+    by the passed parts. Results of actor contexts are based on the groups and
+    global roles loaded for the request, hence they are not stored within the
+    shared cache.
+    """
+    cached = permissions.cache.CachedResult(principal.id, _get_principal_type(principal), *parts)
+    if isinstance(principal, ActorContext):
+        cached.shared = False
+    return cached
+
+def _get_role_ids_by_principal(principals, keys):
+    """Returns a dict which maps the principal keys (see
+    ``_get_principal_key``) of the passed actors and groups to the ids of
+    their global roles, and a dict which maps (principal key, content key)
+    to the ids of their local roles on one of the passed content keys. Roles
+    of the groups of actors are taken into account.
+    """
+    actor_ids = set()
+    group_ids = set()
+    contexts = {}
+    for principal in principals:
+        if isinstance(principal, ActorContext):
+            contexts[principal.id] = principal
+            actor_ids.add(principal.id)
+        elif _is_actor(principal):
+            actor_ids.add(principal.id)
+        else:
+            group_ids.add(principal.id)
+
+    # The principal keys which get the roles of each group
+    receivers = {}
+    for group_id in group_ids:
+        receivers.setdefault(group_id, set()).add((False, group_id))
+
+    # The groups of actor contexts are loaded already
+    for actor_id, context in contexts.items():
+        for group_id in context.group_ids:
+            receivers.setdefault(group_id, set()).add((True, actor_id))
+
+    unloaded_ids = list(actor_ids.difference(contexts))
+    for i in range(0, len(unloaded_ids), CONTENT_KEYS_CHUNK_SIZE):
+        for actor_id, group_id in Actor.groups.through.objects.filter(
+            actor__in=unloaded_ids[i:i + CONTENT_KEYS_CHUNK_SIZE]).values_list("actor", "actorgroup"):
+            receivers.setdefault(group_id, set()).add((True, actor_id))
+
+    actor_ids = list(actor_ids)
+
+    global_role_ids = {}
+    local_role_ids = {}
+    def add(principal_keys, role_id, ctype_id, content_id):
+        for principal_key in principal_keys:
+            if ctype_id is None:
+                global_role_ids.setdefault(principal_key, set()).add(role_id)
+            else:
+                local_role_ids.setdefault((principal_key, (ctype_id, str(content_id))), set()).add(role_id)
+
+    # Actors and groups are chunked alongside, global roles are fetched with
+    # the first chunk of content keys.
+    keys = list(keys)
+    group_ids = receivers.keys()
+    for i in range(0, max(len(actor_ids), len(group_ids)), CONTENT_KEYS_CHUNK_SIZE):
+        principal_q = Q(actor__in=actor_ids[i:i + CONTENT_KEYS_CHUNK_SIZE]) | \
+                      Q(group__in=group_ids[i:i + CONTENT_KEYS_CHUNK_SIZE])
+
+        for j in range(0, max(len(keys), 1), CONTENT_KEYS_CHUNK_SIZE):
+            chunk = keys[j:j + CONTENT_KEYS_CHUNK_SIZE]
+            if j == 0:
+                q = Q(content_type=None, content_id=None)
+                if chunk:
+                    q |= _get_content_q(chunk)
+            else:
+                q = _get_content_q(chunk)
+
+            for actor_id, group_id, role_id, ctype_id, content_id in PrincipalRoleRelation.objects.filter(
+                principal_q).filter(q).values_list("actor", "group", "role", "content_type", "content_id"):
+                if actor_id is not None:
+                    add([(True, actor_id)], role_id, ctype_id, content_id)
+                else:
+                    add(receivers.get(group_id, ()), role_id, ctype_id, content_id)
+
+    return global_role_ids, local_role_ids
+
+def _get_content_key(obj):
+    """Returns the key (content type id, content id) which identifies the
+    passed object within the generic relations of the permission models.
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    return (ctype.id, str(obj.id))
 
-    _cache_permission(actor, cache_key, result)
+def _get_ancestor_keys(obj):
+    """Returns the content keys of the passed object and all of its ancestors,
+    starting with the object itself. They are loaded from the closure table
+    if the model of the object is registered within ``permissions.hierarchy``.
+    """
+    if permissions.hierarchy.is_registered(obj):
+        keys = permissions.hierarchy.get_ancestor_keys(obj)
+        if keys is not None:
+            return keys
+    return _walk_ancestor_keys(obj)
+
+def _get_ancestor_chains(objs):
+    """Returns the content keys of each of the passed objects and all of its
+    ancestors (like ``_get_ancestor_keys``), in the order of the objects.
+
+    Chains of objects registered within ``permissions.hierarchy`` are loaded
+    from the closure table at once. The others are resolved level by level:
+    models may provide a classmethod ``get_parents_for_permissions(objs)``
+    which returns the parents of all passed objects (None for roots) at once,
+    otherwise ``get_parent_for_permissions()`` is called per object. Chains
+    which have been resolved already are reused for objects sharing ancestors.
+    """
+    chains = {}
+    registered = [obj for obj in objs if permissions.hierarchy.is_registered(obj)]
+    if registered:
+        chains.update(permissions.hierarchy.get_ancestor_chains(registered))
+
+    parent_keys = {}
+    level = []
+    seen = set()
+    for obj in objs:
+        key = _get_content_key(obj)
+        if key not in chains and key not in seen:
+            seen.add(key)
+            level.append(obj)
+
+    while level:
+        next_level = []
+        for obj, parent in zip(level, _get_parents(level)):
+            key = _get_content_key(obj)
+            if parent is None:
+                parent_keys[key] = None
+                continue
+
+            parent_key = _get_content_key(parent)
+            parent_keys[key] = parent_key
+            if parent_key not in chains and parent_key not in seen:
+                seen.add(parent_key)
+                next_level.append(parent)
+        level = next_level
+
+    result = []
+    for obj in objs:
+        key = _get_content_key(obj)
+        if key not in chains:
+            # Collect the keys up to the first ancestor with a known chain
+            keys = []
+            while key is not None and key not in chains:
+                keys.append(key)
+                key = parent_keys.get(key)
+
+            chain = chains.get(key, [])
+            for key in reversed(keys):
+                chain = [key] + chain
+                chains[key] = chain
+
+        result.append(chains[_get_content_key(obj)])
     return result
 
+def _get_parents(objs):
+    """Returns the parents of the passed objects (None for objects without a
+    parent), in the order of the objects. Uses the classmethod
+    ``get_parents_for_permissions`` of the models if they provide it.
+    """
+    objs_by_class = {}
+    for i, obj in enumerate(objs):
+        objs_by_class.setdefault(obj.__class__, []).append((i, obj))
+
+    parents = [None] * len(objs)
+    for cls, items in objs_by_class.items():
+        if hasattr(cls, "get_parents_for_permissions"):
+            for (i, obj), parent in zip(items, cls.get_parents_for_permissions([obj for i, obj in items])):
+                parents[i] = parent
+        else:
+            for i, obj in items:
+                try:
+                    parents[i] = obj.get_parent_for_permissions()
+                except AttributeError:
+                    parents[i] = None
+    return parents
+
+def _walk_ancestor_keys(obj):
+    """Returns the content keys of the passed object and all of its ancestors
+    by calling ``get_parent_for_permissions()`` level by level.
+    """
+    keys = []
+    while obj is not None:
+        keys.append(_get_content_key(obj))
+        try:
+            obj = obj.get_parent_for_permissions()
+        except AttributeError:
+            obj = None
+    return keys
+
+def _get_content_keys(queryset):
+    """Returns the content keys of all rows of the passed queryset as a set.
+    """
+    return set([(ctype_id, str(content_id)) for ctype_id, content_id
+        in queryset.values_list("content_type", "content_id")])
+
+def _get_content_q(keys):
+    """Returns a Q object which matches all rows pointing to one of the passed
+    content keys. Ids are grouped per content type to keep the query short.
+    """
+    ids_by_ctype = {}
+    for ctype_id, content_id in keys:
+        ids_by_ctype.setdefault(ctype_id, []).append(content_id)
+
+    q = None
+    for ctype_id, content_ids in ids_by_ctype.items():
+        ctype_q = Q(content_type=ctype_id, content_id__in=content_ids)
+        if q is None:
+            q = ctype_q
+        else:
+            q |= ctype_q
+    return q
+
+def _get_principal_q(principal):
+    """Returns a Q object which matches all role relations of the passed
+    principal. For an actor this includes the relations of its groups, which
+    are resolved within the same statement.
+    """
+    if isinstance(principal, ActorContext):
+        return Q(actor=principal.id) | Q(group__in=principal.group_ids)
+    elif _is_actor(principal):
+        group_ids = Actor.groups.through.objects.filter(
+            actor=principal).values("actorgroup")
+        return Q(actor=principal) | Q(group__in=group_ids)
+    else:
+        return Q(group=principal)
+
+def _get_role_ids(principal, keys):
+    """Returns the ids of the global roles of the passed principal and of its
+    local roles for all passed content keys with one query.
+    """
+    if isinstance(principal, ActorContext):
+        role_ids = set(principal.global_role_ids)
+        if keys:
+            role_ids.update(PrincipalRoleRelation.objects.filter(_get_principal_q(
+                principal)).filter(_get_content_q(keys)).values_list("role", flat=True))
+        return role_ids
+
+    q = Q(content_type=None, content_id=None)
+    if keys:
+        q |= _get_content_q(keys)
+
+    return set(PrincipalRoleRelation.objects.filter(
+        _get_principal_q(principal)).filter(q).values_list("role", flat=True))
+
+def filter_permitted(queryset, actor, codename, roles=None):
+    """Returns the passed queryset restricted to the objects for which the
+    passed actor has the passed permission.
+
+    The check is pushed down into the SQL of the queryset, so the whole
+    listing needs one query. Models with ``get_parent_for_permissions`` must
+    be registered within ``permissions.hierarchy``, from which inherited
+    permissions are resolved. Otherwise ImproperlyConfigured is raised.
+
+    **Parameters:**
+
+    queryset
+        The queryset which should be filtered. Must not be sliced.
+
+    actor
+        The actor for which the permission should be checked.
+
+    codename
+        The permission's codename which should be checked.
+
+    roles
+        If given these roles will be assigned to the actor temporarily before
+        the permissions are checked.
+    """
+    if roles is None:
+        roles = []
+
+    model = queryset.model
+    hierarchical = permissions.hierarchy.is_registered(model)
+    if not hierarchical and hasattr(model, "get_parent_for_permissions"):
+        raise ImproperlyConfigured("%s must be registered within permissions.hierarchy "
+            "to be filtered by permissions." % model.__name__)
+
+    if permissions.catalog.get_permission_id(codename) is None:
+        return queryset.none()
+
+    if hierarchical:
+        sql, params = _get_permitted_hierarchy_sql(model, actor, codename, roles)
+        return queryset.extra(where=[sql], params=params)
+
+    sql, params = _get_permitted_sql(model, actor, codename, roles)
+    return queryset.extra(where=[sql], params=params)
+
+def prefetch_permissions(queryset, actor, codenames):
+    """Checks the passed permissions for all objects of the passed queryset
+    at once and returns the objects as a list. The codenames the actor has
+    are attached to each object as ``_allowed_perms`` frozenset, from which
+    ``PermissionBase.has_permission`` answers subsequent checks of the
+    actor for these codenames.
+
+    All checks are resolved with a constant number of queries (per chunk of
+    content keys), see ``has_permissions_batch``.
+
+    **Parameters:**
+
+    queryset
+        The queryset (or any iterable) of the objects.
+
+    actor
+        The actor for which the permissions should be checked.
+
+    codenames
+        The codenames of the permissions which should be checked.
+    """
+    objs = list(queryset)
+    codenames = list(set(codenames))
+
+    results = iter(has_permissions_batch(
+        [(actor, obj, codename) for obj in objs for codename in codenames]))
+    for obj in objs:
+        obj._allowed_perms = frozenset(
+            [codename for codename in codenames if results.next()])
+        obj._prefetched_perms = (_get_principal_key(actor), frozenset(codenames))
+    return objs
+
+def get_granted_permission_ids(principal):
+    """Returns the ids of the permissions which the passed actor or group may
+    have for any object, as a set. These are the permissions granted to one
+    of its global roles for any object, and the ones granted to one of its
+    local roles for the object of the local role or one of its descendants
+    within ``permissions.hierarchy``.
+    """
+    global_role_ids = set()
+    local_roles = set()
+    for role_id, ctype_id, content_id in PrincipalRoleRelation.objects.filter(
+        _get_principal_q(principal)).values_list("role", "content_type", "content_id"):
+        if ctype_id is None:
+            global_role_ids.add(role_id)
+        else:
+            local_roles.add((role_id, (ctype_id, str(content_id))))
+
+    permission_ids = set()
+    if global_role_ids:
+        permission_ids.update(ObjectPermission.objects.filter(
+            role__in=global_role_ids).values_list("permission", flat=True).distinct())
+
+    local_role_ids = set([role_id for role_id, key in local_roles]) - global_role_ids
+    if not local_role_ids:
+        return permission_ids
+
+    # Grants to local roles count only below the object of the local role
+    grants = []
+    for role_id, ctype_id, content_id, permission_id in ObjectPermission.objects.filter(
+        role__in=local_role_ids).exclude(permission__in=permission_ids).values_list(
+        "role", "content_type", "content_id", "permission"):
+        grants.append((role_id, (ctype_id, str(content_id)), permission_id))
+
+    ancestor_keys = {}
+    for ctype_id, content_id, ancestor_type_id, ancestor_id in _get_values_for_keys(
+        PermissionAncestor.objects.all(), set([key for role_id, key, permission_id in grants]),
+        "content_type", "content_id", "ancestor_type", "ancestor_id"):
+        ancestor_keys.setdefault((ctype_id, str(content_id)), set()).add((ancestor_type_id, str(ancestor_id)))
+
+    for role_id, key, permission_id in grants:
+        for ancestor_key in ancestor_keys.get(key, set([key])):
+            if (role_id, ancestor_key) in local_roles:
+                permission_ids.add(permission_id)
+                break
+    return permission_ids
+
+def get_permitted_actors(obj, codename, is_active=None, suspended=None):
+    """Returns an iterator over all actors which have the passed permission
+    for the passed object, with the semantics of ``has_permission``.
+
+    The grants along the ancestor chain of the object are resolved to roles
+    and these to the actors which have them directly or via their groups.
+    The distinct actors are then loaded in chunks.
+
+    **Parameters:**
+
+    obj
+        The object for which the actors are returned.
+
+    codename
+        The permission's codename which the actors must have.
+
+    is_active, suspended
+        If given only actors with these values are returned.
+    """
+    permission_id = permissions.catalog.get_permission_id(codename)
+    if permission_id is None:
+        return
+
+    actor_ids = list(_get_holder_ids(obj, permission_id=permission_id).get(permission_id, ()))
+
+    queryset = Actor.objects.all()
+    if is_active is not None:
+        queryset = queryset.filter(is_active=is_active)
+    if suspended is not None:
+        queryset = queryset.filter(suspended=suspended)
+
+    for i in range(0, len(actor_ids), CONTENT_KEYS_CHUNK_SIZE):
+        for actor in queryset.filter(pk__in=actor_ids[i:i + CONTENT_KEYS_CHUNK_SIZE]).iterator():
+            yield actor
+
+def _get_holder_ids(obj, actor_ids=None, permission_id=None):
+    """Returns a dict which maps the ids of the permissions granted along the
+    ancestor chain of the passed object to the ids of the actors which have
+    them for the object, with the semantics of ``has_permission``.
+
+    **Parameters:**
+
+    obj
+        The object for which the holders are returned.
+
+    actor_ids
+        If given only these actors are taken into account.
+
+    permission_id
+        If given only this permission is taken into account.
+    """
+    keys = _get_ancestor_keys(obj)
+
+    grants_qs = ObjectPermission.objects.filter(_get_content_q(keys))
+    blocks_qs = ObjectPermissionInheritanceBlock.objects.filter(_get_content_q(keys))
+    if permission_id is not None:
+        grants_qs = grants_qs.filter(permission=permission_id)
+        blocks_qs = blocks_qs.filter(permission=permission_id)
+
+    grants = {}
+    for ctype_id, content_id, permission_id, role_id in grants_qs.values_list(
+        "content_type", "content_id", "permission", "role"):
+        grants.setdefault((ctype_id, str(content_id)), []).append((permission_id, role_id))
+    if not grants:
+        return {}
+
+    blocks = {}
+    for ctype_id, content_id, permission_id in blocks_qs.values_list(
+        "content_type", "content_id", "permission"):
+        blocks.setdefault((ctype_id, str(content_id)), set()).add(permission_id)
+
+    # The roles which are granted a permission on the object or on an
+    # ancestor up to (including) the first object which blocks it.
+    roles_by_permission = {}
+    stopped = set()
+    for key in keys:
+        for permission_id, role_id in grants.get(key, ()):
+            if permission_id not in stopped:
+                roles_by_permission.setdefault(permission_id, set()).add(role_id)
+        stopped.update(blocks.get(key, ()))
+
+    role_ids = set()
+    for ids in roles_by_permission.values():
+        role_ids.update(ids)
+    if not role_ids:
+        return {}
+
+    prrs = PrincipalRoleRelation.objects.filter(role__in=role_ids).filter(
+        Q(content_type=None, content_id=None) | _get_content_q(keys))
+
+    actors_by_role = {}
+    roles_by_group = {}
+    for actor_id, group_id, role_id in prrs.values_list("actor", "group", "role"):
+        if actor_id is not None:
+            if actor_ids is None or actor_id in actor_ids:
+                actors_by_role.setdefault(role_id, set()).add(actor_id)
+        elif group_id is not None:
+            roles_by_group.setdefault(group_id, set()).add(role_id)
+
+    if roles_by_group:
+        memberships = Actor.groups.through.objects.filter(actorgroup__in=roles_by_group.keys())
+        if actor_ids is not None:
+            memberships = memberships.filter(actor__in=actor_ids)
+        for group_id, actor_id in memberships.values_list("actorgroup", "actor"):
+            for role_id in roles_by_group[group_id]:
+                actors_by_role.setdefault(role_id, set()).add(actor_id)
+
+    holders = {}
+    for permission_id, ids in roles_by_permission.items():
+        for role_id in ids:
+            if role_id in actors_by_role:
+                holders.setdefault(permission_id, set()).update(actors_by_role[role_id])
+    return holders
+
+def _get_values_for_keys(queryset, keys, *fields):
+    """Returns the values of passed fields for all rows of the passed queryset
+    which point to one of the passed content keys. Keys are queried in chunks
+    to stay within the parameter limits of the databases.
+    """
+    keys = list(keys)
+    values = []
+    for i in range(0, len(keys), CONTENT_KEYS_CHUNK_SIZE):
+        chunk = keys[i:i + CONTENT_KEYS_CHUNK_SIZE]
+        values.extend(queryset.filter(_get_content_q(chunk)).values_list(*fields))
+    return values
+
+def _get_principal_sql(actor, roles):
+    """Returns an SQL condition (and its parameters) on the role relations
+    ``prr`` of the passed actor or group, and an SQL condition (and its
+    parameters) which adds the passed temporary roles to the roles of grants
+    ``op``.
+    """
+    if _is_actor(actor):
+        through = Actor.groups.through._meta.db_table
+        principal_sql = "(prr.actor_id = %%s OR prr.group_id IN (SELECT actorgroup_id FROM %s WHERE actor_id = %%s))" % through
+        principal_params = [actor.id, actor.id]
+    else:
+        principal_sql = "prr.group_id = %s"
+        principal_params = [actor.id]
+
+    role_ids = [role.id for role in roles]
+    if role_ids:
+        roles_sql = " OR op.role_id IN (%s)" % ", ".join(["%s"] * len(role_ids))
+    else:
+        roles_sql = ""
+    return principal_sql, principal_params, roles_sql, role_ids
+
+def _get_permitted_sql(model, actor, codename, roles):
+    """Returns an SQL condition (and its parameters) for the passed model
+    which is true for all rows the passed actor has the passed permission for.
+    This covers grants on the object itself only, i.e. it is only complete for
+    models which don't have ancestors.
+    """
+    ctype = ContentType.objects.get_for_model(model)
+    content_id = _get_content_id_sql(model)
+
+    principal_sql, principal_params, roles_sql, role_ids = _get_principal_sql(actor, roles)
+
+    sql = """EXISTS (SELECT 1 FROM %(op)s op
+                     WHERE op.content_type_id = %%s
+                     AND op.content_id = %(content_id)s
+                     AND op.permission_id = %%s
+                     AND (op.role_id IN (SELECT prr.role_id FROM %(prr)s prr
+                                         WHERE %(principal)s
+                                         AND ((prr.content_type_id IS NULL AND prr.content_id IS NULL)
+                                              OR (prr.content_type_id = %%s AND prr.content_id = %(content_id)s)))%(roles)s))""" % {
+        "op": ObjectPermission._meta.db_table,
+        "prr": PrincipalRoleRelation._meta.db_table,
+        "content_id": content_id,
+        "principal": principal_sql,
+        "roles": roles_sql,
+    }
+    params = [ctype.id, permissions.catalog.get_permission_id(codename)] + principal_params + [ctype.id] + role_ids
+    return sql, params
+
+def _get_permitted_hierarchy_sql(model, actor, codename, roles):
+    """Returns an SQL condition (and its parameters) for the passed model
+    which is true for all rows the passed actor has the passed permission for,
+    including permissions inherited from ancestors. The ancestors are taken
+    from the closure table of ``permissions.hierarchy``.
+    """
+    ctype = ContentType.objects.get_for_model(model)
+    content_id = _get_content_id_sql(model)
+    closure = PermissionAncestor._meta.db_table
+
+    principal_sql, principal_params, roles_sql, role_ids = _get_principal_sql(actor, roles)
+
+    # A grant on an ancestor counts, if the actor has the role globally or
+    # locally on any ancestor and no ancestor below the granting one blocks
+    # the permission.
+    sql = """EXISTS (SELECT 1 FROM %(closure)s pa
+                     INNER JOIN %(op)s op ON op.content_type_id = pa.ancestor_type_id AND op.content_id = pa.ancestor_id
+                     WHERE pa.content_type_id = %%s
+                     AND pa.content_id = %(content_id)s
+                     AND op.permission_id = %%s
+                     AND (op.role_id IN (SELECT prr.role_id FROM %(prr)s prr
+                                         WHERE %(principal)s
+                                         AND ((prr.content_type_id IS NULL AND prr.content_id IS NULL)
+                                              OR EXISTS (SELECT 1 FROM %(closure)s pa_role
+                                                         WHERE pa_role.content_type_id = pa.content_type_id
+                                                         AND pa_role.content_id = pa.content_id
+                                                         AND pa_role.ancestor_type_id = prr.content_type_id
+                                                         AND pa_role.ancestor_id = prr.content_id)))%(roles)s)
+                     AND NOT EXISTS (SELECT 1 FROM %(closure)s pa_block
+                                     INNER JOIN %(block)s b ON b.content_type_id = pa_block.ancestor_type_id AND b.content_id = pa_block.ancestor_id
+                                     WHERE pa_block.content_type_id = pa.content_type_id
+                                     AND pa_block.content_id = pa.content_id
+                                     AND pa_block.depth < pa.depth
+                                     AND b.permission_id = op.permission_id))""" % {
+        "closure": closure,
+        "op": ObjectPermission._meta.db_table,
+        "prr": PrincipalRoleRelation._meta.db_table,
+        "block": ObjectPermissionInheritanceBlock._meta.db_table,
+        "content_id": content_id,
+        "principal": principal_sql,
+        "roles": roles_sql,
+    }
+    params = [ctype.id, permissions.catalog.get_permission_id(codename)] + principal_params + role_ids
+    return sql, params
+
+def _get_content_id_sql(model):
+    """Returns the SQL expression of the primary key of the passed model as it
+    is stored within the content_id columns of the permission models.
+    """
+    qn = connection.ops.quote_name
+    column = "%s.%s" % (qn(model._meta.db_table), qn(model._meta.pk.column))
+    return _get_char_sql(column, model._meta.pk)
+
+def _get_char_sql(column, field):
+    """Returns the SQL expression which casts passed column of passed field to
+    a string, unless it is a string already.
+    """
+    if field.get_internal_type() == "CharField":
+        return column
+    elif connection.vendor == "mysql":
+        return "CAST(%s AS CHAR)" % column
+    else:
+        return "CAST(%s AS VARCHAR(32))" % column
+
 # Inheritance ################################################################
 
 def add_inheritance_block(obj, permission):
@@ -436,18 +1812,16 @@ def add_inheritance_block(obj, permission):
         obj
             The content object for which an inheritance block should be added.
     """
-    if not isinstance(permission, Permission):
-        try:
-            permission = Permission.objects.get(codename = permission)
-        except Permission.DoesNotExist:
-            return False
+    permission_id = _get_permission_id(permission)
+    if permission_id is None:
+        return False
 
     ct = ContentType.objects.get_for_model(obj)
     try:
-        ObjectPermissionInheritanceBlock.objects.get(content_type = ct, content_id=obj.id, permission=permission)
+        ObjectPermissionInheritanceBlock.objects.get(content_type = ct, content_id=obj.id, permission=permission_id)
     except ObjectPermissionInheritanceBlock.DoesNotExist:
         try:
-            ObjectPermissionInheritanceBlock.objects.create(content=obj, permission=permission)
+            ObjectPermissionInheritanceBlock.objects.create(content=obj, permission_id=permission_id)
         except IntegrityError:
             return False
     return True
@@ -465,15 +1839,13 @@ def remove_inheritance_block(obj, permission):
         The permission for which an inheritance block should be removed.
         Either a permission object or the codename of a permission.
     """
-    if not isinstance(permission, Permission):
-        try:
-            permission = Permission.objects.get(codename = permission)
-        except Permission.DoesNotExist:
-            return False
+    permission_id = _get_permission_id(permission)
+    if permission_id is None:
+        return False
 
     ct = ContentType.objects.get_for_model(obj)
     try:
-        opi = ObjectPermissionInheritanceBlock.objects.get(content_type = ct, content_id=obj.id, permission=permission)
+        opi = ObjectPermissionInheritanceBlock.objects.get(content_type = ct, content_id=obj.id, permission=permission_id)
     except ObjectPermissionInheritanceBlock.DoesNotExist:
         return False
 
@@ -492,10 +1864,14 @@ def is_inherited(obj, codename):
         The permission which should be checked. Must be the codename of the 
         permission.
     """
+    permission_id = permissions.catalog.get_permission_id(codename)
+    if permission_id is None:
+        return True
+
     ct = ContentType.objects.get_for_model(obj)
     try:
         ObjectPermissionInheritanceBlock.objects.get(
-            content_type=ct, content_id=obj.id, permission__codename = codename)
+            content_type=ct, content_id=obj.id, permission=permission_id)
     except ObjectDoesNotExist:
         return True
     else:
@@ -510,11 +1886,7 @@ def get_group_by_id(id):
 def get_group(name):
     """Returns the group with passed group name.
     """
-    
-    try:
-        return ActorGroup.objects.get(name=name)
-    except ActorGroup.DoesNotExist:
-        return None
+    return _get_by_catalog_id(ActorGroup, name, permissions.catalog.get_group_id)
 
 
 
@@ -545,15 +1917,54 @@ def get_role(name):
         except Role.DoesNotExist:
             return None
     else:
-        try:
-            return Role.objects.get(name=name)
-        except Role.DoesNotExist:
+        return _get_by_catalog_id(Role, name, permissions.catalog.get_role_id)
+
+def _get_by_catalog_id(model, name, get_id):
+    """Returns the object of passed model with passed name or None. It is
+    read by the id from the catalog. If the object has been renamed or deleted
+    by another process meanwhile, its entry is dropped and the name is looked
+    up once more.
+    """
+    for i in range(2):
+        id = get_id(name)
+        if id is None:
             return None
+        try:
+            obj = model._default_manager.get(pk=id)
+        except model.DoesNotExist:
+            obj = None
+        if obj is not None and obj.name == name:
+            return obj
+        permissions.catalog.discard(model, name)
+    return None
 
 
 def get_actors(user):
     return Actor.objects.filter(user=user)
 
+def get_actor_context(actor):
+    """Returns an ``ActorContext`` for the passed actor, i.e. loads the ids of
+    its groups and of its global roles (including the ones of its groups).
+    Pass it to the utils instead of the actor to save these queries for the
+    remaining request.
+
+    **Parameters:**
+
+    actor
+        The actor for which the context is returned.
+    """
+    if isinstance(actor, ActorContext):
+        return actor
+    return ActorContext(actor, _load_actor_context)
+
+def _load_actor_context(actor):
+    """Returns the ids of the groups and of the global roles of the passed
+    actor, see ``ActorContext``.
+    """
+    group_ids = Actor.groups.through.objects.filter(
+        actor=actor).values_list("actorgroup", flat=True)
+    return group_ids, get_role_ids(actor)
+
 def get_actor_by_id(id):
     try:
         return Actor.objects.get(id=id)
@@ -724,40 +2135,3 @@ def unregister_group(name):
 
     group.delete()
     return True
-
-def _cache_permission(actor, cache_key, data):
-    """Stores the passed data on the passed actor object.
-
-    **Parameters:**
-
-    actor
-        The actor on which the data is stored.
-
-    cache_key
-        The key under which the data is stored.
-
-    data
-        The data which is stored.
-    """
-    if not getattr(actor, "permissions", None):
-        actor.permissions = {}
-    actor.permissions[cache_key] = data
-
-def _get_cached_permission(actor, cache_key):
-    """Returns the stored data from passed actor object for passed cache_key.
-
-    **Parameters:**
-
-    actor
-        The actor from which the data is retrieved.
-
-    cache_key
-        The key under which the data is stored.
-
-    """
-    permissions = getattr(actor, "permissions", None)
-    if permissions:
-        logging.error("get_cached_permissions: got permissions %s" % (permissions))
-        return actor.permissions.get(cache_key, None)
-    else:
-        logging.error("don't got no permissions")
\ No newline at end of file